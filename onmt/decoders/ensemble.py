@@ -89,14 +89,16 @@ class EnsembleGenerator(nn.Module):
         self.model_generators = nn.ModuleList(model_generators)
         self._raw_probs = raw_probs
 
-    def forward(self, hidden, attn=None, src_map=None):
+    def forward(self, hidden, attn=None, src_map=None,
+                dynamic_dict_size=None):
         """
         Compute a distribution over the target dictionary
         by averaging distributions from models in the ensemble.
         All models in the ensemble must share a target vocabulary.
         """
         distributions = torch.stack(
-                [mg(h) if attn is None else mg(h, attn, src_map)
+                [mg(h) if attn is None
+                 else mg(h, attn, src_map, dynamic_dict_size)
                  for h, mg in zip(hidden, self.model_generators)]
             )
         if self._raw_probs:
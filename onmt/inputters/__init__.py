@@ -5,17 +5,25 @@ e.g., from a line of text to a sequence of embeddings.
 """
 from onmt.inputters.inputter import make_features, collect_features, \
     load_fields_from_vocab, get_fields, OrderedIterator, \
-    save_fields_to_vocab, build_dataset, build_vocab
+    save_fields_to_vocab, build_dataset, build_vocab, count_tokens, \
+    max_src_tok_len
 from onmt.inputters.dataset_base import DatasetBase, PAD_WORD, BOS_WORD, \
     EOS_WORD
 from onmt.inputters.text_dataset import TextDataset
 from onmt.inputters.image_dataset import ImageDataset
 from onmt.inputters.audio_dataset import AudioDataset
+from onmt.inputters.mmap_dataset import MmapDataset, MmapIterator, \
+    write_mmap_shard, numericalize_mmap_shard
+from onmt.inputters.batching import plan_batches
+from onmt.inputters.vocab import CompactVocab
 
 
 __all__ = ['PAD_WORD', 'BOS_WORD', 'EOS_WORD', 'DatasetBase',
            'make_features', 'collect_features',
            'load_fields_from_vocab', 'get_fields',
            'save_fields_to_vocab', 'build_dataset',
-           'build_vocab', 'OrderedIterator',
-           'TextDataset', 'ImageDataset', 'AudioDataset']
+           'build_vocab', 'count_tokens', 'max_src_tok_len',
+           'OrderedIterator',
+           'TextDataset', 'ImageDataset', 'AudioDataset',
+           'MmapDataset', 'MmapIterator', 'write_mmap_shard',
+           'numericalize_mmap_shard', 'plan_batches', 'CompactVocab']
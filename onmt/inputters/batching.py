@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Batch planning on arrays of example lengths.
+
+The planner reproduces the batches of `OrderedIterator` with the
+`max_tok_len` batch size function, but works on numpy arrays of source and
+target lengths: it costs one numpy call per batch instead of one Python
+call per example, and keeps no global state.
+"""
+
+import numpy as np
+
+
+def token_costs(src_lens, tgt_lens):
+    """
+    Padded length of each example, as counted by `max_tok_len`:
+    <bos> w1 ... wN <eos> on the source side, w1 ... wN <eos> on the target
+    side.
+    """
+    return np.maximum(np.asarray(src_lens) + 2, np.asarray(tgt_lens) + 1)
+
+
+def split_batches(src_lens, tgt_lens, batch_size, token_batching=False):
+    """
+    Cut examples, in the given order, into consecutive batches.
+
+    Args:
+        src_lens, tgt_lens: arrays of example lengths.
+        batch_size (int): number of examples per batch or, with
+            `token_batching`, maximum number of padded tokens per batch
+            (a batch always holds at least one example).
+        token_batching (bool): count `batch_size` in padded tokens.
+
+    Returns:
+        List of int64 arrays of positions in `src_lens`.
+    """
+    n = len(src_lens)
+    if not token_batching:
+        return np.split(np.arange(n, dtype=np.int64),
+                        np.arange(batch_size, n, batch_size))
+    costs = token_costs(src_lens, tgt_lens)
+    batches = []
+    start = 0
+    while start < n:
+        # the first example bounds the number of examples in the batch
+        window = costs[start:start + max(1, batch_size // costs[start])]
+        padded = np.maximum.accumulate(window) * \
+            np.arange(1, len(window) + 1)
+        fits = int(np.searchsorted(padded, batch_size, side='right'))
+        end = start + max(1, fits)
+        batches.append(np.arange(start, end, dtype=np.int64))
+        start = end
+    return batches
+
+
+def plan_batches(src_lens, tgt_lens, batch_size, token_batching=False,
+                 pool_factor=100, seed=None):
+    """
+    Plan the batches of a shard the way `OrderedIterator` does.
+
+    Without a `seed` examples keep the corpus order (validation). With a
+    `seed`, examples are shuffled, sorted by (src, tgt) length within pools
+    of `pool_factor * batch_size` examples, and the batches of each pool
+    are shuffled: the plan only depends on the lengths and the seed.
+
+    Returns:
+        List of int64 arrays of example indices.
+    """
+    src_lens = np.asarray(src_lens)
+    tgt_lens = np.asarray(tgt_lens)
+    n = len(src_lens)
+    if seed is None:
+        return split_batches(src_lens, tgt_lens, batch_size, token_batching)
+    rng = np.random.RandomState(seed)
+    perm = rng.permutation(n)
+    pool_size = batch_size * pool_factor
+    plan = []
+    for p in range(0, n, pool_size):
+        pool = perm[p:p + pool_size]
+        pool = pool[np.lexsort((tgt_lens[pool], src_lens[pool]))]
+        batches = split_batches(src_lens[pool], tgt_lens[pool], batch_size,
+                                token_batching)
+        plan.extend(pool[batches[j]] for j in rng.permutation(len(batches)))
+    return plan
+
+
+def padding_stats(src_lens, tgt_lens, batches):
+    """
+    Real and padded tokens of `batches`, as counted by `Statistics`: the
+    source as is, the target with its <eos> (<bos> is only fed to the
+    decoder).
+
+    Returns:
+        (src_words, src_padded, tgt_words, tgt_padded)
+    """
+    src_lens = np.asarray(src_lens)
+    tgt_lens = np.asarray(tgt_lens) + 1
+    if not batches:
+        return 0, 0, 0, 0
+    sizes = np.array([len(b) for b in batches])
+    idx = np.concatenate(batches)
+    # batch maxima with one reduceat over the concatenated batches
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    src_max = np.maximum.reduceat(src_lens[idx], starts)
+    tgt_max = np.maximum.reduceat(tgt_lens[idx], starts)
+    return (int(src_lens[idx].sum()), int((src_max * sizes).sum()),
+            int(tgt_lens[idx].sum()), int((tgt_max * sizes).sum()))
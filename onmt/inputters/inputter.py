@@ -2,20 +2,33 @@
 import glob
 import os
 import codecs
+import random
+import threading
+import time
 
 from collections import Counter, defaultdict, OrderedDict
-from itertools import count, cycle
+from itertools import count, cycle, islice
 from functools import partial
+try:
+    from queue import Queue, Full
+except ImportError:  # python 2
+    from Queue import Queue, Full
 
+import numpy as np
 import torch
 import torchtext.data
 from torchtext.data import Field
+from torchtext.data.utils import RandomShuffler
 from torchtext.vocab import Vocab
 
 from onmt.inputters.dataset_base import PAD_WORD, BOS_WORD, EOS_WORD
 from onmt.inputters.text_dataset import TextDataset
 from onmt.inputters.image_dataset import ImageDataset
 from onmt.inputters.audio_dataset import AudioDataset
+from onmt.inputters.batching import split_batches
+from onmt.inputters.mmap_dataset import MmapDataset, MmapIterator, \
+    MMAP_SUFFIX
+from onmt.inputters.vocab import CompactVocab
 from onmt.utils.logging import logger
 
 import gc
@@ -35,13 +48,15 @@ Vocab.__setstate__ = _setstate
 
 
 def make_src(data, vocab):
+    """
+    Batch the dynamic dict index of each source word as a
+    `[src_len, batch]` LongTensor, padded with the <blank> index (1).
+    """
     src_size = max([t.size(0) for t in data])
-    src_vocab_size = max([t.max() for t in data]) + 1
-    alignment = torch.zeros(src_size, len(data), src_vocab_size)
+    src_map = torch.ones(src_size, len(data), dtype=torch.long)
     for i, sent in enumerate(data):
-        for j, t in enumerate(sent):
-            alignment[j, i, t] = 1
-    return alignment
+        src_map[:sent.size(0), i] = sent
+    return src_map
 
 
 def make_tgt(data, vocab):
@@ -109,7 +124,7 @@ def get_fields(src_data_type, n_src_features, n_tgt_features):
     else:
         # everything except audio has src_map and alignment
         fields["src_map"] = Field(
-            use_vocab=False, dtype=torch.float,
+            use_vocab=False, dtype=torch.long,
             postprocessing=make_src, sequential=False)
 
         fields["alignment"] = Field(
@@ -132,7 +147,8 @@ def get_fields(src_data_type, n_src_features, n_tgt_features):
 
 def load_fields_from_vocab(vocab, data_type="text"):
     """
-    vocab: a list of (field name, torchtext.vocab.Vocab) pairs
+    vocab: a list of (field name, vocab) pairs, with `CompactVocab` or
+           torchtext.vocab.Vocab vocabs
     data_type: text, img, or audio
     returns: a dictionary whose keys are the field names and whose values
              are field objects with the vocab set to the corresponding vocab
@@ -152,9 +168,9 @@ def save_fields_to_vocab(fields):
     fields: a dictionary whose keys are field names and whose values are
             Field objects
     returns: a list of (field name, vocab) pairs for the fields that have a
-             vocabulary
+             vocabulary, as `CompactVocab`s
     """
-    return [(k, f.vocab) for k, f in fields.items()
+    return [(k, CompactVocab.from_vocab(f.vocab)) for k, f in fields.items()
             if f is not None and 'vocab' in f.__dict__]
 
 
@@ -276,9 +292,49 @@ def _build_field_vocab(field, counter, **kwargs):
     field.vocab = field.vocab_cls(counter, specials=specials, **kwargs)
 
 
+def count_tokens(examples, fields):
+    """
+    Count the tokens of every sequential field over some examples.
+
+    Args:
+        examples: iterable of torchtext Examples.
+        fields (dict): fields of the examples.
+
+    Returns:
+        Dict of `Counter`s, one per sequential field. Counters of
+        different shards can be merged with `Counter.update`.
+    """
+    counters = {k: Counter() for k in fields if fields[k].sequential}
+    for ex in examples:
+        for k, counter in counters.items():
+            val = getattr(ex, k, None)
+            if val is not None:
+                counter.update(val)
+    return counters
+
+
+def count_shard_tokens(path, fields):
+    """
+    Count the tokens of a dataset shard saved by preprocess.py.
+
+    Args:
+        path: path of a .pt or memory-mapped shard.
+        fields (dict): fields of the shard.
+
+    Returns:
+        Dict of `Counter`s, as `count_tokens`.
+    """
+    if path.endswith(MMAP_SUFFIX):
+        # memory-mapped shards carry their own token counts
+        dataset = MmapDataset(path)
+        return {k: dataset.counter(k) for k in dataset.field_names}
+    return count_tokens(torch.load(path).examples, fields)
+
+
 def build_vocab(train_dataset_files, fields, data_type, share_vocab,
                 src_vocab_path, src_vocab_size, src_words_min_frequency,
-                tgt_vocab_path, tgt_vocab_size, tgt_words_min_frequency):
+                tgt_vocab_path, tgt_vocab_size, tgt_words_min_frequency,
+                counters=None):
     """
     Args:
         train_dataset_files: a list of train dataset pt file.
@@ -293,6 +349,9 @@ def build_vocab(train_dataset_files, fields, data_type, share_vocab,
         tgt_vocab_size(int): size of the target vocabulary.
         tgt_words_min_frequency(int): the minimum frequency needed to
                 include a target word in the vocabulary.
+        counters (dict): token `Counter`s of the train data, as counted
+                while building the shards. When given,
+                `train_dataset_files` are not read again.
 
     Returns:
         Dict of Fields
@@ -300,6 +359,7 @@ def build_vocab(train_dataset_files, fields, data_type, share_vocab,
     # Prop src from field to get lower memory using when training with image
     if data_type == 'img' or data_type == 'audio':
         fields.pop("src")
+    data_counters = counters
     counters = {k: Counter() for k in fields}
 
     # Load vocabulary
@@ -323,25 +383,19 @@ def build_vocab(train_dataset_files, fields, data_type, share_vocab,
     else:
         tgt_vocab = None
 
-    for i, path in enumerate(train_dataset_files):
-        dataset = torch.load(path)
-        logger.info(" * reloading %s." % path)
-        for ex in dataset.examples:
-            for k in fields:
-                has_vocab = (k == 'src' and src_vocab) or \
-                    (k == 'tgt' and tgt_vocab)
-                if fields[k].sequential and not has_vocab:
-                    val = getattr(ex, k, None)
-                    counters[k].update(val)
-
-        # Drop the none-using from memory but keep the last
-        if i < len(train_dataset_files) - 1:
-            dataset.examples = None
-            gc.collect()
-            del dataset.examples
-            gc.collect()
-            del dataset
-            gc.collect()
+    def update_counters(shard_counters):
+        for k, counter in shard_counters.items():
+            has_vocab = (k == 'src' and src_vocab) or \
+                (k == 'tgt' and tgt_vocab)
+            if k in counters and fields[k].sequential and not has_vocab:
+                counters[k].update(counter)
+
+    if data_counters is not None:
+        update_counters(data_counters)
+    else:
+        for path in train_dataset_files:
+            logger.info(" * counting tokens of %s." % path)
+            update_counters(count_shard_tokens(path, fields))
 
     _build_field_vocab(
         fields["tgt"], counters["tgt"],
@@ -417,26 +471,94 @@ def load_vocabulary(vocab_path, tag):
 
 
 class OrderedIterator(torchtext.data.Iterator):
+    """
+    Args:
+        stride (int), offset (int): only build batches `offset`,
+            `offset + stride`, ... of the batches planned for the dataset,
+            e.g. the share of one of `stride` distributed ranks.
+        pool_factor (int): training examples are sorted by length within
+            pools of `pool_factor * batch_size` examples.
+        See `torchtext.data.Iterator` for the other arguments.
+    """
+
+    def __init__(self, *args, **kwargs):
+        stride = kwargs.pop('stride', 1)
+        offset = kwargs.pop('offset', 0)
+        pool_factor = kwargs.pop('pool_factor', 100)
+        super(OrderedIterator, self).__init__(*args, **kwargs)
+        self.stride = stride
+        self.offset = offset
+        self.pool_factor = pool_factor
+
+    def _split(self, examples):
+        """ Cut sorted training examples into batches. """
+        if self.batch_size_fn is not max_tok_len:
+            return torchtext.data.batch(
+                examples, self.batch_size, self.batch_size_fn)
+        # plan token batches on length arrays rather than calling
+        # max_tok_len once per example
+        src_lens = np.array([len(ex.src) for ex in examples])
+        tgt_lens = np.array([len(ex.tgt) for ex in examples])
+        return [[examples[i] for i in idx] for idx in split_batches(
+            src_lens, tgt_lens, self.batch_size, token_batching=True)]
 
     def create_batches(self):
         """ Create batches """
         if self.train:
             def _pool(data, random_shuffler):
-                for p in torchtext.data.batch(data, self.batch_size * 100):
-                    p_batch = torchtext.data.batch(
-                        sorted(p, key=self.sort_key),
-                        self.batch_size, self.batch_size_fn)
+                for p in torchtext.data.batch(
+                        data, self.batch_size * self.pool_factor):
+                    p_batch = self._split(sorted(p, key=self.sort_key))
                     for b in random_shuffler(list(p_batch)):
                         yield b
 
-            self.batches = _pool(self.data(), self.random_shuffler)
+            self.batches = islice(
+                _pool(self.data(), self.random_shuffler),
+                self.offset, None, self.stride)
         else:
             self.batches = []
-            for b in torchtext.data.batch(self.data(), self.batch_size,
-                                          self.batch_size_fn):
+            # torchtext yields an empty batch before an example that
+            # alone exceeds a token batch_size
+            batches = (b for b in torchtext.data.batch(
+                self.data(), self.batch_size, self.batch_size_fn) if b)
+            for b in islice(batches, self.offset, None, self.stride):
                 self.batches.append(sorted(b, key=self.sort_key))
 
 
+# torchtext shufflers swap the global `random` state in and out
+_random_lock = threading.Lock()
+
+
+class _LockedShuffler(RandomShuffler):
+    """ A `RandomShuffler` that can be used from several threads. """
+
+    def __call__(self, data):
+        with _random_lock:
+            return super(_LockedShuffler, self).__call__(data)
+
+
+_SHARD_END = object()
+_WORKER_END = object()
+
+
+def _move_batch(batch, device, pin_memory=False):
+    """ Pin and/or move the tensors of `batch` to `device` in place. """
+    for name in batch.fields:
+        data = getattr(batch, name, None)
+        if isinstance(data, tuple):
+            setattr(batch, name, tuple(
+                _move_tensor(t, device, pin_memory) for t in data))
+        elif isinstance(data, torch.Tensor):
+            setattr(batch, name, _move_tensor(data, device, pin_memory))
+    return batch
+
+
+def _move_tensor(tensor, device, pin_memory):
+    if pin_memory:
+        tensor = tensor.pin_memory()
+    return tensor.to(device, non_blocking=True)
+
+
 class DatasetLazyIter(object):
     """
     dataset_paths: a list containing the locations of datasets
@@ -445,41 +567,169 @@ class DatasetLazyIter(object):
     batch_size_fn: custom batch process function.
     device: the GPU device.
     is_train (bool): train or valid?
+    num_workers (int): number of background threads loading shards and
+        building their batches ahead of the consumer. 0 does everything
+        on the consumer's thread.
+    prefetch_batches (int): batches each worker may build ahead.
+    pin_memory (bool): build prefetched batches in pinned memory before
+        copying them to `device`.
+    stride (int), offset (int): only build batches `offset`,
+        `offset + stride`, ... of each shard. Distributed ranks use them to
+        read disjoint batches instead of discarding the others' batches.
+    pool_factor (int): training examples are sorted by length within
+        pools of `pool_factor * batch_size` examples.
+    seed (int): the i-th shard read is shuffled with `seed + i`. Ranks
+        sharing a `stride` must use the same seed, or they plan different
+        batches. None draws it from python's `random` on each iteration.
+
+    `wait_time` accumulates the seconds the consumer spent blocked on
+    prefetching workers.
     """
 
     def __init__(self, dataset_paths, fields, batch_size, batch_size_fn,
-                 device, is_train):
+                 device, is_train, num_workers=0, prefetch_batches=32,
+                 pin_memory=False, stride=1, offset=0, pool_factor=100,
+                 seed=None):
         self._paths = dataset_paths
         self.fields = fields
         self.batch_size = batch_size
         self.batch_size_fn = batch_size_fn
         self.device = device
         self.is_train = is_train
+        self.num_workers = num_workers
+        self.prefetch_batches = prefetch_batches
+        self.pin_memory = pin_memory
+        self.stride = stride
+        self.offset = offset
+        self.pool_factor = pool_factor
+        self.seed = seed
+        self.wait_time = 0.
+
+    def _iter_dataset(self, path, device, seed=None):
+        """
+        Batches of the shard at `path`. A `seed` makes the shuffling of
+        the shard independent of the global random state.
+        """
+        if path.endswith(MMAP_SUFFIX):
+            cur_dataset = MmapDataset(path)
+            logger.info('Mapping dataset from %s, number of examples: %d'
+                        % (path, len(cur_dataset)))
+            cur_iter = MmapIterator(
+                cur_dataset, self.fields, self.batch_size,
+                token_batching=self.batch_size_fn is max_tok_len,
+                device=device, train=self.is_train, seed=seed,
+                stride=self.stride, offset=self.offset,
+                pool_factor=self.pool_factor)
+            for batch in cur_iter:
+                yield batch
+            return
+        cur_dataset = torch.load(path)
+        logger.info('Loading dataset from %s, number of examples: %d' %
+                    (path, len(cur_dataset)))
+        cur_dataset.fields = self.fields
+        cur_iter = OrderedIterator(
+            dataset=cur_dataset,
+            batch_size=self.batch_size,
+            batch_size_fn=self.batch_size_fn,
+            device=device,
+            train=self.is_train,
+            sort=False,
+            sort_within_batch=True,
+            repeat=False,
+            stride=self.stride,
+            offset=self.offset,
+            pool_factor=self.pool_factor
+        )
+        if seed is not None:
+            cur_iter.random_shuffler = _LockedShuffler(
+                random.Random(seed).getstate())
+        for batch in cur_iter:
+            yield batch
+
+        cur_dataset.examples = None
+        gc.collect()
+        del cur_dataset
+        gc.collect()
 
     def __iter__(self):
+        if self.num_workers > 0:
+            for batch in self._prefetch():
+                yield batch
+            return
+        base_seed = self._base_seed()
         paths = cycle(self._paths) if self.is_train else self._paths
-        for path in paths:
-            cur_dataset = torch.load(path)
-            logger.info('Loading dataset from %s, number of examples: %d' %
-                        (path, len(cur_dataset)))
-            cur_dataset.fields = self.fields
-            cur_iter = OrderedIterator(
-                dataset=cur_dataset,
-                batch_size=self.batch_size,
-                batch_size_fn=self.batch_size_fn,
-                device=self.device,
-                train=self.is_train,
-                sort=False,
-                sort_within_batch=True,
-                repeat=False
-            )
-            for batch in cur_iter:
+        for j, path in enumerate(paths):
+            for batch in self._iter_dataset(
+                    path, self.device, seed=base_seed + j):
                 yield batch
 
-            cur_dataset.examples = None
-            gc.collect()
-            del cur_dataset
-            gc.collect()
+    def _base_seed(self):
+        # drawn here rather than during the shuffles, which keeps -seed
+        # runs reproducible whatever the scheduling of the workers
+        if self.seed is not None:
+            return self.seed
+        return random.randint(0, 2 ** 31 - 1)
+
+    def _prefetch(self):
+        """
+        Deal the shards out to `num_workers` threads, round-robin, and
+        yield their batches in the same order as without workers.
+        Batches are built on CPU and copied to `device` here.
+        """
+        base_seed = self._base_seed()
+        stop = threading.Event()
+        queues = [Queue(self.prefetch_batches)
+                  for _ in range(self.num_workers)]
+
+        def put(queue, item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return
+                except Full:
+                    pass
+
+        def work(k):
+            paths = cycle(self._paths) if self.is_train else self._paths
+            shards = islice(enumerate(paths), k, None, self.num_workers)
+            try:
+                for j, path in shards:
+                    for batch in self._iter_dataset(
+                            path, "cpu", seed=base_seed + j):
+                        if self.pin_memory:
+                            batch = _move_batch(batch, "cpu", True)
+                        put(queues[k], batch)
+                        if stop.is_set():
+                            return
+                    put(queues[k], (_SHARD_END, path))
+            except Exception as e:
+                put(queues[k], e)
+            put(queues[k], _WORKER_END)
+
+        for k in range(self.num_workers):
+            worker = threading.Thread(target=work, args=(k,))
+            worker.daemon = True
+            worker.start()
+        try:
+            shard_wait = 0.
+            for k in cycle(range(self.num_workers)):
+                while True:
+                    start = time.time()
+                    item = queues[k].get()
+                    shard_wait += time.time() - start
+                    if item is _WORKER_END:
+                        return
+                    if isinstance(item, Exception):
+                        raise item
+                    if isinstance(item, tuple) and item[0] is _SHARD_END:
+                        logger.info('Waited %.2f sec on data for %s'
+                                    % (shard_wait, item[1]))
+                        self.wait_time += shard_wait
+                        shard_wait = 0.
+                        break
+                    yield _move_batch(item, self.device)
+        finally:
+            stop.set()
 
 
 def max_tok_len(new, count, sofar):
@@ -488,39 +738,53 @@ def max_tok_len(new, count, sofar):
     such that the total number of src/tgt tokens (including padding)
     in a batch <= batch_size
     """
-    # Maintains the longest src and tgt length in the current batch
-    global max_src_in_batch, max_tgt_in_batch
-    # Reset current longest length at a new batch (count=1)
-    if count == 1:
-        max_src_in_batch = 0
-        max_tgt_in_batch = 0
-    # Src: <bos> w1 ... wN <eos>
-    max_src_in_batch = max(max_src_in_batch, len(new.src) + 2)
-    # Tgt: w1 ... wN <eos>
-    max_tgt_in_batch = max(max_tgt_in_batch, len(new.tgt) + 1)
-    src_elements = count * max_src_in_batch
-    tgt_elements = count * max_tgt_in_batch
-    return max(src_elements, tgt_elements)
+    # `sofar` is count - 1 times the longest padded length of the batch
+    longest = sofar // (count - 1) if count > 1 else 0
+    # Src: <bos> w1 ... wN <eos>, Tgt: w1 ... wN <eos>
+    return count * max(longest, len(new.src) + 2, len(new.tgt) + 1)
 
 
-def build_dataset_iter(corpus_type, fields, opt, is_train=True):
+def max_src_tok_len(new, count, sofar):
+    """
+    Token batching for translation: the number of sequences is limited
+    such that the number of src tokens (including padding) in a batch
+    <= batch_size.
+    """
+    longest = sofar // (count - 1) if count > 1 else 0
+    return count * max(longest, len(new.src))
+
+
+def build_dataset_iter(corpus_type, fields, opt, is_train=True,
+                       stride=1, offset=0, seed=None):
     """
     This returns user-defined train/validate data iterator for the trainer
     to iterate over. We implement simple ordered iterator strategy here,
     but more sophisticated strategy like curriculum learning is ok too.
+
+    With `stride` > 1 the iterator only yields the batches of rank `offset`
+    out of `stride`, which must all pass the same shuffling `seed` (see
+    `DatasetLazyIter`).
     """
     dataset_paths = sorted(glob.glob(opt.data + '.' + corpus_type + '*.pt'))
+    if not dataset_paths:
+        dataset_paths = sorted(
+            glob.glob(opt.data + '.' + corpus_type + '*' + MMAP_SUFFIX))
     batch_size = opt.batch_size if is_train else opt.valid_batch_size
     batch_fn = max_tok_len if is_train and opt.batch_type == "tokens" else None
 
     device = "cuda" if opt.gpu_ranks else "cpu"
 
     return DatasetLazyIter(dataset_paths, fields, batch_size, batch_fn,
-                           device, is_train)
+                           device, is_train,
+                           num_workers=opt.prefetch_workers,
+                           prefetch_batches=opt.prefetch_batches,
+                           pin_memory=opt.pin_memory and device == "cuda",
+                           stride=stride, offset=offset,
+                           pool_factor=opt.pool_factor, seed=seed)
 
 
 def load_fields(dataset, opt, checkpoint):
-    if isinstance(dataset, TextDataset):
+    if isinstance(dataset, (TextDataset, MmapDataset)):
         data_type = 'text'
     elif isinstance(dataset, AudioDataset):
         data_type = 'audio'
@@ -534,7 +798,10 @@ def load_fields(dataset, opt, checkpoint):
 
     fields = load_fields_from_vocab(vocab, data_type)
 
-    ex_fields = dataset.examples[0].__dict__
+    if isinstance(dataset, MmapDataset):
+        ex_fields = dataset.field_names + ['indices']
+    else:
+        ex_fields = dataset.examples[0].__dict__
     fields = {k: f for k, f in fields.items() if k in ex_fields}
 
     if data_type == 'text':
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped shard format for text corpora.
+
+A shard is a single binary file made of a small JSON header followed by
+flat numpy arrays:
+
+    * `<side>.offsets` (int64, n_examples + 1): start of each example in
+      the token arrays of that side ("src" or "tgt"),
+    * `<name>` (int32): the concatenated token ids of the field `name`
+      ("src", "src_feat_0", ..., "tgt", "tgt_feat_0", ...),
+    * `<name>.types` (uint8) and `<name>.counts` (int64): the table of the
+      token types seen in the shard and their frequencies,
+    * `indices` (int64): position of each example in the shard.
+
+Shards are first written with ids relative to their own type table, which
+gives the token counts needed to build the vocabulary for free. Once the
+vocabulary is known, `numericalize_mmap_shard` rewrites the ids in place
+so that training can `np.memmap` the arrays and build batches without any
+per-example Python object or unpickling.
+"""
+
+import json
+import random
+import struct
+from array import array
+from collections import Counter
+from itertools import islice
+
+import numpy as np
+import torch
+
+from onmt.inputters.batching import plan_batches
+from onmt.inputters.text_dataset import TextDataset
+
+MMAP_MAGIC = b'ONMTMMAP'
+MMAP_SUFFIX = '.bin'
+_HEADER_ALIGN = 4096
+
+
+def _side(name):
+    return name.split('_feat_')[0]
+
+
+def _write_header(f, header, reserved=None):
+    header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+    if reserved is None:
+        # leave room for the header to grow when the shard is numericalized
+        reserved = len(header_bytes) + 1024
+        reserved += -(len(MMAP_MAGIC) + 8 + reserved) % _HEADER_ALIGN
+    assert len(header_bytes) <= reserved, "mmap header overflow"
+    f.write(MMAP_MAGIC)
+    f.write(struct.pack('<Q', reserved))
+    f.write(header_bytes.ljust(reserved))
+    return reserved
+
+
+def _read_header(f):
+    magic = f.read(len(MMAP_MAGIC))
+    if magic != MMAP_MAGIC:
+        raise ValueError("%s is not a memory-mapped onmt shard" % f.name)
+    reserved, = struct.unpack('<Q', f.read(8))
+    header = json.loads(f.read(reserved).decode('utf-8'))
+    return header, reserved
+
+
+def write_mmap_shard(path, src, tgt, src_seq_length_trunc=0,
+                     tgt_seq_length_trunc=0, filter_pred=None):
+    """
+    Tokenize a text shard and write it to `path` in the memory-mapped format.
+
+    Args:
+        path (str): destination file.
+        src (list of str): source lines.
+        tgt (list of str): target lines, aligned with `src`.
+        src_seq_length_trunc (int): truncate source sequences (0: no).
+        tgt_seq_length_trunc (int): truncate target sequences (0: no).
+        filter_pred: predicate called with an object having `src` and
+            `tgt` attributes, used to drop examples (see `filter_example`).
+
+    Returns:
+        A dict mapping each written field name to a `Counter` of its
+        tokens in this shard.
+    """
+    src_examples = TextDataset.make_examples(src, src_seq_length_trunc, "src")
+    tgt_examples = TextDataset.make_examples(tgt, tgt_seq_length_trunc, "tgt")
+
+    tables = {}
+    counts = {}
+    tokens = {}
+    offsets = {"src": [0], "tgt": [0]}
+    indices = array('q')
+
+    for src_ex, tgt_ex in zip(src_examples, tgt_examples):
+        example = dict(src_ex, **tgt_ex)
+        if filter_pred is not None and \
+                not filter_pred(_LengthView(example["src"], example["tgt"])):
+            continue
+        indices.append(example["indices"])
+        for name, words in example.items():
+            if name == "indices":
+                continue
+            if name not in tables:
+                tables[name] = {}
+                counts[name] = array('q')
+                tokens[name] = array('i')
+            table, count, ids = tables[name], counts[name], tokens[name]
+            for w in words:
+                i = table.get(w)
+                if i is None:
+                    i = table[w] = len(table)
+                    count.append(0)
+                count[i] += 1
+                ids.append(i)
+        for side in offsets:
+            offsets[side].append(offsets[side][-1] + len(example[side]))
+
+    types = {name: sorted(table, key=table.get)
+             for name, table in tables.items()}
+    arrays = [("indices", np.frombuffer(indices, dtype=np.int64)
+               if indices else np.zeros(0, dtype=np.int64))]
+    for side, off in offsets.items():
+        arrays.append((side + ".offsets", np.array(off, dtype=np.int64)))
+    for name in sorted(tables):
+        arrays.append((name, np.frombuffer(tokens[name], dtype=np.int32)
+                       if tokens[name] else np.zeros(0, dtype=np.int32)))
+        arrays.append((name + ".types", np.frombuffer(
+            u"\n".join(types[name]).encode('utf-8'), dtype=np.uint8)))
+        arrays.append((name + ".counts", np.array(counts[name],
+                                                  dtype=np.int64)))
+
+    header = {"n_examples": len(indices), "numericalized": False,
+              "fields": sorted(tables), "arrays": {}}
+    offset = 0
+    for name, arr in arrays:
+        header["arrays"][name] = {"dtype": arr.dtype.str, "offset": offset,
+                                  "shape": list(arr.shape)}
+        offset += arr.nbytes + (-arr.nbytes % 8)
+
+    with open(path, 'wb') as f:
+        reserved = _write_header(f, header)
+        start = len(MMAP_MAGIC) + 8 + reserved
+        for name, arr in arrays:
+            f.seek(start + header["arrays"][name]["offset"])
+            f.write(arr.tobytes())
+        f.truncate(start + offset)
+
+    return {name: Counter(dict(zip(types[name], counts[name])))
+            for name in tables}
+
+
+def numericalize_mmap_shard(path, fields):
+    """
+    Rewrite in place the shard-local token ids of `path` as ids of the
+    vocabularies of `fields`.
+    """
+    dataset = MmapDataset(path, mode='r+')
+    if dataset.header["numericalized"]:
+        return
+    vocab_sizes = {}
+    for name in dataset.field_names:
+        field = fields[name]
+        unk = field.vocab.stoi[field.unk_token]
+        remap = np.array([field.vocab.stoi.get(w, unk)
+                          for w in dataset.types(name)], dtype=np.int32)
+        ids = dataset.arrays[name]
+        if ids.size:
+            ids[:] = remap[ids]
+        vocab_sizes[name] = len(field.vocab)
+    for arr in dataset.arrays.values():
+        if isinstance(arr, np.memmap):
+            arr.flush()
+    dataset.header["numericalized"] = True
+    dataset.header["vocab_sizes"] = vocab_sizes
+    with open(path, 'r+b') as f:
+        _write_header(f, dataset.header, reserved=dataset.reserved)
+
+
+class _LengthView(object):
+    """ Just enough of an `Example` for `filter_example`. """
+
+    def __init__(self, src, tgt):
+        self.src = src
+        self.tgt = tgt
+
+
+class MmapDataset(object):
+    """
+    A memory-mapped text shard written by `write_mmap_shard`.
+
+    Args:
+        path (str): location of the shard.
+        mode (str): `np.memmap` mode, 'r' for training.
+    """
+    data_type = 'text'
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.header, self.reserved = _read_header(f)
+        start = len(MMAP_MAGIC) + 8 + self.reserved
+        self.arrays = {}
+        for name, desc in self.header["arrays"].items():
+            dtype = np.dtype(desc["dtype"])
+            shape = tuple(desc["shape"])
+            if shape[0] == 0:
+                self.arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self.arrays[name] = np.memmap(
+                    path, dtype=dtype, mode=mode, shape=shape,
+                    offset=start + desc["offset"])
+        # kept for the interface shared with `DatasetBase`
+        self.src_vocabs = []
+
+    def __len__(self):
+        return self.header["n_examples"]
+
+    @property
+    def field_names(self):
+        return self.header["fields"]
+
+    def types(self, name):
+        """ The shard-local type table of field `name`. """
+        raw = self.arrays[name + ".types"].tobytes()
+        return raw.decode('utf-8').split(u"\n") if raw else []
+
+    def counter(self, name):
+        """ Token counts of field `name` in this shard. """
+        return Counter(dict(zip(self.types(name),
+                                self.arrays[name + ".counts"].tolist())))
+
+    def lengths(self, side):
+        """ Number of tokens of each example on `side` (src or tgt). """
+        return np.diff(self.arrays[side + ".offsets"])
+
+    def check_fields(self, fields):
+        """ Make sure the shard was numericalized with these vocabs. """
+        if not self.header["numericalized"]:
+            raise ValueError("%s was not numericalized by preprocess.py"
+                             % self.path)
+        for name, size in self.header["vocab_sizes"].items():
+            if name in fields and len(fields[name].vocab) != size:
+                raise ValueError(
+                    "%s was numericalized with a %s vocab of size %d, "
+                    "got %d" % (self.path, name, size,
+                                len(fields[name].vocab)))
+
+    def pad(self, name, idx, pad, bos=None, eos=None):
+        """
+        Gather the examples `idx` of field `name` into a padded
+        `len x batch` numpy array, optionally surrounded by `bos`/`eos`.
+
+        Returns:
+            (array, lengths) where lengths do not count `bos`/`eos`.
+        """
+        off = self.arrays[_side(name) + ".offsets"]
+        starts = off[idx]
+        lens = off[idx + 1] - starts
+        extra = int(bos is not None) + int(eos is not None)
+        max_len = int(lens.max()) if len(lens) else 0
+        out = np.full((max_len + extra, len(idx)), pad, dtype=np.int64)
+        rows = np.arange(max_len)[:, None]
+        mask = rows < lens[None, :]
+        shift = int(bos is not None)
+        out[shift:shift + max_len][mask] = \
+            self.arrays[name][(starts[None, :] + rows)[mask]]
+        if bos is not None:
+            out[0] = bos
+        if eos is not None:
+            out[lens + shift, np.arange(len(idx))] = eos
+        return out, lens
+
+
+class MmapBatch(object):
+    """
+    Mimics `torchtext.data.Batch` for batches built from a `MmapDataset`.
+    """
+
+    def __init__(self, dataset, fields, idx, device):
+        self.batch_size = len(idx)
+        self.dataset = dataset
+        self.fields = list(fields.keys())
+        for name in dataset.field_names:
+            field = fields[name]
+            vocab = field.vocab
+            pad = vocab.stoi[field.pad_token]
+            bos = vocab.stoi[field.init_token] \
+                if field.init_token is not None else None
+            eos = vocab.stoi[field.eos_token] \
+                if field.eos_token is not None else None
+            data, lens = dataset.pad(name, idx, pad, bos, eos)
+            data = torch.from_numpy(data).to(device)
+            if field.include_lengths:
+                data = (data, torch.from_numpy(lens).to(device))
+            setattr(self, name, data)
+        self.indices = torch.from_numpy(
+            np.asarray(dataset.arrays["indices"][idx])).to(device)
+
+
+class MmapIterator(object):
+    """
+    Batches a `MmapDataset` the way `OrderedIterator` batches a
+    `DatasetBase`: in training, examples are shuffled, sorted by length
+    within pools of `pool_factor * batch_size` and the resulting batches are
+    shuffled; otherwise examples keep the corpus order. Examples are always
+    sorted by decreasing length within a batch.
+
+    Args:
+        dataset (MmapDataset): the shard.
+        fields (dict): fields holding the vocabularies of the shard.
+        batch_size (int): batch size.
+        token_batching (bool): count `batch_size` in padded tokens (as
+            `max_tok_len` does) rather than in examples.
+        device: where to put batches.
+        train (bool): training or validation order.
+        seed (int): seed of the shuffling, drawn from python's `random`
+            when None.
+        stride (int), offset (int): only build batches `offset`,
+            `offset + stride`, ... of the planned batches.
+        pool_factor (int): size of the sorting pools, in batches.
+    """
+
+    def __init__(self, dataset, fields, batch_size, token_batching=False,
+                 device=None, train=True, seed=None, stride=1, offset=0,
+                 pool_factor=100):
+        dataset.check_fields(fields)
+        self.dataset = dataset
+        self.fields = fields
+        self.batch_size = batch_size
+        self.token_batching = token_batching
+        self.device = device
+        self.train = train
+        self.seed = seed
+        self.stride = stride
+        self.offset = offset
+        self.pool_factor = pool_factor
+
+    def create_batches(self):
+        seed = None
+        if self.train:
+            # seed from python's RNG so that -seed behaves as with torchtext
+            seed = self.seed
+            if seed is None:
+                seed = random.randint(0, 2 ** 31 - 1)
+        return plan_batches(
+            self.dataset.lengths("src"), self.dataset.lengths("tgt"),
+            self.batch_size, token_batching=self.token_batching,
+            pool_factor=self.pool_factor, seed=seed)
+
+    def __iter__(self):
+        src_lens = self.dataset.lengths("src")
+        tgt_lens = self.dataset.lengths("tgt")
+        batches = islice(self.create_batches(), self.offset, None,
+                         self.stride)
+        for idx in batches:
+            # sort_within_batch: decreasing (src, tgt) length
+            idx = idx[np.lexsort((-tgt_lens[idx], -src_lens[idx]))]
+            yield MmapBatch(self.dataset, self.fields, idx, self.device)
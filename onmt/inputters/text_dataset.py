@@ -27,6 +27,26 @@ class TextDataset(DatasetBase):
             return len(ex.src), len(ex.tgt)
         return len(ex.src)
 
+    @staticmethod
+    def copy_map(batch, tgt_vocab, src_vocabs):
+        """
+        The `tgt_vocab` index of each entry of the dynamic dicts of `batch`
+        as a `[batch, dynamic dict size]` LongTensor, 0 for the words that
+        are not in `tgt_vocab` and for padding. It is computed on the
+        first call and kept on the batch for the next decoding steps.
+        """
+        copy_map = getattr(batch, "copy_map", None)
+        if copy_map is None:
+            vocabs = [src_vocabs[i] for i in batch.indices.tolist()]
+            copy_map = torch.zeros(len(vocabs), max(len(v) for v in vocabs),
+                                   dtype=torch.long)
+            for b, src_vocab in enumerate(vocabs):
+                copy_map[b, 1:len(src_vocab)] = torch.LongTensor(
+                    [tgt_vocab.stoi[w] for w in src_vocab.itos[1:]])
+            copy_map = copy_map.to(batch.indices.device)
+            batch.copy_map = copy_map
+        return copy_map
+
     @staticmethod
     def collapse_copy_scores(scores, batch, tgt_vocab, src_vocabs,
                              batch_dim=1, batch_offset=None):
@@ -36,24 +56,16 @@ class TextDataset(DatasetBase):
         with a dictionary word when it is ambiguous.
         """
         offset = len(tgt_vocab)
-        for b in range(scores.size(batch_dim)):
-            blank = []
-            fill = []
-            batch_id = batch_offset[b] if batch_offset is not None else b
-            index = batch.indices.data[batch_id]
-            src_vocab = src_vocabs[index]
-            for i in range(1, len(src_vocab)):
-                sw = src_vocab.itos[i]
-                ti = tgt_vocab.stoi[sw]
-                if ti != 0:
-                    blank.append(offset + i)
-                    fill.append(ti)
-            if blank:
-                blank = torch.Tensor(blank).type_as(batch.indices.data)
-                fill = torch.Tensor(fill).type_as(batch.indices.data)
-                score = scores[:, b] if batch_dim == 1 else scores[b]
-                score.index_add_(1, fill, score.index_select(1, blank))
-                score.index_fill_(1, blank, 1e-10)
+        fill = TextDataset.copy_map(batch, tgt_vocab, src_vocabs)
+        if batch_offset is not None:
+            fill = fill.index_select(0, batch_offset.to(fill.device))
+        # [batch, len, vocab + dynamic dict]
+        score = scores.transpose(0, batch_dim) if batch_dim else scores
+        fill = fill[:, :score.size(-1) - offset].unsqueeze(1) \
+            .expand_as(score[..., offset:])
+        score[..., :offset].scatter_add_(
+            -1, fill, score[..., offset:].masked_fill(fill.eq(0), 0))
+        score[..., offset:].masked_fill_(fill.ne(0), 1e-10)
         return scores
 
     @classmethod
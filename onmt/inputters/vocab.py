@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Compact vocabulary stored in one flat buffer.
+
+A `CompactVocab` holds, after a small header:
+
+    * `offsets` (int64, size + 1): start of each type in the string table,
+    * `table` (int32, a power of two >= 2 * size): an open-addressing hash
+      index from the crc32 of a type to its id, -1 for empty slots,
+    * the utf-8 string table of the types, in id order.
+
+Pickling it (`torch.save` of a checkpoint or of a `*.vocab.pt` file) only
+copies that buffer, and loading it builds no per-type Python object:
+lookups read the buffer directly. Ids of looked up types are memoized, so
+numericalizing a corpus costs about as much as with torchtext's dict.
+"""
+
+import struct
+import zlib
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:  # python 2
+    from collections import Mapping, Sequence
+
+import numpy as np
+
+VOCAB_MAGIC = b'ONMTVOCB'
+_HEADER = struct.Struct('<8sQQ')
+
+
+def _hash(word):
+    return zlib.crc32(word)
+
+
+class _Stoi(Mapping):
+    """ `stoi` of a `CompactVocab`: unknown types map to 0 (<unk>). """
+
+    def __init__(self, vocab):
+        self._vocab = vocab
+        self._cache = {}
+
+    def __getitem__(self, word):
+        return self.get(word, 0)
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def get(self, word, default=None):
+        i = self._cache.get(word)
+        if i is None:
+            i = self._vocab.index(word)
+            if i < 0:
+                return default
+            self._cache[word] = i
+        return i
+
+    def __iter__(self):
+        return iter(self._vocab.itos)
+
+    def __len__(self):
+        return len(self._vocab)
+
+    def items(self):
+        return ((w, i) for i, w in enumerate(self._vocab.itos))
+
+
+class _Itos(Sequence):
+    """ `itos` of a `CompactVocab`, decoded on access. """
+
+    def __init__(self, vocab):
+        self._vocab = vocab
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._vocab.word(i)
+
+    def __len__(self):
+        return len(self._vocab)
+
+
+class CompactVocab(object):
+    """
+    Drop-in replacement for the `torchtext.vocab.Vocab` of a trained
+    field: `stoi`, `itos` and `len`, without `freqs` nor `vectors`.
+
+    Args:
+        buffer: the bytes built by `CompactVocab.from_itos`.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        magic, size, table_size = _HEADER.unpack_from(buffer)
+        assert magic == VOCAB_MAGIC, "not a compact vocab"
+        start = _HEADER.size
+        # views of the buffer, not copies
+        self._offsets = np.frombuffer(buffer, dtype='<i8', count=size + 1,
+                                      offset=start)
+        start += 8 * (size + 1)
+        self._table = np.frombuffer(buffer, dtype='<i4', count=table_size,
+                                    offset=start)
+        self._strings = memoryview(buffer)[start + 4 * table_size:]
+        self._size = size
+        self._mask = table_size - 1
+        self.stoi = _Stoi(self)
+        self.itos = _Itos(self)
+
+    @classmethod
+    def from_itos(cls, itos):
+        """ Build the buffer of the types `itos`, in id order. """
+        words = [w.encode('utf-8') for w in itos]
+        size = len(words)
+        table_size = 1
+        while table_size < 2 * size:
+            table_size *= 2
+        offsets = np.zeros(size + 1, dtype='<i8')
+        offsets[1:] = np.cumsum([len(w) for w in words])
+        table = np.full(table_size, -1, dtype='<i4')
+        mask = table_size - 1
+        for i, w in enumerate(words):
+            h = _hash(w) & mask
+            while table[h] >= 0:
+                h = (h + 1) & mask
+            table[h] = i
+        buffer = b''.join([_HEADER.pack(VOCAB_MAGIC, size, table_size),
+                           offsets.tobytes(), table.tobytes()] + words)
+        return cls(buffer)
+
+    @classmethod
+    def from_vocab(cls, vocab):
+        """ Convert a torchtext `Vocab` (a `CompactVocab` is kept). """
+        if isinstance(vocab, cls):
+            return vocab
+        return cls.from_itos(vocab.itos)
+
+    def index(self, word):
+        """ Id of `word`, -1 if it is not in the vocab. """
+        word = word.encode('utf-8')
+        h = _hash(word) & self._mask
+        while True:
+            i = int(self._table[h])
+            if i < 0 or self._strings[
+                    self._offsets[i]:self._offsets[i + 1]] == word:
+                return i
+            h = (h + 1) & self._mask
+
+    def word(self, i):
+        """ The type of id `i`. """
+        i = int(i)
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError("vocab index out of range")
+        return self._strings[
+            self._offsets[i]:self._offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __len__(self):
+        return self._size
+
+    def __eq__(self, other):
+        return isinstance(other, CompactVocab) and \
+            memoryview(self._buffer) == memoryview(other._buffer)
+
+    def __reduce__(self):
+        return CompactVocab, (memoryview(self._buffer).tobytes(),)
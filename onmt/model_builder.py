@@ -20,7 +20,7 @@ from onmt.decoders.decoder import InputFeedRNNDecoder, StdRNNDecoder
 from onmt.decoders.transformer import TransformerDecoder
 from onmt.decoders.cnn_decoder import CNNDecoder
 
-from onmt.modules import Embeddings, CopyGenerator
+from onmt.modules import Embeddings, CopyGenerator, Cast
 from onmt.utils.misc import use_gpu
 from onmt.utils.logging import logger
 
@@ -242,8 +242,10 @@ def build_base_model(model_opt, fields, gpu, checkpoint=None):
             gen_func = onmt.modules.sparse_activations.LogSparsemax(dim=-1)
         else:
             gen_func = nn.LogSoftmax(dim=-1)
+        # the (log) softmax runs in fp32 with a reduced precision model
         generator = nn.Sequential(
             nn.Linear(model_opt.dec_rnn_size, len(fields["tgt"].vocab)),
+            Cast(torch.float32),
             gen_func
         )
         if model_opt.share_decoder_embeddings:
@@ -299,5 +301,9 @@ def build_base_model(model_opt, fields, gpu, checkpoint=None):
 def build_model(model_opt, opt, fields, checkpoint):
     logger.info('Building model...')
     model = build_base_model(model_opt, fields, use_gpu(opt), checkpoint)
+    if opt.model_dtype == 'fp16':
+        model.half()
+    elif opt.model_dtype == 'bf16':
+        model.to(torch.bfloat16)
     logger.info(model)
     return model
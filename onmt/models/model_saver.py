@@ -102,10 +102,10 @@ class ModelSaver(ModelSaverBase):
                           if isinstance(real_model.generator, nn.DataParallel)
                           else real_model.generator)
 
-        model_state_dict = real_model.state_dict()
+        model_state_dict = self._state_dict(real_model)
         model_state_dict = {k: v for k, v in model_state_dict.items()
                             if 'generator' not in k}
-        generator_state_dict = real_generator.state_dict()
+        generator_state_dict = self._state_dict(real_generator)
         checkpoint = {
             'model': model_state_dict,
             'generator': generator_state_dict,
@@ -119,5 +119,18 @@ class ModelSaver(ModelSaverBase):
         torch.save(checkpoint, checkpoint_path)
         return checkpoint, checkpoint_path
 
+    def _state_dict(self, module):
+        """
+        The state dict of `module`, holding the fp32 master weights of a
+        reduced precision model in place of its weights. They share their
+        storage with the masters of the saved optimizer.
+        """
+        masters = {}
+        if getattr(self.optim, 'model_params', None) is not None:
+            masters = {id(p): master for p, master in zip(
+                self.optim.model_params, self.optim.master_params)}
+        return {k: masters.get(id(v), v).detach()
+                for k, v in module.state_dict(keep_vars=True).items()}
+
     def _rm_checkpoint(self, name):
         os.remove(name)
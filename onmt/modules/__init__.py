@@ -1,5 +1,5 @@
 """  Attention and normalization modules  """
-from onmt.modules.util_class import Elementwise
+from onmt.modules.util_class import Elementwise, Cast
 from onmt.modules.gate import context_gate_factory, ContextGate
 from onmt.modules.global_attention import GlobalAttention
 from onmt.modules.conv_multi_step_attention import ConvMultiStepAttention
@@ -10,7 +10,7 @@ from onmt.modules.embeddings import Embeddings, PositionalEncoding
 from onmt.modules.weight_norm import WeightNormConv2d
 from onmt.modules.average_attn import AverageAttention
 
-__all__ = ["Elementwise", "context_gate_factory", "ContextGate",
+__all__ = ["Elementwise", "Cast", "context_gate_factory", "ContextGate",
            "GlobalAttention", "ConvMultiStepAttention", "CopyGenerator",
            "CopyGeneratorLoss", "CopyGeneratorLossCompute",
            "MultiHeadedAttention", "Embeddings", "PositionalEncoding",
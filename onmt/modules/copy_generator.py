@@ -57,7 +57,7 @@ class CopyGenerator(nn.Module):
         self.linear_copy = nn.Linear(input_size, 1)
         self.pad_idx = pad_idx
 
-    def forward(self, hidden, attn, src_map):
+    def forward(self, hidden, attn, src_map, dynamic_dict_size=None):
         """
         Compute a distribution over the target dictionary
         extended by the dynamic dictionary implied by compying
@@ -66,33 +66,40 @@ class CopyGenerator(nn.Module):
         Args:
            hidden (`FloatTensor`): hidden outputs `[batch*tlen, input_size]`
            attn (`FloatTensor`): attn for each `[batch*tlen, input_size]`
-           src_map (`FloatTensor`):
-             A sparse indicator matrix mapping each source word to
-             its index in the "extended" vocab containing.
-             `[src_len, batch, extra_words]`
+           src_map (`LongTensor`):
+             the index of each source word in the "extended" vocab
+             `[src_len, batch]`
+           dynamic_dict_size (int): size of the largest dynamic dictionary
+             of the batch, e.g. `TextDataset.copy_map(...).size(1)`.
+             Computed from `src_map` when None, which synchronizes
+             with the GPU.
         """
         # CHECKS
         batch_by_tlen, _ = hidden.size()
         batch_by_tlen_, slen = attn.size()
-        slen_, batch, cvocab = src_map.size()
+        slen_, batch = src_map.size()
         aeq(batch_by_tlen, batch_by_tlen_)
         aeq(slen, slen_)
+        cvocab = dynamic_dict_size
+        if cvocab is None:
+            cvocab = src_map.max().item() + 1
 
-        # Original probabilities.
-        logits = self.linear(hidden)
+        # Original probabilities, in fp32 with a reduced precision model
+        # (the loss takes their log).
+        logits = self.linear(hidden).float()
         logits[:, self.pad_idx] = -float('inf')
         prob = torch.softmax(logits, 1)
 
         # Probability of copying p(z=1) batch.
-        p_copy = torch.sigmoid(self.linear_copy(hidden))
+        p_copy = torch.sigmoid(self.linear_copy(hidden).float())
         # Probability of not copying: p_{word}(w) * (1 - p(z))
         out_prob = torch.mul(prob, 1 - p_copy)
-        mul_attn = torch.mul(attn, p_copy)
-        copy_prob = torch.bmm(
-            mul_attn.view(-1, batch, slen).transpose(0, 1),
-            src_map.transpose(0, 1)
-        ).transpose(0, 1)
-        copy_prob = copy_prob.contiguous().view(-1, cvocab)
+        mul_attn = torch.mul(attn.float(), p_copy).view(-1, batch, slen)
+        # add the attention of each source word to its extended vocab entry
+        index = src_map.t().unsqueeze(0).expand_as(mul_attn)
+        copy_prob = mul_attn.new_zeros(mul_attn.size(0), batch, cvocab)
+        copy_prob = copy_prob.scatter_add_(2, index, mul_attn)
+        copy_prob = copy_prob.view(-1, cvocab)
         return torch.cat([out_prob, copy_prob], 1)
 
 
@@ -174,8 +181,12 @@ class CopyGeneratorLossCompute(LossComputeBase):
         """
         target = target.view(-1)
         align = align.view(-1)
+        # computed once per batch, unlike the maximum of `batch.src_map`
+        copy_map = inputters.TextDataset.copy_map(
+            batch, self.tgt_vocab, batch.dataset.src_vocabs)
         scores = self.generator(
-            self._bottle(output), self._bottle(copy_attn), batch.src_map
+            self._bottle(output), self._bottle(copy_attn), batch.src_map,
+            copy_map.size(1)
         )
         loss = self.criterion(scores, align, target)
 
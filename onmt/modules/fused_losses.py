@@ -0,0 +1,109 @@
+""" Generator and loss fused over chunks of target tokens """
+from __future__ import division
+import math
+
+import torch
+import torch.nn.functional as F
+from torch.autograd import Function
+
+
+class FusedCrossEntropyFunction(Function):
+    """
+    Summed (label smoothed) cross-entropy of the log softmax of
+    `hidden * weight^T + bias`, computed `chunk_size` rows at a time.
+
+    The log probs of a chunk are reduced to their log-sum-exp, gold
+    score and row sum as soon as they are computed, and recomputed in
+    the backward, so the full `n x vocab` logits never exist at once.
+    The second output, the argmax of each row, has no gradient.
+
+    The smoothed loss is the KL-divergence of `LabelSmoothingLoss`: the
+    gold word has probability `1 - label_smoothing` and the others but
+    `ignore_index` share `label_smoothing`.
+    """
+
+    @staticmethod
+    def forward(ctx, hidden, weight, bias, target, ignore_index,
+                label_smoothing, chunk_size):
+        """
+        hidden (FloatTensor): n x hidden_size
+        weight (FloatTensor): vocab_size x hidden_size
+        bias (FloatTensor): vocab_size, or None
+        target (LongTensor): n, the indices of the target classes
+        """
+        n_rows, vocab_size = hidden.size(0), weight.size(0)
+        if chunk_size <= 0:
+            chunk_size = max(n_rows, 1)
+        smoothing = label_smoothing / (vocab_size - 2)
+        confidence = 1.0 - label_smoothing
+        # sum of q log q over the smoothed distribution q of a row
+        entropy = 0.
+        if confidence > 0:
+            entropy += confidence * math.log(confidence)
+        if smoothing > 0:
+            entropy += (vocab_size - 2) * smoothing * math.log(smoothing)
+
+        lse = hidden.new_empty(n_rows, dtype=torch.float)
+        pred = target.new_empty(n_rows)
+        loss = hidden.new_zeros([], dtype=torch.float)
+        for start in range(0, n_rows, chunk_size):
+            rows = slice(start, start + chunk_size)
+            tgt = target[rows]
+            logits = F.linear(hidden[rows], weight, bias).float()
+            chunk_lse = logits.logsumexp(1)
+            gold = logits.gather(1, tgt.unsqueeze(1)).squeeze(1) - chunk_lse
+            if label_smoothing > 0:
+                pad = logits[:, ignore_index] - chunk_lse
+                others = logits.sum(1) - vocab_size * chunk_lse - gold - pad
+                row_loss = entropy - confidence * gold - smoothing * others
+            else:
+                row_loss = -gold
+            loss += row_loss.masked_fill(tgt.eq(ignore_index), 0).sum()
+            lse[rows] = chunk_lse
+            pred[rows] = logits.max(1)[1]
+
+        ctx.save_for_backward(hidden, weight, bias, target, lse)
+        ctx.ignore_index = ignore_index
+        ctx.smoothing = smoothing
+        ctx.confidence = confidence
+        ctx.chunk_size = chunk_size
+        ctx.mark_non_differentiable(pred)
+        return loss, pred
+
+    @staticmethod
+    def backward(ctx, grad_loss, grad_pred):
+        hidden, weight, bias, target, lse = ctx.saved_tensors
+        grad_hidden = grad_weight = grad_bias = None
+        if ctx.needs_input_grad[0]:
+            grad_hidden = torch.empty_like(hidden)
+        if ctx.needs_input_grad[1]:
+            grad_weight = torch.zeros_like(weight)
+        if bias is not None and ctx.needs_input_grad[2]:
+            grad_bias = torch.zeros_like(bias)
+
+        for start in range(0, hidden.size(0), ctx.chunk_size):
+            rows = slice(start, start + ctx.chunk_size)
+            tgt = target[rows]
+            logits = F.linear(hidden[rows], weight, bias).float()
+            # softmax minus the target distribution
+            grad_logits = logits.sub_(lse[rows].unsqueeze(1)).exp_()
+            if ctx.smoothing > 0:
+                grad_logits -= ctx.smoothing
+                grad_logits[:, ctx.ignore_index] += ctx.smoothing
+            grad_logits.scatter_add_(
+                1, tgt.unsqueeze(1),
+                grad_logits.new_full([tgt.size(0), 1],
+                                     ctx.smoothing - ctx.confidence))
+            grad_logits.masked_fill_(tgt.eq(ctx.ignore_index).unsqueeze(1), 0)
+            grad_logits = grad_logits.mul_(grad_loss).to(hidden.dtype)
+
+            if grad_hidden is not None:
+                grad_hidden[rows] = grad_logits.mm(weight)
+            if grad_weight is not None:
+                grad_weight += grad_logits.t().mm(hidden[rows])
+            if grad_bias is not None:
+                grad_bias += grad_logits.sum(0)
+        return grad_hidden, grad_weight, grad_bias, None, None, None, None
+
+
+fused_cross_entropy = FusedCrossEntropyFunction.apply
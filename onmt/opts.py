@@ -197,6 +197,16 @@ def preprocess_opts(parser):
                        shard_size=0 means no segmentation
                        shard_size>0 means segment dataset into multiple shards,
                        each shard has shard_size samples""")
+    group.add('--shard_format', '-shard_format', default='pt',
+              choices=['pt', 'mmap'],
+              help="""On-disk format of the shards. pt pickles torchtext
+                       datasets; mmap (text only) writes flat arrays of
+                       token ids, already numericalized against the
+                       vocabulary, that training memory-maps.""")
+    group.add('--num_workers', '-num_workers', type=int, default=1,
+              help="""Number of processes building and saving shards
+                       in parallel. At most this many shards are held in
+                       memory at once.""")
 
     # Dictionary options, for text corpus
 
@@ -359,6 +369,12 @@ def train_opts(parser):
               choices=["sents", "tokens"],
               help="""Batch grouping for batch_size. Standard
                                is sents. Tokens will do dynamic batching""")
+    group.add('--pool_factor', '-pool_factor', type=int, default=100,
+              help="""Training examples are sorted by length within pools
+                       of pool_factor * batch_size examples before being
+                       cut into batches. Larger pools give less padding
+                       but less random batches. See
+                       tools/tune_batching.py.""")
     group.add('--normalization', '-normalization', default='sents',
               choices=["sents", "tokens"],
               help='Normalization method of the gradient.')
@@ -371,11 +387,34 @@ def train_opts(parser):
               help='Perfom validation every X steps')
     group.add('--valid_batch_size', '-valid_batch_size', type=int, default=32,
               help='Maximum batch size for validation')
+    group.add('--prefetch_workers', '-prefetch_workers', type=int, default=0,
+              help="""Number of background threads loading the next
+                       shards and building their batches ahead of
+                       training. Each worker holds one shard in memory.
+                       0 loads data on the training thread.""")
+    group.add('--prefetch_batches', '-prefetch_batches', type=int,
+              default=32,
+              help="""Number of batches each prefetch worker may build
+                       ahead of training.""")
+    group.add('--pin_memory', '-pin_memory', action='store_true',
+              help="""Build prefetched batches in pinned memory for
+                       faster copies to the GPU.""")
     group.add('--max_generator_batches', '-max_generator_batches',
               type=int, default=32,
               help="""Maximum batches of words in a sequence to run
                         the generator on in parallel. Higher is faster, but
                         uses more memory.""")
+    group.add('--model_dtype', '-model_dtype', default='fp32',
+              choices=['fp32', 'fp16', 'bf16'],
+              help="""Data type of the model parameters and of their
+                       computations. With fp16 or bf16, the optimizer
+                       updates fp32 master weights and the loss is scaled
+                       by -loss_scale.""")
+    group.add('--loss_scale', '-loss_scale', type=float, default=0,
+              help="""Scale of the loss of a fp16 or bf16 model in the
+                       backward. 0 adjusts it dynamically: it is halved
+                       and the step skipped when gradients overflow, and
+                       doubled after 2000 steps without overflow.""")
     group.add('--train_steps', '-train_steps', type=int, default=100000,
               help='Number of training steps')
     group.add('--epochs', '-epochs', type=int, default=0,
@@ -513,6 +552,11 @@ def translate_opts(parser):
     group.add('--output', '-output', default='pred.txt',
               help="""Path to output the predictions (each line will
                        be the decoded sequence""")
+    group.add('--shard_size', '-shard_size', type=int, default=10000,
+              help="""Read and translate the source by shards of this
+                       many examples, each sorted by length into batches;
+                       memory does not grow with the input size.
+                       0 translates the whole source as one shard.""")
     group.add('--report_bleu', '-report_bleu', action='store_true',
               help="""Report bleu score after translation,
                        call tools/multi-bleu.perl on command line""")
@@ -529,7 +573,8 @@ def translate_opts(parser):
     group = parser.add_argument_group('Beam')
     group.add('--fast', '-fast', action="store_true",
               help="""Use fast beam search (some features may not be
-                       supported!)""")
+                       supported!). With -beam_size 1 and -n_best 1, use
+                       greedy search, unless -block_ngram_repeat is set.""")
     group.add('--beam_size', '-beam_size', type=int, default=5,
               help='Beam size')
     group.add('--min_length', '-min_length', type=int, default=0,
@@ -591,6 +636,15 @@ def translate_opts(parser):
     group = parser.add_argument_group('Efficiency')
     group.add('--batch_size', '-batch_size', type=int, default=30,
               help='Batch size')
+    group.add('--batch_type', '-batch_type', default='sents',
+              choices=["sents", "tokens"],
+              help="""Batch grouping for batch_size. With tokens, batches
+                       hold at most batch_size source tokens (including
+                       padding) times beam_size. Text only.""")
+    group.add('--num_workers', '-num_workers', type=int, default=1,
+              help="""CPU only: translate shards of shard_size examples
+                       in this many forked processes, which share the
+                       model and split the CPU threads.""")
     group.add('--gpu', '-gpu', type=int, default=-1,
                        help="Device to run on")
 
@@ -122,6 +122,31 @@ ${PYTHON} translate.py -model ${TEST_DIR}/test_model.pt -src /tmp/src-test.txt -
 [ "$?" -eq 0 ] || error_exit
 echo "Succeeded" | tee -a ${LOG_FILE}
 
+echo -n "  [+] Testing NMT translation by shards..."
+${PYTHON} translate.py -model ${TEST_DIR}/test_model.pt -src /tmp/src-test.txt -output /tmp/trans-shard0 -shard_size 0 >> ${LOG_FILE} 2>&1
+[ "$?" -eq 0 ] || error_exit
+${PYTHON} translate.py -model ${TEST_DIR}/test_model.pt -src /tmp/src-test.txt -output /tmp/trans-shard3 -shard_size 3 >> ${LOG_FILE} 2>&1
+[ "$?" -eq 0 ] || error_exit
+diff /tmp/trans-shard0 /tmp/trans-shard3
+[ "$?" -eq 0 ] || error_exit
+${PYTHON} translate.py -model ${TEST_DIR}/test_model.pt -src /tmp/src-test.txt -output /tmp/trans-workers -shard_size 3 -num_workers 2 >> ${LOG_FILE} 2>&1
+[ "$?" -eq 0 ] || error_exit
+diff /tmp/trans-shard0 /tmp/trans-workers
+[ "$?" -eq 0 ] || error_exit
+echo "Succeeded" | tee -a ${LOG_FILE}
+
+echo -n "  [+] Testing NMT greedy translation..."
+${PYTHON} translate.py -model ${TEST_DIR}/test_model.pt -src /tmp/src-test.txt -verbose -fast -beam_size 1 >> ${LOG_FILE} 2>&1
+[ "$?" -eq 0 ] || error_exit
+echo "Succeeded" | tee -a ${LOG_FILE}
+
+echo -n "  [+] Testing NMT translation with n-gram blocking..."
+${PYTHON} translate.py -model ${TEST_DIR}/test_model.pt -src /tmp/src-test.txt -verbose -block_ngram_repeat 2 -ignore_when_blocking . >> ${LOG_FILE} 2>&1
+[ "$?" -eq 0 ] || error_exit
+${PYTHON} translate.py -model ${TEST_DIR}/test_model.pt -src /tmp/src-test.txt -verbose -fast -block_ngram_repeat 2 -ignore_when_blocking . >> ${LOG_FILE} 2>&1
+[ "$?" -eq 0 ] || error_exit
+echo "Succeeded" | tee -a ${LOG_FILE}
+
 echo -n "  [+] Testing img2text translation..."
 head /tmp/im2text/src-val.txt > /tmp/im2text/src-val-head.txt
 head /tmp/im2text/tgt-val.txt > /tmp/im2text/tgt-val-head.txt
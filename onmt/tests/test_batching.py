@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+import torchtext
+
+from onmt.inputters.batching import split_batches, plan_batches, \
+    padding_stats
+from onmt.inputters.inputter import max_tok_len, max_src_tok_len
+
+
+class _Example(object):
+    def __init__(self, src, tgt):
+        self.src = [0] * src
+        self.tgt = [0] * tgt
+
+
+class TestBatching(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.src_lens = rng.randint(1, 60, size=500)
+        self.tgt_lens = rng.randint(1, 60, size=500)
+
+    def _torchtext_batches(self, batch_size, batch_size_fn):
+        examples = [_Example(s, t) for s, t in
+                    zip(self.src_lens.tolist(), self.tgt_lens.tolist())]
+        ids = {id(ex): i for i, ex in enumerate(examples)}
+        return [[ids[id(ex)] for ex in b] for b in torchtext.data.batch(
+            examples, batch_size, batch_size_fn)]
+
+    def test_token_batches_match_max_tok_len(self):
+        # torchtext yields an empty batch when an example alone exceeds
+        # batch_size, so keep batch_size above the longest example
+        for batch_size in [64, 100, 500, 4096]:
+            batches = split_batches(self.src_lens, self.tgt_lens,
+                                    batch_size, token_batching=True)
+            self.assertEqual([b.tolist() for b in batches],
+                             self._torchtext_batches(batch_size, max_tok_len))
+
+    def test_translation_token_batches(self):
+        examples = sorted((_Example(s, 0) for s in self.src_lens.tolist()),
+                          key=lambda ex: len(ex.src))
+        for batch_size in [30, 100, 1000]:
+            batches = [b for b in torchtext.data.batch(
+                examples, batch_size, max_src_tok_len) if b]
+            self.assertEqual(sum(len(b) for b in batches), len(examples))
+            for b in batches:
+                padded = len(b) * max(len(ex.src) for ex in b)
+                self.assertTrue(padded <= batch_size or len(b) == 1)
+
+    def test_sentence_batches(self):
+        batches = split_batches(self.src_lens, self.tgt_lens, 64)
+        self.assertEqual([b.tolist() for b in batches],
+                         self._torchtext_batches(64, None))
+
+    def test_plan_is_reproducible(self):
+        def plan(seed):
+            return [b.tolist() for b in plan_batches(
+                self.src_lens, self.tgt_lens, 300, token_batching=True,
+                pool_factor=2, seed=seed)]
+
+        self.assertEqual(plan(1), plan(1))
+        self.assertNotEqual(plan(1), plan(2))
+        self.assertEqual(sorted(sum(plan(1), [])), list(range(500)))
+
+    def test_padding_stats(self):
+        batches = [np.array([0, 1]), np.array([2])]
+        src_words, src_padded, tgt_words, tgt_padded = padding_stats(
+            [3, 5, 2], [4, 1, 6], batches)
+        self.assertEqual((src_words, src_padded), (10, 12))
+        # targets are counted with their <eos>
+        self.assertEqual((tgt_words, tgt_padded), (14, 17))
@@ -0,0 +1,144 @@
+import math
+import unittest
+from argparse import Namespace
+
+import torch
+
+from onmt.translate.beam import BeamSearch, GNMTGlobalScorer
+from onmt.translate.ngram_blocker import NGramBlocker
+
+
+def scorer(alpha=0., beta=0., length_penalty="none", coverage_penalty="none"):
+    return GNMTGlobalScorer(Namespace(
+        alpha=alpha, beta=beta, length_penalty=length_penalty,
+        coverage_penalty=coverage_penalty))
+
+
+class TestBeamSearch(unittest.TestCase):
+    BOS, EOS, PAD = 2, 3, 1
+    VOCAB = 8
+
+    def beam(self, batch_size, beam_size, **kwargs):
+        return BeamSearch(
+            beam_size, batch_size, self.PAD, self.BOS, self.EOS,
+            global_scorer=kwargs.pop("global_scorer", scorer()),
+            memory_lengths=torch.full([batch_size * beam_size], 4,
+                                      dtype=torch.long),
+            **kwargs)
+
+    def step(self, beam, word_log_probs):
+        """ Advance `beam` with the same log probs for every hypothesis. """
+        n = beam.topk_log_probs.size(0)
+        log_probs = torch.full([n, self.VOCAB], -10.)
+        for word, log_prob in word_log_probs.items():
+            log_probs[:, word] = log_prob
+        attn = torch.full([1, n, 4], 0.25)
+        beam.advance(log_probs, attn)
+
+    def test_finishes_when_top_beam_ends(self):
+        beam = self.beam(2, 3, n_best=2)
+        self.step(beam, {5: -0.1, self.EOS: -1.})
+        self.assertEqual(beam.is_finished.tolist(), [[0, 1, 0]] * 2)
+        beam.update_finished()
+        # the best hypotheses did not end yet
+        self.assertFalse(beam.done)
+        self.assertEqual(beam.batch_offset.tolist(), [0, 1])
+        self.step(beam, {self.EOS: -0.1, 4: -1.})
+        beam.update_finished()
+        self.assertTrue(beam.done)
+        for b in range(2):
+            self.assertEqual(len(beam.predictions[b]), 2)
+            self.assertEqual(beam.predictions[b][0].tolist(),
+                             [5, self.EOS])
+            self.assertEqual(beam.predictions[b][1].tolist(), [self.EOS])
+            self.assertEqual(beam.attention[b][0].size(), (2, 4))
+            self.assertAlmostEqual(beam.scores[b][0].item(), -0.2, places=5)
+            self.assertAlmostEqual(beam.scores[b][1].item(), -1., places=5)
+
+    def test_min_length_blocks_eos(self):
+        beam = self.beam(1, 2, min_length=3)
+        self.step(beam, {self.EOS: -0.1, 4: -1.})
+        self.assertFalse(beam.is_finished.any())
+        self.step(beam, {self.EOS: -0.1, 4: -1.})
+        self.assertFalse(beam.is_finished.any())
+        self.step(beam, {self.EOS: -0.1, 4: -1.})
+        self.assertTrue(beam.is_finished.any())
+
+    def test_max_length_fills_n_best(self):
+        beam = self.beam(1, 3, n_best=2, max_length=2)
+        self.step(beam, {5: -0.1, 4: -1.})
+        self.step(beam, {5: -0.1, 4: -1.})
+        beam.update_finished()
+        self.assertTrue(beam.done)
+        self.assertEqual(len(beam.predictions[0]), 2)
+        self.assertEqual(beam.predictions[0][0].tolist(), [5, 5])
+
+    def test_ngram_repeat_is_blocked(self):
+        beam = self.beam(1, 2, block_ngram_repeat=1)
+        self.step(beam, {5: -0.1, 4: -1.})
+        self.step(beam, {5: -0.1, 4: -1.})
+        self.assertEqual(beam.alive_seq[0].tolist(), [self.BOS, 5, 5])
+        self.assertEqual(beam.ngram_blocker.blocked.tolist(), [1, 0])
+        self.step(beam, {5: -0.1, 4: -1.})
+        self.assertIn(beam.alive_seq[0, :3].tolist(),
+                      [[self.BOS, 5, 4], [self.BOS, 4, 5]])
+
+    def test_excluded_ngram_is_not_blocked(self):
+        beam = self.beam(1, 2, block_ngram_repeat=1, exclusion_tokens={5})
+        for _ in range(3):
+            self.step(beam, {5: -0.1, 4: -1.})
+        self.assertEqual(beam.alive_seq[0].tolist(), [self.BOS, 5, 5, 5])
+
+    def test_coverage_penalty(self):
+        beam = self.beam(1, 2, global_scorer=scorer(
+            beta=1., coverage_penalty="wu"))
+        self.step(beam, {5: -0.1})
+        self.step(beam, {self.EOS: -0.1})
+        beam.update_finished()
+        self.assertTrue(beam.done)
+        # each source word got 0.5 of attention
+        self.assertAlmostEqual(beam.scores[0][0].item(),
+                               -0.2 + 4 * math.log(0.5), places=4)
+
+
+class TestNGramBlocker(unittest.TestCase):
+
+    @staticmethod
+    def repeats(hyps, n, exclusion_tokens=None):
+        """ Whether each hypothesis repeated an n-gram, the slow way. """
+        result = []
+        for hyp in hyps:
+            grams = [tuple(hyp[i:i + n]) for i in range(len(hyp) - n + 1)
+                     if not set(hyp[i:i + n]) & (exclusion_tokens or set())]
+            result.append(int(len(set(grams)) < len(grams)))
+        return result
+
+    def run_blocker(self, hyps, n, exclusion_tokens=None):
+        blocker = NGramBlocker(n, len(hyps), exclusion_tokens)
+        for tokens in torch.tensor(hyps).t():
+            blocker.advance(tokens)
+        return blocker.blocked.tolist()
+
+    def test_matches_repeats(self):
+        torch.manual_seed(1)
+        hyps = torch.randint(0, 4, (20, 12), dtype=torch.long).tolist()
+        for n in range(1, 5):
+            self.assertEqual(self.run_blocker(hyps, n),
+                             self.repeats(hyps, n))
+            self.assertEqual(self.run_blocker(hyps, n, {0}),
+                             self.repeats(hyps, n, {0}))
+
+    def test_only_full_ngrams(self):
+        self.assertEqual(self.run_blocker([[0, 0, 1, 0, 0]], 3), [0])
+        self.assertEqual(self.run_blocker([[0, 0, 1, 0, 0, 1]], 3), [1])
+
+    def test_map_state_follows_backpointers(self):
+        blocker = NGramBlocker(2, 2)
+        blocker.advance(torch.tensor([5, 6]))
+        blocker.advance(torch.tensor([7, 7]))
+        # both new hypotheses extend the first one: 5 7 5 7
+        blocker.map_state(lambda state: state.index_select(
+            0, torch.tensor([0, 0])))
+        blocker.advance(torch.tensor([5, 6]))
+        blocker.advance(torch.tensor([7, 7]))
+        self.assertEqual(blocker.blocked.tolist(), [1, 0])
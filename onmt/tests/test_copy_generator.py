@@ -0,0 +1,72 @@
+"""
+Here come the tests for the copy generator
+"""
+import argparse
+import unittest
+from collections import Counter
+
+import torch
+from torchtext.vocab import Vocab
+
+import onmt
+from onmt.inputters.inputter import make_src
+from onmt.inputters.text_dataset import TextDataset
+
+
+class TestCopyGenerator(unittest.TestCase):
+
+    def test_make_src_pads_with_blank(self):
+        src_map = make_src([torch.LongTensor([2, 3, 2]),
+                            torch.LongTensor([2])], None)
+        self.assertEqual(src_map.tolist(), [[2, 2], [3, 1], [2, 1]])
+
+    def test_copy_probs_match_one_hot_src_map(self):
+        tlen, batch, slen, dim = 3, 2, 4, 8
+        src_map = torch.LongTensor([[2, 2], [3, 4], [2, 1], [5, 1]])
+        hidden = torch.randn(tlen * batch, dim)
+        attn = torch.softmax(torch.randn(tlen * batch, slen), 1)
+        generator = onmt.modules.CopyGenerator(dim, 10, pad_idx=1)
+        probs = generator(hidden, attn, src_map)
+
+        # the dense one-hot computation the index form replaces
+        one_hot = torch.zeros(slen, batch, 6)
+        one_hot.scatter_(2, src_map.unsqueeze(2), 1)
+        p_copy = torch.sigmoid(generator.linear_copy(hidden))
+        expected = torch.bmm(
+            (attn * p_copy).view(tlen, batch, slen).transpose(0, 1),
+            one_hot.transpose(0, 1)).transpose(0, 1).contiguous()
+        self.assertEqual(probs.size(), (tlen * batch, 16))
+        self.assertTrue(torch.allclose(probs[:, 10:],
+                                       expected.view(-1, 6)))
+
+    def test_dynamic_dict_size(self):
+        src_map = torch.LongTensor([[2, 2], [3, 1]])
+        hidden = torch.randn(4, 8)
+        attn = torch.softmax(torch.randn(4, 2), 1)
+        generator = onmt.modules.CopyGenerator(8, 10, pad_idx=1)
+        probs = generator(hidden, attn, src_map)
+        # a larger dictionary in the batch only adds zero columns
+        padded = generator(hidden, attn, src_map, dynamic_dict_size=6)
+        self.assertEqual(padded.size(), (4, 16))
+        self.assertTrue(padded[:, :14].equal(probs))
+        self.assertTrue(padded[:, 14:].eq(0).all())
+
+    def test_collapse_copy_scores(self):
+        tgt_vocab = Vocab(Counter(['a', 'b', 'c']),
+                          specials=['<unk>', '<blank>', '<s>', '</s>'])
+        src_vocabs = [Vocab(Counter(src), specials=['<unk>', '<blank>'])
+                      for src in [['a', 'x', 'b'], ['y'], ['c', 'a']]]
+        batch = argparse.Namespace(indices=torch.LongTensor([2, 0, 1]))
+        offset = len(tgt_vocab)
+        scores = torch.rand(4, 3, offset + 5)
+        collapsed = TextDataset.collapse_copy_scores(
+            scores.clone(), batch, tgt_vocab, src_vocabs)
+        for b, index in enumerate(batch.indices.tolist()):
+            src_vocab = src_vocabs[index]
+            expected = scores[:, b].clone()
+            for i in range(1, len(src_vocab)):
+                ti = tgt_vocab.stoi[src_vocab.itos[i]]
+                if ti != 0:
+                    expected[:, ti] += scores[:, b, offset + i]
+                    expected[:, offset + i] = 1e-10
+            self.assertTrue(torch.allclose(collapsed[:, b], expected))
@@ -0,0 +1,188 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+import torch.distributed
+import torch.multiprocessing
+import torch.nn as nn
+
+from onmt.utils.distributed import GradientReducer, all_gather_list, \
+    all_reduce_numbers
+from onmt.utils.statistics import Statistics
+
+WORLD_SIZE = 2
+
+
+def _model():
+    torch.manual_seed(1)
+    return nn.Sequential(nn.Linear(4, 8), nn.Tanh(), nn.Linear(8, 3))
+
+
+def _inputs(rank, n_batches):
+    torch.manual_seed(100 + rank)
+    return [torch.randn(5, 4) for _ in range(n_batches)]
+
+
+def _run_reducer(rank, init_file, n_batches):
+    """ Accumulate `n_batches` micro-batches, all-reducing the last. """
+    _init(rank, init_file)
+    model = _model()
+    # one bucket per parameter
+    reducer = GradientReducer(model.parameters(), bucket_size=1)
+    for i, x in enumerate(_inputs(rank, n_batches)):
+        reducer.sync = i == n_batches - 1
+        model(x).pow(2).sum().backward()
+        if not reducer.sync:
+            assert len(reducer.handles) == 0
+    # the buckets were all launched during the backward
+    assert len(reducer.handles) == len(reducer.buckets) == 4
+    reducer.finish()
+
+    # same gradients as one process on the inputs of all processes
+    expected = _model()
+    for r in range(WORLD_SIZE):
+        for x in _inputs(r, n_batches):
+            expected(x).pow(2).sum().backward()
+    for p, q in zip(model.parameters(), expected.parameters()):
+        assert p.grad.allclose(q.grad, atol=1e-5), (p.grad, q.grad)
+
+
+def _init(rank, init_file):
+    torch.distributed.init_process_group(
+        backend="gloo", init_method="file://" + init_file,
+        world_size=WORLD_SIZE, rank=rank)
+
+
+def _run_unused(rank, init_file):
+    """ A parameter without gradient on one process. """
+    _init(rank, init_file)
+    model = _model()
+    unused = nn.Parameter(torch.zeros(3))
+    reducer = GradientReducer([unused] + list(model.parameters()))
+    x = _inputs(rank, 1)[0]
+    if rank == 0:
+        model(x).sum().backward()
+    else:
+        model[0](x).sum().backward()
+    reducer.finish()
+    # only the first process contributes to the last layer
+    expected = _model()
+    expected(_inputs(0, 1)[0]).sum().backward()
+    for p, q in zip(model[2].parameters(), expected[2].parameters()):
+        assert p.grad.allclose(q.grad), (p.grad, q.grad)
+    # no process contributes: no gradient for the optimizer
+    assert unused.grad is None
+
+
+def _tied_model():
+    torch.manual_seed(1)
+    body, head = nn.Linear(4, 4), nn.Linear(4, 4)
+    head.weight = body.weight
+    return body, head
+
+
+def _run_shards(rank, init_file):
+    """ Loss shards accumulating into a tied parameter, as the
+    generator shards of `LossComputeBase.sharded_compute_loss`. """
+    _init(rank, init_file)
+    body, head = _tied_model()
+    # the gradient of the head is complete before the synced backward
+    params = [head.bias] + list(body.parameters())
+    reducer = GradientReducer(params, bucket_size=1)
+    out = body(_inputs(rank, 1)[0])
+    shard_out = out.detach().requires_grad_()
+    for shard in shard_out.split(2):
+        with reducer.no_sync():
+            head(shard).pow(2).sum().backward()
+    assert len(reducer.handles) == 0
+    out.backward(shard_out.grad)
+    # all but the bucket of the head launched during the backward
+    assert len(reducer.handles) == len(reducer.buckets) - 1
+    reducer.finish()
+
+    expected_body, expected_head = _tied_model()
+    for r in range(WORLD_SIZE):
+        x = _inputs(r, 1)[0]
+        expected_head(expected_body(x)).pow(2).sum().backward()
+    for p, q in zip(params, [expected_head.bias]
+                    + list(expected_body.parameters())):
+        assert p.grad.allclose(q.grad, atol=1e-5), (p.grad, q.grad)
+
+    # a second synced backward cannot reach an all-reduced gradient
+    x = _inputs(rank, 1)[0]
+    body(x).sum().backward()
+    try:
+        body(x).sum().backward()
+        raise AssertionError("the second backward did not raise")
+    except RuntimeError as e:
+        assert "after its all-reduce" in str(e)
+    reducer.finish()
+
+
+def _run_gather(rank, init_file):
+    _init(rank, init_file)
+    # beyond the former 65k limit, different sizes on each process
+    data = {"rank": rank, "payload": "x" * (100000 * (rank + 1))}
+    gathered = all_gather_list(data)
+    assert [d["rank"] for d in gathered] == list(range(WORLD_SIZE))
+    assert [len(d["payload"]) for d in gathered] == [100000, 200000]
+
+    assert all_reduce_numbers([rank, 0.5, 2 ** 40 + rank]) == \
+        [1., 1., 2 ** 41 + 1.]
+
+
+def _run_stats(rank, init_file):
+    _init(rank, init_file)
+    stats = [Statistics(loss=1.5 + rank, n_words=10, n_correct=rank),
+             Statistics(loss=1., n_words=3, n_correct=1)]
+    stats[0].n_batches = 1
+    stats[0].n_tgt_padded = 12 + rank
+    stats = Statistics.all_gather_stats_list(stats)
+    assert stats[0].loss == 4.
+    assert (stats[0].n_words, stats[0].n_correct) == (20, 1)
+    assert (stats[0].n_batches, stats[0].n_tgt_padded) == (2, 25)
+    assert (stats[1].loss, stats[1].n_words) == (2., 6)
+    assert isinstance(stats[0].n_words, int)
+
+
+@unittest.skipIf(not torch.distributed.is_available(),
+                 "torch.distributed is not available")
+class DistributedTestCase(unittest.TestCase):
+    """ Runs functions in `WORLD_SIZE` gloo processes. """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def spawn(self, fn, *args):
+        init_file = os.path.join(self.tmp, "init")
+        torch.multiprocessing.spawn(fn, args=(init_file,) + args,
+                                    nprocs=WORLD_SIZE)
+
+
+class TestGradientReducer(DistributedTestCase):
+
+    def test_all_reduce(self):
+        self.spawn(_run_reducer, 1)
+
+    def test_accumulation(self):
+        self.spawn(_run_reducer, 3)
+
+    def test_unused_parameters(self):
+        self.spawn(_run_unused)
+
+    def test_shards_accumulate_before_sync(self):
+        self.spawn(_run_shards)
+
+
+class TestGather(DistributedTestCase):
+
+    def test_gather_and_reduce(self):
+        self.spawn(_run_gather)
+
+    def test_statistics(self):
+        self.spawn(_run_stats)
@@ -0,0 +1,72 @@
+import unittest
+from argparse import Namespace
+
+import torch
+import torch.nn as nn
+
+from onmt.utils.loss import LabelSmoothingLoss, NMTLossCompute
+
+
+class TestFusedCrossEntropy(unittest.TestCase):
+    VOCAB = 11
+    PAD = 1
+    HIDDEN = 6
+
+    def make_loss(self, label_smoothing, fused):
+        torch.manual_seed(1)
+        generator = nn.Sequential(nn.Linear(self.HIDDEN, self.VOCAB),
+                                  nn.LogSoftmax(dim=-1))
+        if label_smoothing > 0:
+            criterion = LabelSmoothingLoss(label_smoothing, self.VOCAB,
+                                           ignore_index=self.PAD)
+        else:
+            criterion = nn.NLLLoss(ignore_index=self.PAD, reduction='sum')
+        return NMTLossCompute(criterion, generator, fused=fused)
+
+    def run_loss(self, label_smoothing, fused, shard_size):
+        compute = self.make_loss(label_smoothing, fused)
+        torch.manual_seed(2)
+        tgt_len, batch_size = 7, 3
+        output = torch.randn(tgt_len - 1, batch_size, self.HIDDEN,
+                             requires_grad=True)
+        tgt = torch.randint(0, self.VOCAB, (tgt_len, batch_size, 1),
+                            dtype=torch.long)
+        tgt[-2:, 0] = self.PAD
+        batch = Namespace(tgt=tgt)
+        stats = compute.sharded_compute_loss(
+            batch, output, None, 0, tgt_len - 1, shard_size, 2)
+        grads = [output.grad] + [p.grad for p in compute.parameters()]
+        return compute, stats, grads
+
+    def check_same_as_generator(self, label_smoothing, shard_size):
+        _, ref_stats, ref_grads = self.run_loss(label_smoothing, False, 2)
+        compute, stats, grads = self.run_loss(
+            label_smoothing, True, shard_size)
+        self.assertTrue(compute.fused)
+        self.assertAlmostEqual(stats.loss, ref_stats.loss, places=4)
+        self.assertEqual(stats.n_words, ref_stats.n_words)
+        self.assertEqual(stats.n_correct, ref_stats.n_correct)
+        for grad, ref_grad in zip(grads, ref_grads):
+            self.assertTrue(grad.allclose(ref_grad, atol=1e-6))
+
+    def test_nll(self):
+        for shard_size in [0, 1, 2, 4]:
+            self.check_same_as_generator(0., shard_size)
+
+    def test_label_smoothing(self):
+        for shard_size in [0, 1, 2, 4]:
+            self.check_same_as_generator(0.1, shard_size)
+
+    def test_full_smoothing(self):
+        self.check_same_as_generator(1.0, 2)
+
+    def test_validation(self):
+        compute = self.make_loss(0.1, True)
+        reference = self.make_loss(0.1, False)
+        output = torch.randn(4, 2, self.HIDDEN)
+        batch = Namespace(tgt=torch.randint(
+            0, self.VOCAB, (5, 2, 1), dtype=torch.long))
+        self.assertAlmostEqual(
+            compute.monolithic_compute_loss(batch, output, None).loss,
+            reference.monolithic_compute_loss(batch, output, None).loss,
+            places=4)
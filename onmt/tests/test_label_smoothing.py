@@ -0,0 +1,46 @@
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from onmt.utils.loss import LabelSmoothingLoss
+
+
+def dense_label_smoothing(output, target, label_smoothing, ignore_index):
+    """ KL-divergence with the smoothed distribution built in full. """
+    model_prob = torch.full_like(
+        output, label_smoothing / (output.size(1) - 2))
+    model_prob[:, ignore_index] = 0
+    model_prob.scatter_(1, target.unsqueeze(1), 1.0 - label_smoothing)
+    model_prob.masked_fill_((target == ignore_index).unsqueeze(1), 0)
+    return F.kl_div(output, model_prob, reduction='sum')
+
+
+class TestLabelSmoothingLoss(unittest.TestCase):
+    PAD = 1
+
+    def check(self, label_smoothing, vocab_size=13, n=20):
+        torch.manual_seed(1)
+        logits = torch.randn(n, vocab_size, requires_grad=True)
+        target = torch.randint(0, vocab_size, (n,), dtype=torch.long)
+        target[:3] = self.PAD
+        criterion = LabelSmoothingLoss(label_smoothing, vocab_size,
+                                       ignore_index=self.PAD)
+
+        loss = criterion(F.log_softmax(logits, -1), target)
+        grad, = torch.autograd.grad(loss, logits)
+        ref = dense_label_smoothing(F.log_softmax(logits, -1), target,
+                                    label_smoothing, self.PAD)
+        ref_grad, = torch.autograd.grad(ref, logits)
+        self.assertAlmostEqual(loss.item(), ref.item(), places=4)
+        self.assertTrue(grad.allclose(ref_grad, atol=1e-6))
+
+    def test_same_as_dense(self):
+        for label_smoothing in [0.1, 0.5, 1.0]:
+            self.check(label_smoothing)
+
+    def test_padding_only(self):
+        criterion = LabelSmoothingLoss(0.1, 5, ignore_index=self.PAD)
+        output = F.log_softmax(torch.randn(2, 5), -1)
+        loss = criterion(output, torch.full([2], self.PAD, dtype=torch.long))
+        self.assertEqual(loss.item(), 0.)
@@ -0,0 +1,177 @@
+import io
+import unittest
+from argparse import Namespace
+
+import torch
+import torch.nn as nn
+
+from onmt.models import ModelSaver
+from onmt.modules import Cast, CopyGenerator, CopyGeneratorLoss
+from onmt.utils.loss import NMTLossCompute
+from onmt.utils.optimizers import LossScaler, Optimizer, build_optim
+
+
+@unittest.skipIf(not hasattr(torch, 'bfloat16'), "no bfloat16")
+class TestMixedPrecisionOptimizer(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(1)
+        self.model = nn.Linear(4, 3).to(torch.bfloat16)
+        self.optim = Optimizer('sgd', 0.5, 0, loss_scale=0)
+        self.optim.set_parameters(self.model)
+
+    def backward(self):
+        self.model.zero_grad()
+        x = torch.randn(5, 4).to(torch.bfloat16)
+        loss = self.model(x).float().pow(2).sum()
+        (loss * self.optim.loss_scale).backward()
+
+    def test_fp32_master_weights(self):
+        self.assertEqual(len(self.optim.master_params), 2)
+        for p, master in zip(self.model.parameters(),
+                             self.optim.master_params):
+            self.assertEqual(master.dtype, torch.float32)
+            self.assertTrue(master.to(torch.bfloat16).equal(p))
+
+    def test_step(self):
+        self.backward()
+        masters = [m.detach().clone() for m in self.optim.master_params]
+        grads = [p.grad.float() / self.optim.loss_scale
+                 for p in self.model.parameters()]
+        self.optim.step()
+        self.assertEqual(self.optim._step, 1)
+        for p, master, old, grad in zip(self.model.parameters(),
+                                        self.optim.master_params,
+                                        masters, grads):
+            self.assertTrue(master.allclose(old - 0.5 * grad))
+            self.assertTrue(p.equal(master.to(torch.bfloat16)))
+
+    def test_overflow_skips_step(self):
+        self.backward()
+        self.model.weight.grad[0, 0] = float('inf')
+        params = [p.detach().clone() for p in self.model.parameters()]
+        scale = self.optim.loss_scale
+        self.optim.step()
+        self.assertEqual(self.optim._step, 0)
+        self.assertEqual(self.optim.loss_scale, scale / 2)
+        self.assertEqual(self.optim.loss_scaler.skipped_steps, 1)
+        for p, old in zip(self.model.parameters(), params):
+            self.assertTrue(p.equal(old))
+
+    def test_loss_scale_in_checkpoint(self):
+        self.optim.loss_scaler.update(overflow=True)
+        buf = io.BytesIO()
+        torch.save({'optim': self.optim}, buf)
+        buf.seek(0)
+        optim = torch.load(buf)['optim']
+        self.assertEqual(optim.loss_scaler.scale, 2. ** 14)
+        self.assertEqual(optim.loss_scaler.skipped_steps, 1)
+
+    def save(self):
+        saver = ModelSaver('model', self.model, None, None, self.optim, 1)
+        buf = io.BytesIO()
+        torch.save({'optim': self.optim,
+                    'model': saver._state_dict(self.model)}, buf)
+        buf.seek(0)
+        return torch.load(buf)
+
+    def test_checkpoint_holds_masters_once(self):
+        self.backward()
+        self.optim.step()
+        checkpoint = self.save()
+        self.assertIsNone(checkpoint['optim'].model_params)
+        self.assertIsNotNone(self.optim.model_params)
+        for (name, _), master in zip(self.model.named_parameters(),
+                                     checkpoint['optim'].master_params):
+            weight = checkpoint['model'][name]
+            self.assertEqual(weight.dtype, torch.float32)
+            self.assertEqual(weight.data_ptr(), master.data_ptr())
+
+    def test_resume_keeps_fp32_masters(self):
+        self.backward()
+        self.optim.step()
+        checkpoint = self.save()
+
+        model = nn.Linear(4, 3).to(torch.bfloat16)
+        model.load_state_dict(checkpoint['model'])
+        opt = Namespace(train_from='model.pt', reset_optim='none',
+                        gpu_ranks=[])
+        optim = build_optim(model, opt, checkpoint)
+        for master, saved in zip(optim.master_params,
+                                 self.optim.master_params):
+            self.assertTrue(master.equal(saved))
+        # the masters are not the rounded model weights
+        self.assertFalse(all(master.equal(p.float()) for master, p in
+                             zip(optim.master_params, model.parameters())))
+
+    def test_fp32_model(self):
+        optim = Optimizer('sgd', 0.5, 0)
+        optim.set_parameters(nn.Linear(4, 3))
+        self.assertIsNone(optim.model_params)
+        self.assertEqual(optim.loss_scale, 1)
+
+
+@unittest.skipIf(not hasattr(torch, 'bfloat16'), "no bfloat16")
+class TestMixedPrecisionLoss(unittest.TestCase):
+    VOCAB = 10
+    PAD = 1
+    HIDDEN = 8
+
+    def test_copy_loss(self):
+        tlen, batch, slen = 3, 2, 4
+        torch.manual_seed(1)
+        generator = CopyGenerator(self.HIDDEN, self.VOCAB, self.PAD)
+        criterion = CopyGeneratorLoss(self.VOCAB, False, ignore_index=self.PAD)
+        src_map = torch.LongTensor([[2, 2], [3, 4], [2, 1], [5, 1]])
+        hidden = torch.randn(tlen * batch, self.HIDDEN)
+        attn = torch.softmax(torch.randn(tlen * batch, slen), 1)
+        target = torch.LongTensor([0, 3, 0, 5, 7, 1])
+        # the first word is copied, the others have no copy probability
+        align = torch.LongTensor([2, 0, 3, 0, 0, 0])
+
+        ref_loss = criterion(generator(hidden, attn, src_map), align, target)
+        generator.to(torch.bfloat16)
+        hidden.requires_grad_()
+        scores = generator(hidden.to(torch.bfloat16),
+                           attn.to(torch.bfloat16), src_map)
+        self.assertEqual(scores.dtype, torch.float32)
+        loss = criterion(scores, align, target)
+        self.assertTrue(loss.allclose(ref_loss, rtol=0.05))
+        # the scaled loss and its gradient stay finite
+        (loss.sum() * 2. ** 15).backward()
+        self.assertTrue(torch.isfinite(hidden.grad).all())
+
+    def test_unfused_generator(self):
+        torch.manual_seed(1)
+        generator = nn.Sequential(nn.Linear(self.HIDDEN, self.VOCAB),
+                                  Cast(torch.float32),
+                                  nn.LogSoftmax(dim=-1))
+        compute = NMTLossCompute(
+            nn.NLLLoss(ignore_index=self.PAD, reduction='sum'),
+            generator, fused=False)
+        output = torch.randn(4, 2, self.HIDDEN)
+        batch = Namespace(tgt=torch.randint(
+            0, self.VOCAB, (5, 2, 1), dtype=torch.long))
+        ref_loss = compute.monolithic_compute_loss(batch, output, None).loss
+        generator.to(torch.bfloat16)
+        loss = compute.monolithic_compute_loss(
+            batch, output.to(torch.bfloat16), None).loss
+        self.assertAlmostEqual(loss, ref_loss, delta=0.05 * ref_loss)
+
+
+class TestLossScaler(unittest.TestCase):
+
+    def test_dynamic(self):
+        scaler = LossScaler(scale_window=2)
+        scaler.update(overflow=False)
+        self.assertEqual(scaler.scale, 2. ** 15)
+        scaler.update(overflow=False)
+        self.assertEqual(scaler.scale, 2. ** 16)
+        scaler.update(overflow=True)
+        self.assertEqual(scaler.scale, 2. ** 15)
+
+    def test_static(self):
+        scaler = LossScaler(128.)
+        scaler.update(overflow=True)
+        self.assertEqual(scaler.scale, 128.)
+        self.assertEqual(scaler.skipped_steps, 1)
@@ -0,0 +1,152 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+from itertools import islice
+
+import torch
+
+import onmt.inputters as inputters
+from onmt.inputters.inputter import OrderedIterator, DatasetLazyIter, \
+    max_tok_len
+
+SRC = ["a b c", "a b", "c d e f", "b", "d d e a b", "e f"] * 7
+TGT = ["x y", "y z w", "x", "w w x y", "z", "x y z"] * 7
+
+
+class TestMmapDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "data.train.0.bin")
+        counters = inputters.write_mmap_shard(self.path, SRC, TGT)
+        self.fields = inputters.get_fields("text", 0, 0)
+        for name in ["src", "tgt"]:
+            inputters.inputter._build_field_vocab(
+                self.fields[name], counters[name])
+        inputters.numericalize_mmap_shard(self.path, self.fields)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_counts(self):
+        dataset = inputters.MmapDataset(self.path)
+        self.assertEqual(len(dataset), len(SRC))
+        self.assertEqual(dataset.counter("src"),
+                         Counter(" ".join(SRC).split()))
+        self.assertEqual(dataset.counter("tgt"),
+                         Counter(" ".join(TGT).split()))
+
+    def _compare(self, batch_size, batch_size_fn=None):
+        fields = {k: self.fields[k] for k in ["src", "tgt", "indices"]}
+        data = inputters.build_dataset(fields, "text", src=SRC, tgt=TGT,
+                                       use_filter_pred=False)
+        data.fields = fields
+        ref_iter = OrderedIterator(
+            dataset=data, batch_size=batch_size, batch_size_fn=batch_size_fn,
+            device="cpu", train=False, sort=False, sort_within_batch=True,
+            repeat=False)
+        mmap_iter = inputters.MmapIterator(
+            inputters.MmapDataset(self.path), fields, batch_size,
+            token_batching=batch_size_fn is not None, device="cpu",
+            train=False)
+        n_batches = 0
+        for ref, batch in zip(ref_iter, mmap_iter):
+            self.assertTrue(torch.equal(ref.src[0], batch.src[0]))
+            self.assertTrue(torch.equal(ref.src[1], batch.src[1]))
+            self.assertTrue(torch.equal(ref.tgt, batch.tgt))
+            self.assertTrue(torch.equal(ref.indices, batch.indices))
+            n_batches += 1
+        self.assertEqual(n_batches, len(list(mmap_iter)))
+
+    def test_batches_match_torchtext(self):
+        self._compare(4)
+
+    def test_token_batches_match_torchtext(self):
+        self._compare(30, max_tok_len)
+
+    def test_train_batches_cover_shard(self):
+        mmap_iter = inputters.MmapIterator(
+            inputters.MmapDataset(self.path), self.fields, 5, device="cpu")
+        indices = torch.cat([b.indices for b in mmap_iter])
+        self.assertEqual(sorted(indices.tolist()), list(range(len(SRC))))
+
+    def test_prefetch_matches_sequential(self):
+        paths = [self.path]
+        for i in range(1, 3):
+            path = os.path.join(self.tmp_dir, "data.train.%d.bin" % i)
+            inputters.write_mmap_shard(path, SRC[i:], TGT[i:])
+            inputters.numericalize_mmap_shard(path, self.fields)
+            paths.append(path)
+
+        def batches(num_workers):
+            data_iter = DatasetLazyIter(
+                paths, self.fields, 4, None, "cpu", False,
+                num_workers=num_workers, prefetch_batches=2)
+            return [b.indices.tolist() for b in data_iter]
+
+        self.assertEqual(batches(0), batches(2))
+
+    def test_prefetch_train_is_reproducible(self):
+        data_iter = DatasetLazyIter(
+            [self.path] * 3, self.fields, 4, None, "cpu", True,
+            num_workers=2)
+
+        def batches():
+            random.seed(1)
+            return [b.indices.tolist() for b in islice(data_iter, 50)]
+
+        self.assertEqual(batches(), batches())
+
+    def test_strided_batches_partition_shard(self):
+        fields = {k: self.fields[k] for k in ["src", "tgt", "indices"]}
+        data = inputters.build_dataset(fields, "text", src=SRC, tgt=TGT,
+                                       use_filter_pred=False)
+        data.fields = fields
+
+        def ordered(stride=1, offset=0):
+            it = OrderedIterator(
+                dataset=data, batch_size=4, device="cpu", train=False,
+                sort=False, sort_within_batch=True, repeat=False,
+                stride=stride, offset=offset)
+            return [b.indices.tolist() for b in it]
+
+        def mapped(stride=1, offset=0):
+            it = inputters.MmapIterator(
+                inputters.MmapDataset(self.path), fields, 4, device="cpu",
+                train=False, stride=stride, offset=offset)
+            return [b.indices.tolist() for b in it]
+
+        for batches in [ordered, mapped]:
+            everything = batches()
+            self.assertEqual(batches(3, 0), everything[0::3])
+            self.assertEqual(batches(3, 1), everything[1::3])
+            self.assertEqual(batches(3, 2), everything[2::3])
+
+    def test_strided_train_batches_cover_shard_once(self):
+        fields = {k: self.fields[k] for k in ["src", "tgt", "indices"]}
+        pt_path = os.path.join(self.tmp_dir, "data.train.0.pt")
+        inputters.build_dataset(fields, "text", src=SRC, tgt=TGT,
+                                use_filter_pred=False).save(pt_path)
+
+        def batches(path, stride, offset, num_workers, n):
+            data_iter = DatasetLazyIter(
+                [path], fields, 4, None, "cpu", True,
+                num_workers=num_workers, stride=stride, offset=offset,
+                seed=3)
+            # ranks do not share the global random state
+            random.seed(offset)
+            return [b.indices.tolist() for b in islice(data_iter, n)]
+
+        # batches of a pass over the shard
+        n = (len(SRC) + 3) // 4
+        for path in [pt_path, self.path]:
+            for num_workers in [0, 2]:
+                indices = []
+                for offset in range(2):
+                    for b in batches(path, 2, offset, num_workers,
+                                     (n + 1 - offset) // 2):
+                        indices += b
+                self.assertEqual(sorted(indices), list(range(len(SRC))))
@@ -5,9 +5,11 @@ from __future__ import print_function
 import configargparse
 import copy
 import unittest
-import glob
 import os
+import shutil
+import tempfile
 import codecs
+from collections import Counter
 
 import onmt
 import onmt.inputters
@@ -37,6 +39,13 @@ class TestData(unittest.TestCase):
         super(TestData, self).__init__(*args, **kwargs)
         self.opt = opt
 
+    def setUp(self):
+        # the shards are saved there
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
     def dataset_build(self, opt):
         fields = onmt.inputters.get_fields("text", 0, 0)
 
@@ -47,15 +56,26 @@ class TestData(unittest.TestCase):
             with codecs.open(opt.tgt_vocab, 'w', 'utf-8') as f:
                 f.write('a\nb\nc\nd\ne\nf\n')
 
-        train_data_files = preprocess.build_save_dataset('train', fields, opt)
+        train_data_files, counters = \
+            preprocess.build_save_dataset('train', fields, opt)
+
+        # counts streamed while building match those of the saved shards
+        shard_counters = [onmt.inputters.inputter.count_shard_tokens(
+            path, fields) for path in train_data_files]
+        for k in counters:
+            self.assertEqual(
+                counters[k], sum([c[k] for c in shard_counters], Counter()))
 
-        preprocess.build_save_vocab(train_data_files, fields, opt)
+        preprocess.build_save_vocab(train_data_files, fields, opt,
+                                    counters=counters)
 
-        preprocess.build_save_dataset('valid', fields, opt)
+        valid_data_files, _ = \
+            preprocess.build_save_dataset('valid', fields, opt)
+
+        if opt.shard_format == 'mmap':
+            preprocess.numericalize_shards(
+                train_data_files + valid_data_files, fields)
 
-        # Remove the generated *pt files.
-        for pt in glob.glob(SAVE_DATA_PREFIX + '*.pt'):
-            os.remove(pt)
         if hasattr(opt, 'src_vocab') and os.path.exists(opt.src_vocab):
             os.remove(opt.src_vocab)
         if hasattr(opt, 'tgt_vocab') and os.path.exists(opt.tgt_vocab):
@@ -72,12 +92,11 @@ def _add_test(param_setting, methodname):
     """
 
     def test_method(self):
-        if param_setting:
-            opt = copy.deepcopy(self.opt)
-            for param, setting in param_setting:
-                setattr(opt, param, setting)
-        else:
-            opt = self.opt
+        opt = copy.deepcopy(self.opt)
+        for param, setting in param_setting:
+            setattr(opt, param, setting)
+        opt.save_data = os.path.join(
+            self.tmp_dir, os.path.basename(SAVE_DATA_PREFIX))
         getattr(self, methodname)(opt)
     if param_setting:
         name = 'test_' + methodname + "_" + "_".join(
@@ -111,6 +130,16 @@ test_databuild = [[],
                    ('max_shard_size', 500000)],
                   [('src_vocab', '/tmp/src_vocab.txt'),
                    ('tgt_vocab', '/tmp/tgt_vocab.txt')],
+                  [('shard_format', 'mmap')],
+                  [('shard_format', 'mmap'),
+                   ('shard_size', 500)],
+                  [('shard_format', 'mmap'),
+                   ('share_vocab', True)],
+                  [('shard_format', 'mmap'),
+                   ('shard_size', 500),
+                   ('num_workers', 2)],
+                  [('shard_size', 500),
+                   ('num_workers', 2)],
                   ]
 
 for p in test_databuild:
@@ -0,0 +1,258 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from onmt.translate.translation_server import BatchScheduler, \
+    ModelPool, ServerModel, ServerModelError, TranslationCache, \
+    TranslationServer
+
+
+class TestBatchScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def translate_fn(self, texts, emit):
+        self.release.wait()
+        self.calls.append(list(texts))
+        for t in texts:
+            if t == "fail":
+                raise ServerModelError("failed")
+            emit([len(t)], [t.upper()])
+
+    def run_requests(self, scheduler, requests):
+        results = [None] * len(requests)
+
+        def request(i):
+            try:
+                results[i] = scheduler.translate(requests[i])
+            except ServerModelError as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=request, args=(i,))
+                   for i in range(len(requests))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_single_request(self):
+        scheduler = BatchScheduler(self.translate_fn, max_wait=0)
+        scores, preds = scheduler.translate(["a", "bb"])
+        self.assertEqual(scores, [[1], [2]])
+        self.assertEqual(preds, [["A"], ["BB"]])
+
+    def test_concurrent_requests_are_coalesced(self):
+        scheduler = BatchScheduler(self.translate_fn, max_batch_size=100,
+                                   max_wait=1.)
+        requests = [["r%d.%d" % (i, j) for j in range(i + 1)]
+                    for i in range(4)]
+        results = self.run_requests(scheduler, requests)
+        # all requests arrive within max_wait
+        self.assertEqual(len(self.calls), 1)
+        for texts, (scores, preds) in zip(requests, results):
+            self.assertEqual(preds, [[t.upper()] for t in texts])
+            self.assertEqual(scores, [[len(t)] for t in texts])
+
+    def test_max_batch_size(self):
+        self.release.clear()
+        scheduler = BatchScheduler(self.translate_fn, max_batch_size=4,
+                                   max_wait=0.05)
+        requests = [["a", "b", "c"]] * 4
+        timer = threading.Timer(0.2, self.release.set)
+        timer.start()
+        results = self.run_requests(scheduler, requests)
+        self.assertTrue(all(len(texts) <= 4 for texts in self.calls))
+        self.assertEqual(sum(len(texts) for texts in self.calls), 12)
+        self.assertEqual(results, [([[1]] * 3, [["A"], ["B"], ["C"]])] * 4)
+
+    def test_results_are_streamed(self):
+        self.release.clear()
+        scheduler = BatchScheduler(self.translate_fn, max_wait=0)
+        results = scheduler.translate_iter(["a", "b"])
+        self.release.set()
+        self.assertEqual(next(results), ([1], ["A"]))
+        self.assertEqual(next(results), ([1], ["B"]))
+        self.assertEqual(list(results), [])
+        self.assertEqual(list(scheduler.translate_iter([])), [])
+
+    def test_errors_after_partial_results(self):
+        scheduler = BatchScheduler(self.translate_fn, max_wait=0)
+        results = scheduler.translate_iter(["a", "fail", "b"])
+        self.assertEqual(next(results), ([1], ["A"]))
+        with self.assertRaises(ServerModelError):
+            next(results)
+
+    def test_errors_reach_the_batch_requests(self):
+        scheduler = BatchScheduler(self.translate_fn, max_batch_size=2,
+                                   max_wait=1.)
+        results = self.run_requests(scheduler, [["fail"], ["ok"]])
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(isinstance(r, ServerModelError)
+                            for r in results))
+        # the scheduler keeps running
+        self.assertEqual(scheduler.translate(["ok"]), ([[2]], [["OK"]]))
+
+
+class TestTranslationCache(unittest.TestCase):
+
+    def put(self, cache, text):
+        cache.put(cache.key({"beam_size": 5}, text), [-1.], [text.upper()])
+
+    def get(self, cache, text, model_id=0):
+        return cache.get(model_id, cache.key({"beam_size": 5}, text))
+
+    def test_keys(self):
+        key = TranslationCache.key
+        self.assertEqual(key({"beam_size": 5}, "a  b "),
+                         key({"beam_size": 5}, "a b"))
+        self.assertNotEqual(key({"beam_size": 5}, "a b"),
+                            key({"beam_size": 1}, "a b"))
+
+    def test_lru(self):
+        cache = TranslationCache(size=2)
+        self.put(cache, "a")
+        self.put(cache, "b")
+        self.assertEqual(self.get(cache, "a"), ([-1.], ["A"]))
+        self.put(cache, "c")
+        # b is the least recently used
+        self.assertIsNone(self.get(cache, "b"))
+        self.assertEqual(self.get(cache, "c"), ([-1.], ["C"]))
+        stats = cache.stats(0)
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+        self.assertEqual(stats["entries"], 2)
+        self.assertGreater(stats["memory_bytes"], 0)
+        self.assertEqual(cache.stats(1)["hits"], 0)
+
+    def test_ttl(self):
+        cache = TranslationCache(ttl=0.05)
+        self.put(cache, "a")
+        self.assertIsNotNone(self.get(cache, "a"))
+        time.sleep(0.1)
+        self.assertIsNone(self.get(cache, "a"))
+        self.assertEqual(cache.stats(0)["memory_bytes"], 0)
+
+    def test_disk_spill(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "cache")
+            cache = TranslationCache(size=1, path=path)
+            self.put(cache, "a")
+            self.put(cache, "b")
+            self.assertEqual(cache.stats(0)["disk_entries"], 1)
+            self.assertEqual(self.get(cache, "a"), ([-1.], ["A"]))
+            cache.disk.close()
+            # the store outlives the cache
+            cache = TranslationCache(size=1, path=path)
+            self.assertEqual(self.get(cache, "b"), ([-1.], ["B"]))
+            cache.disk.close()
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_replaced_checkpoint_misses(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "model.pt")
+            with open(path, "wb") as f:
+                f.write(b"old model")
+            model = ServerModel({"models": "model.pt", "beam_size": 5}, 0,
+                                model_root=tmp)
+            cache = TranslationCache()
+
+            def get():
+                return cache.get(0, cache.key(model.checkpoint_key(), "a"))
+
+            cache.put(cache.key(model.checkpoint_key(), "a"), [-1.], ["A"])
+            self.assertEqual(get(), ([-1.], ["A"]))
+            # another checkpoint at the same path
+            with open(path, "wb") as f:
+                f.write(b"new model!")
+            self.assertIsNone(get())
+        finally:
+            shutil.rmtree(tmp)
+
+
+class FakeModel(object):
+    """ Stands for a `ServerModel` in the pool tests. """
+
+    def __init__(self, model_id, memory=100, loaded=True):
+        self.model_id = model_id
+        self.memory = memory
+        self.loaded = loaded
+        self.release = threading.Event()
+        self.release.set()
+        self.logger = logging.getLogger()
+
+    def run_stream(self, inputs):
+        self.release.wait()
+        for i, inp in enumerate(inputs):
+            yield i, inp["src"].upper(), 0.
+
+    def unload(self):
+        self.loaded = False
+
+
+class TestModelPool(unittest.TestCase):
+
+    def test_least_loaded_replica(self):
+        replicas = [FakeModel(0), FakeModel(0)]
+        pool = ModelPool(replicas)
+        replicas[0].release.clear()
+        busy = pool.run_stream([{"src": "a"}, {"src": "b"}])
+        thread = threading.Thread(target=list, args=(busy,))
+        thread.start()
+        while not pool.busy:
+            time.sleep(0.01)
+        self.assertEqual(pool.in_flight, [2, 0])
+        # the second replica takes the next request
+        outputs = list(pool.run_stream([{"src": "c"}]))
+        self.assertEqual(outputs, [(0, "C", 0.)])
+        replicas[0].release.set()
+        thread.join()
+        self.assertEqual(pool.in_flight, [0, 0])
+        self.assertFalse(pool.busy)
+
+    def test_memory(self):
+        pool = ModelPool([FakeModel(0), FakeModel(0, loaded=False)])
+        self.assertEqual(pool.memory, 100)
+        pool.unload()
+        self.assertFalse(pool.loaded)
+        self.assertEqual(pool.memory, 0)
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TranslationServer()
+        self.server.memory_budget = 300
+        for model_id in range(3):
+            pool = ModelPool([FakeModel(model_id)])
+            pool.last_used = model_id
+            self.server.models[model_id] = pool
+
+    def loaded(self):
+        return [model_id for model_id, pool in self.server.models.items()
+                if pool.loaded]
+
+    def test_lru_eviction(self):
+        self.server.models[0].last_used = 10
+        self.server.make_room(FakeModel(3, loaded=False))
+        # model 1 was used least recently
+        self.assertEqual(self.loaded(), [0, 2])
+
+    def test_busy_models_are_kept(self):
+        self.server.models[0].in_flight = [1]
+        self.server.make_room(FakeModel(3, memory=200, loaded=False))
+        self.assertEqual(self.loaded(), [0])
+
+    def test_no_budget(self):
+        self.server.memory_budget = None
+        self.server.make_room(FakeModel(3, loaded=False))
+        self.assertEqual(self.loaded(), [0, 1, 2])
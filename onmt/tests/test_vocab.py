@@ -0,0 +1,31 @@
+import pickle
+import unittest
+from collections import Counter
+
+from torchtext.vocab import Vocab
+
+from onmt.inputters.vocab import CompactVocab
+
+
+class TestCompactVocab(unittest.TestCase):
+
+    def setUp(self):
+        counter = Counter(u"le chat mangé le poisson et la souris".split())
+        self.vocab = Vocab(counter,
+                           specials=['<unk>', '<blank>', '<s>', '</s>'])
+        self.compact = CompactVocab.from_vocab(self.vocab)
+
+    def test_lookups_match_torchtext(self):
+        self.assertEqual(len(self.compact), len(self.vocab))
+        self.assertEqual(list(self.compact.itos), self.vocab.itos)
+        for w, i in self.vocab.stoi.items():
+            self.assertEqual(self.compact.stoi[w], i)
+        self.assertEqual(self.compact.stoi[u'chien'], 0)
+        self.assertNotIn(u'chien', self.compact.stoi)
+        self.assertEqual(self.compact.stoi.get(u'chien', 1), 1)
+
+    def test_pickle(self):
+        loaded = pickle.loads(pickle.dumps(self.compact))
+        self.assertEqual(loaded, self.compact)
+        self.assertEqual(loaded.stoi[u'mangé'], self.vocab.stoi[u'mangé'])
+        self.assertEqual(loaded.itos[-1], self.vocab.itos[-1])
@@ -14,8 +14,10 @@ import onmt.opts as opts
 
 from onmt.inputters.inputter import build_dataset_iter, \
     load_fields, _collect_report_features
+from onmt.inputters.mmap_dataset import MmapDataset, MMAP_SUFFIX
 from onmt.model_builder import build_model
 from onmt.utils.optimizers import build_optim
+from onmt.utils.distributed import all_reduce_numbers
 from onmt.trainer import build_trainer
 from onmt.models import build_model_saver
 from onmt.utils.logging import init_logger, logger
@@ -111,7 +113,12 @@ def main(opt, device_id):
     # Load a shard dataset to determine the data_type.
     # (All datasets have the same data_type).
     # this should be refactored out of existence reasonably soon
-    first_dataset = torch.load(glob.glob(opt.data + '.train*.pt')[0])
+    pt_files = glob.glob(opt.data + '.train*.pt')
+    if pt_files:
+        first_dataset = torch.load(pt_files[0])
+    else:
+        first_dataset = MmapDataset(
+            glob.glob(opt.data + '.train*' + MMAP_SUFFIX)[0])
     data_type = first_dataset.data_type
 
     # Load fields generated from preprocess phase.
@@ -144,7 +151,19 @@ def main(opt, device_id):
     trainer = build_trainer(opt, device_id, model, fields,
                             optim, data_type, model_saver=model_saver)
 
-    train_iter = build_dataset_iter("train", fields, opt)
+    # each rank only reads its own share of the training batches, which
+    # are only disjoint if all ranks shuffle the shards alike
+    if opt.world_size > 1:
+        stride, offset = opt.world_size, opt.gpu_ranks[device_id]
+        seed = opt.seed
+        if seed <= 0:
+            # the seed of the first rank
+            seed = random.randint(0, 2 ** 31 - 1) if offset == 0 else 0
+            seed = int(all_reduce_numbers([seed])[0])
+    else:
+        stride, offset, seed = 1, 0, None
+    train_iter = build_dataset_iter("train", fields, opt,
+                                    stride=stride, offset=offset, seed=seed)
     valid_iter = build_dataset_iter("valid", fields, opt, is_train=False)
 
     if len(opt.gpu_ranks):
@@ -101,6 +101,20 @@ class Trainer(object):
         self.gpu_verbose_level = gpu_verbose_level
         self.report_manager = report_manager
         self.model_saver = model_saver
+        # all-reduces the gradients during the backward
+        self.grad_reducer = None
+        if n_gpu > 1:
+            params = list(self.model.parameters())
+            if not getattr(self.train_loss, "fused", False):
+                # the loss shards accumulate the generator gradients
+                # before the backward that syncs: all-reduce them last
+                generator = set(
+                    id(p) for p in self.model.generator.parameters())
+                params = [p for p in params if id(p) in generator] + \
+                    [p for p in params if id(p) not in generator]
+            self.grad_reducer = onmt.utils.distributed.GradientReducer(
+                params)
+            self.train_loss.grad_reducer = self.grad_reducer
 
         assert grad_accum_count > 0
         if grad_accum_count > 1:
@@ -140,11 +154,15 @@ class Trainer(object):
         report_stats = onmt.utils.Statistics()
         self._start_report_manager(start_time=total_stats.start_time)
 
+        # iterators built with a stride already yield only our batches
+        shared_iter = self.n_gpu > 1 and \
+            getattr(train_iter, 'stride', 1) == 1
+
         while step <= train_steps:
 
             reduce_counter = 0
             for i, batch in enumerate(train_iter):
-                if self.n_gpu == 0 or (i % self.n_gpu == self.gpu_rank):
+                if not shared_iter or (i % self.n_gpu == self.gpu_rank):
                     if self.gpu_verbose_level > 1:
                         logger.info("GpuRank %d: index: %d accum: %d"
                                     % (self.gpu_rank, i, accum))
@@ -166,22 +184,26 @@ class Trainer(object):
                                         % (self.gpu_rank, reduce_counter,
                                            len(true_batchs)))
                         if self.n_gpu > 1:
-                            normalization = sum(onmt.utils.distributed
-                                                .all_gather_list
-                                                (normalization))
+                            normalization = onmt.utils.distributed \
+                                .all_reduce_numbers([normalization])[0]
 
+                        optim_step = self.optim._step
                         self._gradient_accumulation(
                             true_batchs, normalization, total_stats,
                             report_stats)
+                        true_batchs = []
+                        accum = 0
+                        normalization = 0
+                        if self.optim._step == optim_step:
+                            # the loss scaler skipped the update on
+                            # overflow: not a training step
+                            continue
 
                         report_stats = self._maybe_report_training(
                             step, train_steps,
                             self.optim.learning_rate,
                             report_stats)
 
-                        true_batchs = []
-                        accum = 0
-                        normalization = 0
                         if (step % valid_steps == 0):
                             if self.gpu_verbose_level > 0:
                                 logger.info('GpuRank %d: validate step %d'
@@ -251,7 +273,10 @@ class Trainer(object):
         if self.grad_accum_count > 1:
             self.model.zero_grad()
 
-        for batch in true_batchs:
+        for k, batch in enumerate(true_batchs):
+            if self.grad_reducer is not None:
+                # only the last backward before the step all-reduces
+                self.grad_reducer.sync = k == len(true_batchs) - 1
             target_size = batch.tgt.size(0)
             # Truncated BPTT: reminder not compatible with accum > 1
             if self.trunc_size:
@@ -263,11 +288,12 @@ class Trainer(object):
             src = inputters.make_features(batch, 'src', self.data_type)
             if self.data_type == 'text':
                 _, src_lengths = batch.src
-                report_stats.n_src_words += src_lengths.sum().item()
             elif self.data_type == 'audio':
                 src_lengths = batch.src_lengths
             else:
                 src_lengths = None
+            report_stats.update_batch(
+                batch, src_lengths if self.data_type == 'text' else None)
 
             tgt_outer = inputters.make_features(batch, 'tgt')
 
@@ -281,10 +307,12 @@ class Trainer(object):
                 outputs, attns = \
                     self.model(src, tgt, src_lengths)
 
-                # 3. Compute loss in shards for memory efficiency.
+                # 3. Compute loss in shards for memory efficiency,
+                # scaled for mixed precision.
                 batch_stats = self.train_loss.sharded_compute_loss(
                     batch, outputs, attns, j,
-                    trunc_size, self.shard_size, normalization)
+                    trunc_size, self.shard_size,
+                    normalization / self.optim.loss_scale)
                 total_stats.update(batch_stats)
                 report_stats.update(batch_stats)
 
@@ -292,11 +320,7 @@ class Trainer(object):
                 if self.grad_accum_count == 1:
                     # Multi GPU gradient gather
                     if self.n_gpu > 1:
-                        grads = [p.grad.data for p in self.model.parameters()
-                                 if p.requires_grad
-                                 and p.grad is not None]
-                        onmt.utils.distributed.all_reduce_and_rescale_tensors(
-                            grads, float(1))
+                        self.grad_reducer.finish()
                     self.optim.step()
 
                 # If truncated, don't backprop fully.
@@ -310,11 +334,7 @@ class Trainer(object):
         # update only after accum batches
         if self.grad_accum_count > 1:
             if self.n_gpu > 1:
-                grads = [p.grad.data for p in self.model.parameters()
-                         if p.requires_grad
-                         and p.grad is not None]
-                onmt.utils.distributed.all_reduce_and_rescale_tensors(
-                    grads, float(1))
+                self.grad_reducer.finish()
             self.optim.step()
 
     def _start_report_manager(self, start_time=None):
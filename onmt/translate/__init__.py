@@ -1,11 +1,12 @@
 """ Modules for translation """
 from onmt.translate.translator import Translator
 from onmt.translate.translation import Translation, TranslationBuilder
-from onmt.translate.beam import Beam, GNMTGlobalScorer
+from onmt.translate.beam import BeamSearch, GNMTGlobalScorer
+from onmt.translate.ngram_blocker import NGramBlocker
 from onmt.translate.penalties import PenaltyBuilder
 from onmt.translate.translation_server import TranslationServer, \
     ServerModelError
 
-__all__ = ['Translator', 'Translation', 'Beam',
-           'GNMTGlobalScorer', 'TranslationBuilder',
+__all__ = ['Translator', 'Translation', 'BeamSearch',
+           'GNMTGlobalScorer', 'NGramBlocker', 'TranslationBuilder',
            'PenaltyBuilder', 'TranslationServer', 'ServerModelError']
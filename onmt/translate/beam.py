@@ -1,181 +1,289 @@
 from __future__ import division
 import torch
 from onmt.translate import penalties
+from onmt.translate.ngram_blocker import NGramBlocker
 
 
-class Beam(object):
+class BeamSearch(object):
     """
-    Class for managing the internals of the beam search process.
+    Class for managing the internals of the beam search process,
+    for a whole batch at once.
 
-    Takes care of beams, back pointers, and scores.
+    The `beam_size` hypotheses of each sentence are rows of
+    `[batch_size * beam_size, ...]` tensors, advanced together with tensor
+    ops. A sentence leaves the search when its best hypothesis ended and
+    `n_best` hypotheses are finished; its translations are then in
+    `predictions`, `scores` and `attention`.
 
     Args:
-       size (int): beam size
+       beam_size (int): beam size
+       batch_size (int): number of sentences
        pad, bos, eos (int): indices of padding, beginning, and ending.
        n_best (int): nbest size to use
-       cuda (bool): use gpu
        global_scorer (:obj:`GlobalScorer`)
+       min_length (int): <eos> is blocked while hypotheses, <s> included,
+          are shorter
+       max_length (int): maximum number of decoding steps
+       memory_lengths (LongTensor): `[batch_size * beam_size]` source
+          lengths
+       stepwise_penalty (bool): apply the coverage penalty at every step
+       block_ngram_repeat (int): block hypotheses repeating an n-gram of
+          this size
+       exclusion_tokens (set): n-grams with these tokens are not blocked
+       trace (bool): keep the predictions, backpointers and scores of
+          every step in `trace` (for `-dump_beam`)
     """
 
-    def __init__(self, size, pad, bos, eos,
-                 n_best=1, cuda=False,
+    def __init__(self, beam_size, batch_size, pad, bos, eos,
+                 n_best=1,
                  global_scorer=None,
                  min_length=0,
+                 max_length=100,
+                 memory_lengths=None,
                  stepwise_penalty=False,
                  block_ngram_repeat=0,
-                 exclusion_tokens=set()):
+                 exclusion_tokens=set(),
+                 trace=False):
 
-        self.size = size
-        self.tt = torch.cuda if cuda else torch
-
-        # The score for each translation on the beam.
-        self.scores = self.tt.FloatTensor(size).zero_()
-        self.all_scores = []
-
-        # The backpointers at each time-step.
-        self.prev_ks = []
-
-        # The outputs at each time-step.
-        self.next_ys = [self.tt.LongTensor(size)
-                        .fill_(pad)]
-        self.next_ys[0][0] = bos
-
-        # Has EOS topped the beam yet.
-        self._eos = eos
-        self.eos_top = False
-
-        # The attentions (matrix) for each time.
-        self.attn = []
-
-        # Time and k pair for finished.
-        self.finished = []
+        self.beam_size = beam_size
+        self.pad = pad
+        self.eos = eos
         self.n_best = n_best
-
-        # Information for global scoring.
         self.global_scorer = global_scorer
-        self.global_state = {}
-
-        # Minimum prediction length
         self.min_length = min_length
-
-        # Apply Penalty at every step
+        self.max_length = max_length
+        self.memory_lengths = memory_lengths
         self.stepwise_penalty = stepwise_penalty
         self.block_ngram_repeat = block_ngram_repeat
-        self.exclusion_tokens = exclusion_tokens
+        device = memory_lengths.device
+
+        # Translations of the finished sentences.
+        self.predictions = [[] for _ in range(batch_size)]  # noqa: F812
+        self.scores = [[] for _ in range(batch_size)]  # noqa: F812
+        self.attention = [[] for _ in range(batch_size)]  # noqa: F812
+        self.hypotheses = [[] for _ in range(batch_size)]  # noqa: F812
+        self.done = False
+
+        # Original index in the batch of the sentences still searched.
+        self.batch_offset = torch.arange(batch_size, dtype=torch.long)
+        self._beam_offset = torch.arange(
+            0, batch_size * beam_size, step=beam_size, dtype=torch.long,
+            device=device)
+        self.top_beam_finished = torch.zeros([batch_size], dtype=torch.uint8)
+
+        # The hypotheses, their attention and their scores.
+        self.alive_seq = torch.full(
+            [batch_size * beam_size, 1], bos, dtype=torch.long,
+            device=device)
+        self.alive_attn = None
+        # Give full probability to the first beam on the first step.
+        self.topk_log_probs = torch.tensor(
+            [0.0] + [float("-inf")] * (beam_size - 1), device=device
+        ).repeat(batch_size)
+        self.select_indices = None
+        self.is_finished = None
 
-    def get_current_state(self):
+        # Information for global scoring.
+        self.coverage = None
+        self.prev_penalty = None
+
+        self.ngram_blocker = None
+        if block_ngram_repeat > 0:
+            self.ngram_blocker = NGramBlocker(
+                block_ngram_repeat, batch_size * beam_size,
+                exclusion_tokens=exclusion_tokens, device=device)
+
+        self.trace = None
+        if trace:
+            self.trace = [{"predicted_ids": [], "beam_parent_ids": [],
+                           "scores": []} for _ in range(batch_size)]
+
+    @property
+    def current_predictions(self):
         "Get the outputs for the current timestep."
-        return self.next_ys[-1]
+        return self.alive_seq[:, -1]
 
-    def get_current_origin(self):
-        "Get the backpointers for the current timestep."
-        return self.prev_ks[-1]
+    def _cov_penalty(self, cov):
+        # padding positions are neutral for both coverage penalties
+        pad = torch.arange(cov.size(1), device=cov.device).unsqueeze(0) \
+            .ge(self.memory_lengths.unsqueeze(1))
+        return self.global_scorer.cov_penalty(
+            cov.masked_fill(pad, 1.0), self.global_scorer.beta)
 
-    def advance(self, word_probs, attn_out):
+    def advance(self, log_probs, attn):
         """
-        Given prob over words for every last beam `wordLk` and attention
-        `attn_out`: Compute and update the beam search.
+        Given the log probs over words of every hypothesis and their
+        attention, extend the hypotheses with the `beam_size` best words
+        of each sentence.
 
         Parameters:
 
-        * `word_probs`- probs of advancing from the last step (K x words)
-        * `attn_out`- attention at the last step
+        * `log_probs`- probs of advancing from the last step
+          `[batch * beam, words]`
+        * `attn`- attention at the last step `[1, batch * beam, src_len]`
 
-        Returns: True if beam search is complete.
+        Sets `select_indices`, the hypothesis each new one extends, and
+        `is_finished`, `[batch, beam]`.
         """
-        num_words = word_probs.size(1)
-        if self.stepwise_penalty:
-            self.global_scorer.update_score(self, attn_out)
+        vocab_size = log_probs.size(-1)
+        beam_size = self.beam_size
+        _B = self.topk_log_probs.size(0) // beam_size
+        step = self.alive_seq.size(1) - 1
+
+        if self.stepwise_penalty and self.prev_penalty is not None:
+            self.topk_log_probs += self.prev_penalty
+            self.topk_log_probs -= self._cov_penalty(self.coverage + attn[0])
         # force the output to be longer than self.min_length
-        cur_len = len(self.next_ys)
-        if cur_len < self.min_length:
-            for k in range(len(word_probs)):
-                word_probs[k][self._eos] = -1e20
+        if step + 1 < self.min_length:
+            log_probs[:, self.eos] = -1e20
+
         # Sum the previous scores.
-        if len(self.prev_ks) > 0:
-            beam_scores = word_probs + self.scores.unsqueeze(1)
-            # Don't let EOS have children.
-            for i in range(self.next_ys[-1].size(0)):
-                if self.next_ys[-1][i] == self._eos:
-                    beam_scores[i] = -1e20
-
-            # Block ngram repeats
-            if self.block_ngram_repeat > 0:
-                ngrams = []
-                le = len(self.next_ys)
-                for j in range(self.next_ys[-1].size(0)):
-                    hyp, _ = self.get_hyp(le - 1, j)
-                    ngrams = set()
-                    fail = False
-                    gram = []
-                    for i in range(le - 1):
-                        # Last n tokens, n = block_ngram_repeat
-                        gram = (gram +
-                                [hyp[i].item()])[-self.block_ngram_repeat:]
-                        # Skip the blocking if it is in the exclusion list
-                        if set(gram) & self.exclusion_tokens:
-                            continue
-                        if tuple(gram) in ngrams:
-                            fail = True
-                        ngrams.add(tuple(gram))
-                    if fail:
-                        beam_scores[j] = -10e20
+        log_probs += self.topk_log_probs.unsqueeze(1)
+        if self.ngram_blocker is not None:
+            log_probs.masked_fill_(
+                self.ngram_blocker.blocked.unsqueeze(1), -10e20)
+
+        # Flatten probs into a list of possibilities.
+        curr_scores = log_probs.view(_B, beam_size * vocab_size)
+        topk_scores, topk_ids = curr_scores.topk(beam_size, dim=-1)
+        self.topk_log_probs = topk_scores.view(-1)
+
+        # Resolve beam origin and true word ids.
+        topk_beam_index = topk_ids.div(vocab_size)
+        topk_ids = topk_ids.fmod(vocab_size)
+
+        # Map beam_index to batch_index in the flat representation.
+        self.select_indices = (
+            topk_beam_index
+            + self._beam_offset[:_B].unsqueeze(1)).view(-1)
+
+        # Append last prediction.
+        self.alive_seq = torch.cat(
+            [self.alive_seq.index_select(0, self.select_indices),
+             topk_ids.view(-1, 1)], -1)
+        current_attn = attn.index_select(1, self.select_indices)
+        if self.alive_attn is None:
+            self.alive_attn = current_attn
         else:
-            beam_scores = word_probs[0]
-        flat_beam_scores = beam_scores.view(-1)
-        best_scores, best_scores_id = flat_beam_scores.topk(self.size, 0,
-                                                            True, True)
-
-        self.all_scores.append(self.scores)
-        self.scores = best_scores
-
-        # best_scores_id is flattened beam x word array, so calculate which
-        # word and beam each score came from
-        prev_k = best_scores_id / num_words
-        self.prev_ks.append(prev_k)
-        self.next_ys.append((best_scores_id - prev_k * num_words))
-        self.attn.append(attn_out.index_select(0, prev_k))
-        self.global_scorer.update_global_state(self)
-
-        for i in range(self.next_ys[-1].size(0)):
-            if self.next_ys[-1][i] == self._eos:
-                global_scores = self.global_scorer.score(self, self.scores)
-                s = global_scores[i]
-                self.finished.append((s, len(self.next_ys) - 1, i))
-
-        # End condition is when top-of-beam is EOS and no global score.
-        if self.next_ys[-1][0] == self._eos:
-            self.all_scores.append(self.scores)
-            self.eos_top = True
-
-    def done(self):
-        return self.eos_top and len(self.finished) >= self.n_best
-
-    def sort_finished(self, minimum=None):
-        if minimum is not None:
-            i = 0
-            # Add from beam until we have minimum outputs.
-            while len(self.finished) < minimum:
-                global_scores = self.global_scorer.score(self, self.scores)
-                s = global_scores[i]
-                self.finished.append((s, len(self.next_ys) - 1, i))
-                i += 1
-
-        self.finished.sort(key=lambda a: -a[0])
-        scores = [sc for sc, _, _ in self.finished]
-        ks = [(t, k) for _, t, k in self.finished]
-        return scores, ks
-
-    def get_hyp(self, timestep, k):
+            self.alive_attn = self.alive_attn.index_select(
+                1, self.select_indices)
+            self.alive_attn = torch.cat([self.alive_attn, current_attn], 0)
+
+        # Keeps the coverage vector as sum of attentions.
+        if self.global_scorer.has_cov_pen:
+            if self.coverage is None:
+                self.coverage = current_attn[0]
+                self.prev_penalty = torch.zeros_like(self.topk_log_probs)
+            else:
+                self.coverage = self.coverage.index_select(
+                    0, self.select_indices) + current_attn[0]
+                if self.stepwise_penalty:
+                    self.prev_penalty = self._cov_penalty(self.coverage)
+
+        if self.ngram_blocker is not None:
+            select_indices = self.select_indices
+            self.ngram_blocker.map_state(
+                lambda state: state.index_select(0, select_indices))
+            self.ngram_blocker.advance(topk_ids.view(-1))
+
+        self.is_finished = topk_ids.eq(self.eos)
+
+        if self.trace is not None:
+            ids = topk_ids.tolist()
+            parents = topk_beam_index.tolist()
+            scores = topk_scores.tolist()
+            for i, b in enumerate(self.batch_offset.tolist()):
+                self.trace[b]["predicted_ids"].append(ids[i])
+                self.trace[b]["beam_parent_ids"].append(parents[i])
+                self.trace[b]["scores"].append(scores[i])
+
+    def update_finished(self):
         """
-        Walk back to construct the full hypothesis.
+        Save the finished hypotheses and remove the sentences that are
+        done from the search. On the last step, sentences with fewer than
+        `n_best` finished hypotheses are completed with their best
+        unfinished ones.
         """
-        hyp, attn = [], []
-        for j in range(len(self.prev_ks[:timestep]) - 1, -1, -1):
-            hyp.append(self.next_ys[j + 1][k])
-            attn.append(self.attn[j][k])
-            k = self.prev_ks[j][k]
-        return hyp[::-1], torch.stack(attn[::-1])
+        beam_size = self.beam_size
+        _B = self.topk_log_probs.size(0) // beam_size
+        last_step = self.alive_seq.size(1) - 1 >= self.max_length
+
+        cov_penalty = None
+        if self.global_scorer.has_cov_pen and not self.stepwise_penalty:
+            cov_penalty = self._cov_penalty(self.coverage)
+        global_scores = self.global_scorer.score(
+            self.topk_log_probs, self.alive_seq.size(1),
+            cov_penalty).view(_B, beam_size)
+        # Don't let EOS have children.
+        self.topk_log_probs.masked_fill_(self.is_finished.view(-1), -1e20)
+
+        is_finished = self.is_finished.to('cpu')
+        self.top_beam_finished |= is_finished[:, 0].eq(1)
+        predictions = self.alive_seq.view(_B, beam_size, -1)
+        attention = self.alive_attn.view(
+            self.alive_attn.size(0), _B, beam_size, -1)
+        memory_lengths = self.memory_lengths.view(_B, beam_size)
+
+        def add(i, j):
+            b = self.batch_offset[i]
+            self.hypotheses[b].append((
+                global_scores[i, j],
+                predictions[i, j, 1:],  # Ignore start_token.
+                attention[:, i, j, :memory_lengths[i, j]]))
+
+        non_finished_batch = []
+        for i in range(_B):
+            b = self.batch_offset[i]
+            for j in is_finished[i].nonzero().view(-1):
+                add(i, j)
+            if last_step:
+                # Add from beam until we have minimum outputs.
+                for j in range(beam_size):
+                    if len(self.hypotheses[b]) >= self.n_best:
+                        break
+                    if not is_finished[i, j]:
+                        add(i, j)
+            elif not (self.top_beam_finished[i]
+                      and len(self.hypotheses[b]) >= self.n_best):
+                non_finished_batch.append(i)
+                continue
+            best_hyp = sorted(
+                self.hypotheses[b], key=lambda x: x[0], reverse=True)
+            for score, pred, attn in best_hyp[:self.n_best]:
+                self.scores[b].append(score)
+                self.predictions[b].append(pred)
+                self.attention[b].append(attn)
+            self.hypotheses[b] = None
+
+        non_finished = torch.tensor(non_finished_batch, dtype=torch.long)
+        # If all sentences are translated, no need to go further.
+        if len(non_finished) == 0:
+            self.done = True
+            return
+        if len(non_finished) == _B:
+            return
+
+        # Remove finished batches for the next step.
+        self.top_beam_finished = self.top_beam_finished.index_select(
+            0, non_finished)
+        self.batch_offset = self.batch_offset.index_select(0, non_finished)
+        non_finished = non_finished.to(self.alive_seq.device)
+
+        def reduce(x):
+            return x.view(_B, beam_size, *x.size()[1:]) \
+                .index_select(0, non_finished).view(-1, *x.size()[1:])
+
+        self.topk_log_probs = reduce(self.topk_log_probs)
+        self.select_indices = reduce(self.select_indices)
+        self.memory_lengths = reduce(self.memory_lengths)
+        self.alive_seq = reduce(self.alive_seq)
+        self.alive_attn = attention.index_select(1, non_finished) \
+            .view(self.alive_attn.size(0), -1, self.alive_attn.size(-1))
+        if self.coverage is not None:
+            self.coverage = reduce(self.coverage)
+            self.prev_penalty = reduce(self.prev_penalty)
+        if self.ngram_blocker is not None:
+            self.ngram_blocker.map_state(reduce)
 
 
 class GNMTGlobalScorer(object):
@@ -197,46 +305,18 @@ class GNMTGlobalScorer(object):
         self.cov_penalty = penalty_builder.coverage_penalty()
         # Probability will be divided by this
         self.length_penalty = penalty_builder.length_penalty()
+        # Coverage is only tracked when it changes the scores
+        self.has_cov_pen = opt.coverage_penalty != "none" and self.beta != 0
 
-    def score(self, beam, logprobs):
+    def score(self, logprobs, cur_len, cov_penalty=None):
         """
-        Rescores a prediction based on penalty functions
+        Rescores hypotheses of length `cur_len` (<s> included) based on
+        penalty functions, subtracting their coverage penalty if given.
         """
-        normalized_probs = self.length_penalty(beam,
+        normalized_probs = self.length_penalty(cur_len,
                                                logprobs,
                                                self.alpha)
-        if not beam.stepwise_penalty:
-            penalty = self.cov_penalty(beam,
-                                       beam.global_state["coverage"],
-                                       self.beta)
-            normalized_probs -= penalty
+        if cov_penalty is not None:
+            normalized_probs = normalized_probs - cov_penalty
 
         return normalized_probs
-
-    def update_score(self, beam, attn):
-        """
-        Function to update scores of a Beam that is not finished
-        """
-        if "prev_penalty" in beam.global_state.keys():
-            beam.scores.add_(beam.global_state["prev_penalty"])
-            penalty = self.cov_penalty(beam,
-                                       beam.global_state["coverage"] + attn,
-                                       self.beta)
-            beam.scores.sub_(penalty)
-
-    def update_global_state(self, beam):
-        "Keeps the coverage vector as sum of attentions"
-        if len(beam.prev_ks) == 1:
-            beam.global_state["prev_penalty"] = beam.scores.clone().fill_(0.0)
-            beam.global_state["coverage"] = beam.attn[-1]
-            self.cov_total = beam.attn[-1].sum(1)
-        else:
-            self.cov_total += torch.min(beam.attn[-1],
-                                        beam.global_state['coverage']).sum(1)
-            beam.global_state["coverage"] = beam.global_state["coverage"] \
-                .index_select(0, beam.prev_ks[-1]).add(beam.attn[-1])
-
-            prev_penalty = self.cov_penalty(beam,
-                                            beam.global_state["coverage"],
-                                            self.beta)
-            beam.global_state["prev_penalty"] = prev_penalty
@@ -0,0 +1,89 @@
+""" Incremental n-gram repeat blocking for the beam searches """
+from __future__ import division
+import torch
+
+
+class NGramBlocker(object):
+    """
+    Detects, for a batch of hypotheses growing one token per step, those
+    which repeated an n-gram, without leaving the device.
+
+    Each hypothesis keeps its last `n` tokens, the rolling hash of that
+    window and the hashes of all its previous n-grams. Appending a token
+    updates the hash in constant time and checks it against the previous
+    ones with a single comparison over the batch. Hashes are int64
+    polynomial hashes, so a false repeat is astronomically unlikely.
+
+    The state has one row per hypothesis and must follow the search:
+    call `map_state` with the beam backpointers before `advance`, and
+    when finished sentences leave the batch.
+
+    Args:
+       n (int): size of the blocked n-grams
+       n_hyps (int): number of hypotheses
+       exclusion_tokens (set): n-grams with one of these tokens are
+          never blocked (`-ignore_when_blocking`)
+       device: device of the search
+    """
+
+    PRIME = 1000003
+
+    def __init__(self, n, n_hyps, exclusion_tokens=None, device=None):
+        self.n = n
+        self.n_tokens = 0
+        # P ** (n - 1), for the token leaving the window
+        self._lead = 1
+        for _ in range(n - 1):
+            self._lead *= self.PRIME
+        self._lead = (self._lead + 2 ** 63) % 2 ** 64 - 2 ** 63
+        self.exclusion_tokens = None
+        if exclusion_tokens:
+            self.exclusion_tokens = torch.tensor(
+                sorted(exclusion_tokens), dtype=torch.long, device=device)
+
+        self.window = torch.zeros([n_hyps, n], dtype=torch.long,
+                                  device=device)
+        self.hash = torch.zeros([n_hyps], dtype=torch.long, device=device)
+        # number of excluded tokens in the window
+        self.excluded = torch.zeros([n_hyps], dtype=torch.long,
+                                    device=device)
+        self.seen = torch.zeros([n_hyps, 0], dtype=torch.long,
+                                device=device)
+        self.blocked = torch.zeros([n_hyps], dtype=torch.uint8,
+                                   device=device)
+
+    def map_state(self, fn):
+        """ Apply `fn` to the state, batch dimension first. """
+        self.window = fn(self.window)
+        self.hash = fn(self.hash)
+        self.excluded = fn(self.excluded)
+        self.seen = fn(self.seen)
+        self.blocked = fn(self.blocked)
+
+    def _is_excluded(self, tokens):
+        return tokens.unsqueeze(1).eq(self.exclusion_tokens) \
+            .any(1).long()
+
+    def advance(self, tokens):
+        """
+        Append `tokens` (`[n_hyps]`) to the hypotheses and update
+        `blocked`, the hypotheses that repeated an n-gram so far.
+        """
+        first = self.window[:, 0]
+        self.hash = (self.hash - first * self._lead) * self.PRIME + tokens
+        if self.exclusion_tokens is not None:
+            self.excluded += self._is_excluded(tokens)
+            if self.n_tokens >= self.n:
+                self.excluded -= self._is_excluded(first)
+        self.window = torch.cat([self.window[:, 1:], tokens.unsqueeze(1)], 1)
+        self.n_tokens += 1
+        if self.n_tokens < self.n:
+            return self.blocked
+
+        if self.seen.size(1) > 0:
+            repeated = self.seen.eq(self.hash.unsqueeze(1)).any(1)
+            if self.exclusion_tokens is not None:
+                repeated &= self.excluded.eq(0)
+            self.blocked |= repeated
+        self.seen = torch.cat([self.seen, self.hash.unsqueeze(1)], 1)
+        return self.blocked
@@ -32,10 +32,13 @@ class PenaltyBuilder(object):
             return self.length_none
 
     """
-    Below are all the different penalty terms implemented so far
+    Below are all the different penalty terms implemented so far.
+    Coverage penalties take the `[n_hyps, src_len]` coverage of each
+    hypothesis, length penalties the length of the hypotheses (counting
+    <s>) and their `[n_hyps]` log probabilities.
     """
 
-    def coverage_wu(self, beam, cov, beta=0.):
+    def coverage_wu(self, cov, beta=0.):
         """
         NMT coverage re-ranking score from
         "Google's Neural Machine Translation System" :cite:`wu2016google`.
@@ -43,7 +46,7 @@ class PenaltyBuilder(object):
         penalty = -torch.min(cov, cov.clone().fill_(1.0)).log().sum(1)
         return beta * penalty
 
-    def coverage_summary(self, beam, cov, beta=0.):
+    def coverage_summary(self, cov, beta=0.):
         """
         Our summary penalty.
         """
@@ -51,29 +54,29 @@ class PenaltyBuilder(object):
         penalty -= cov.size(1)
         return beta * penalty
 
-    def coverage_none(self, beam, cov, beta=0.):
+    def coverage_none(self, cov, beta=0.):
         """
         returns zero as penalty
         """
-        return beam.scores.clone().fill_(0.0)
+        return cov.new_zeros(cov.size(0))
 
-    def length_wu(self, beam, logprobs, alpha=0.):
+    def length_wu(self, cur_len, logprobs, alpha=0.):
         """
         NMT length re-ranking score from
         "Google's Neural Machine Translation System" :cite:`wu2016google`.
         """
 
-        modifier = (((5 + len(beam.next_ys)) ** alpha) /
+        modifier = (((5 + cur_len) ** alpha) /
                     ((5 + 1) ** alpha))
         return (logprobs / modifier)
 
-    def length_average(self, beam, logprobs, alpha=0.):
+    def length_average(self, cur_len, logprobs, alpha=0.):
         """
         Returns the average probability of tokens in a sequence.
         """
-        return logprobs / len(beam.next_ys)
+        return logprobs / cur_len
 
-    def length_none(self, beam, logprobs, alpha=0., beta=0.):
+    def length_none(self, cur_len, logprobs, alpha=0., beta=0.):
         """
         Returns unmodified scores.
         """
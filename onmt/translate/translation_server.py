@@ -9,6 +9,12 @@ import json
 import threading
 import re
 import traceback
+import hashlib
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+from collections import deque, OrderedDict
 
 import torch
 import onmt.opts
@@ -25,9 +31,10 @@ def critical(func):
         if not server_model.running_lock.acquire(blocking=True, timeout=120):
             raise ServerModelError("Model %d running lock timeout"
                                    % server_model.model_id)
-        o = func(server_model, *args, **kwargs)
-        server_model.running_lock.release()
-        return o
+        try:
+            return func(server_model, *args, **kwargs)
+        finally:
+            server_model.running_lock.release()
     return wrapper
 
 
@@ -61,10 +68,221 @@ class ServerModelError(Exception):
     pass
 
 
+class _Job(object):
+    """ The sentences of one request waiting in a `BatchScheduler`. """
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.arrival = time.time()
+        # the results of the sentences, in order, or an exception
+        self.results = queue.Queue()
+
+
+class BatchScheduler(object):
+    """
+    Coalesces the sentences of concurrent requests into shared calls to
+    `translate_fn`, run one at a time by a background thread.
+
+    A batch starts with the oldest waiting request and takes the next
+    ones, in arrival order, until it holds `max_batch_size` sentences or
+    `max_wait` seconds passed since that request arrived. A request is
+    never split: a larger one is translated alone.
+
+    Args:
+        translate_fn: function translating a list of sentences, called
+            with the sentences and a function `emit(scores, predictions)`
+            to call with the `n_best` results of each sentence, in order
+        max_batch_size (int): sentences gathered in a batch
+        max_wait (float): seconds a request waits for others
+        timeout (float): seconds a request waits for each result
+    """
+
+    def __init__(self, translate_fn, max_batch_size=64, max_wait=0.01,
+                 timeout=120):
+        self.translate_fn = translate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def translate(self, texts):
+        """ Translate `texts` within the next batch; blocks until done. """
+        results = list(self.translate_iter(texts))
+        return [r[0] for r in results], [r[1] for r in results]
+
+    def translate_iter(self, texts):
+        """
+        Translate `texts` within the next batch, yielding the scores and
+        predictions of each sentence as soon as they are translated.
+        """
+        if len(texts) == 0:
+            return
+        job = _Job(texts)
+        with self.cond:
+            self.queue.append(job)
+            self.cond.notify()
+        for _ in texts:
+            try:
+                result = job.results.get(timeout=self.timeout)
+            except queue.Empty:
+                with self.cond:
+                    if job in self.queue:
+                        self.queue.remove(job)
+                raise ServerModelError("Translation timeout")
+            if isinstance(result, Exception):
+                raise result
+            yield result
+
+    def _next_batch(self):
+        with self.cond:
+            while not self.queue:
+                self.cond.wait()
+            deadline = self.queue[0].arrival + self.max_wait
+            while True:
+                n_texts = sum(len(job.texts) for job in self.queue)
+                remaining = deadline - time.time()
+                if n_texts >= self.max_batch_size or remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            jobs = [self.queue.popleft()]
+            n_texts = len(jobs[0].texts)
+            while self.queue and n_texts + len(self.queue[0].texts) \
+                    <= self.max_batch_size:
+                jobs.append(self.queue.popleft())
+                n_texts += len(jobs[-1].texts)
+        return jobs
+
+    def _loop(self):
+        while True:
+            jobs = self._next_batch()
+            texts = [text for job in jobs for text in job.texts]
+            owners = iter([job for job in jobs for _ in job.texts])
+
+            def emit(scores, predictions):
+                next(owners).results.put((scores, predictions))
+
+            try:
+                self.translate_fn(texts, emit)
+            except Exception as e:
+                for job in jobs:
+                    job.results.put(e)
+
+
+class TranslationCache(object):
+    """
+    LRU cache of translations, shared by the models of a server.
+
+    Entries are keyed by the model, its decoding options and the
+    tokenized source, whitespace-normalized, and hold the `n_best` scores
+    and tokenized predictions. Entries older than `ttl` seconds are
+    ignored. When `path` is set, entries evicted from memory are written
+    to a `dbm` store there, which is looked up on memory misses and
+    outlives the server.
+
+    Args:
+        size (int): maximum number of entries in memory
+        ttl (float): seconds an entry stays valid, <= 0 for ever
+        path (str): path of the on-disk store, or None
+    """
+
+    def __init__(self, size=10000, ttl=-1, path=None):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.memory = 0
+        self.lock = threading.Lock()
+        # hits and misses of each model
+        self.counts = {}
+        self.disk = None
+        if path is not None:
+            try:
+                import anydbm as dbm  # python 2
+            except ImportError:
+                import dbm
+            self.disk = dbm.open(path, 'c')
+
+    @staticmethod
+    def key(model_key, text):
+        """ Key of the tokenized `text` for the model `model_key`. """
+        return hashlib.sha1(json.dumps(
+            [model_key, " ".join(text.split())]).encode('utf-8')).digest()
+
+    @staticmethod
+    def _size(key, value):
+        _, scores, predictions = value
+        return sys.getsizeof(key) + sys.getsizeof(value) + \
+            sum(sys.getsizeof(x) for x in scores + predictions)
+
+    def _count(self, model_id, hit):
+        hits, misses = self.counts.get(model_id, (0, 0))
+        self.counts[model_id] = (hits + hit, misses + (not hit))
+
+    def get(self, model_id, key):
+        """ The scores and predictions cached for `key`, or None. """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                # most recently used last
+                self.entries[key] = self.entries.pop(key)
+            elif self.disk is not None and key in self.disk:
+                value = tuple(json.loads(self.disk[key].decode('utf-8')))
+            if value is not None and 0 < value[0] < time.time():
+                self._remove(key)
+                value = None
+            self._count(model_id, value is not None)
+            if value is None:
+                return None
+            if key not in self.entries:
+                self._put(key, value)
+            return value[1], value[2]
+
+    def put(self, key, scores, predictions):
+        expire = time.time() + self.ttl if self.ttl > 0 else 0
+        with self.lock:
+            self._remove(key)
+            self._put(key, (expire, list(scores), list(predictions)))
+
+    def _put(self, key, value):
+        self.entries[key] = value
+        self.memory += self._size(key, value)
+        while len(self.entries) > self.size:
+            old_key, old_value = self.entries.popitem(last=False)
+            self.memory -= self._size(old_key, old_value)
+            if self.disk is not None:
+                self.disk[old_key] = json.dumps(old_value).encode('utf-8')
+
+    def _remove(self, key):
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.memory -= self._size(key, value)
+        if self.disk is not None and key in self.disk:
+            del self.disk[key]
+
+    def stats(self, model_id):
+        """ Hits and misses of `model_id`, and the size of the cache. """
+        with self.lock:
+            hits, misses = self.counts.get(model_id, (0, 0))
+            stats = {"hits": hits,
+                     "misses": misses,
+                     "hit_rate": hits / max(hits + misses, 1),
+                     "entries": len(self.entries),
+                     "memory_bytes": self.memory}
+            if self.disk is not None:
+                stats["disk_entries"] = len(self.disk)
+            return stats
+
+
 class TranslationServer():
     def __init__(self):
         self.models = {}
         self.next_id = 0
+        self.cache = None
+        self.memory_budget = None
+        self.lock = threading.Lock()
 
     def start(self, config_file):
         """Read the config file and pre-/load the models
@@ -74,6 +292,11 @@ class TranslationServer():
             self.confs = json.load(f)
 
         self.models_root = self.confs.get('models_root', './available_models')
+        if "cache" in self.confs:
+            self.cache = TranslationCache(**self.confs["cache"])
+        if "memory_budget" in self.confs:
+            # in MB
+            self.memory_budget = self.confs["memory_budget"] * 2 ** 20
         for i, conf in enumerate(self.confs["models"]):
             if "models" not in conf:
                 if "model" in conf:
@@ -86,7 +309,10 @@ class TranslationServer():
                       'load': conf.get('load', None),
                       'tokenizer_opt': conf.get('tokenizer', None),
                       'on_timeout': conf.get('on_timeout', None),
-                      'model_root': conf.get('model_root', self.models_root)
+                      'model_root': conf.get('model_root', self.models_root),
+                      'max_batch_size': conf.get('max_batch_size', None),
+                      'max_wait': conf.get('max_wait', None),
+                      'devices': conf.get('devices', None)
                       }
             kwargs = {k: v for (k, v) in kwargs.items() if v is not None}
             model_id = conf.get("id", None)
@@ -115,9 +341,13 @@ class TranslationServer():
 
         return model_id, load_time
 
-    def preload_model(self, opt, model_id=None, **model_kwargs):
+    def preload_model(self, opt, model_id=None, devices=None,
+                      **model_kwargs):
         """Preloading the model: updating internal datastructure
            It will effectively load the model if `load` is set
+
+           A replica of the model is placed on each of `devices` (GPU ids,
+           -1 for CPU), or on `opt["gpu"]` by default (see `ModelPool`)
         """
         if model_id is not None:
             if model_id in self.models.keys():
@@ -128,8 +358,13 @@ class TranslationServer():
                 model_id += 1
             self.next_id = model_id + 1
         print("Pre-loading model %d" % model_id)
-        model = ServerModel(opt, model_id, **model_kwargs)
-        self.models[model_id] = model
+        if devices is None:
+            devices = [opt.get("gpu", -1)]
+        replicas = [ServerModel(dict(opt, gpu=gpu), model_id,
+                                cache=self.cache, before_load=self.make_room,
+                                **model_kwargs)
+                    for gpu in devices]
+        self.models[model_id] = ModelPool(replicas)
 
         return model_id
 
@@ -147,6 +382,17 @@ class TranslationServer():
             print("Error No such model '%s'" % str(model_id))
             raise ServerModelError("No such model '%s'" % str(model_id))
 
+    def run_stream(self, inputs):
+        """Translate `inputs` as `run`, but yield the index, translation
+           and score of each input as soon as it is translated
+        """
+        model_id = inputs[0].get("id", 0)
+        if model_id in self.models and self.models[model_id] is not None:
+            return self.models[model_id].run_stream(inputs)
+        else:
+            print("Error No such model '%s'" % str(model_id))
+            raise ServerModelError("No such model '%s'" % str(model_id))
+
     def unload_model(self, model_id):
         """Manually unload a model.
            It will free the memory and cancel the timer
@@ -156,6 +402,28 @@ class TranslationServer():
         else:
             raise ServerModelError("No such model '%s'" % str(model_id))
 
+    def make_room(self, server_model):
+        """Unload the least recently used idle models until
+           `server_model` fits in `memory_budget` with the loaded models
+        """
+        if self.memory_budget is None:
+            return
+        with self.lock:
+            used = sum(pool.memory for pool in self.models.values())
+            needed = server_model.memory
+            others = [pool for pool in self.models.values()
+                      if pool.model_id != server_model.model_id]
+            for pool in sorted(others, key=lambda pool: pool.last_used):
+                if used + needed <= self.memory_budget:
+                    break
+                if pool.loaded and not pool.busy:
+                    used -= pool.memory
+                    pool.unload()
+            if used + needed > self.memory_budget:
+                server_model.logger.warning(
+                    "Loading model %d exceeds the memory budget: %d MB used"
+                    % (server_model.model_id, (used + needed) // 2 ** 20))
+
     def list_models(self):
         """Return the list of available models
         """
@@ -165,9 +433,117 @@ class TranslationServer():
         return models
 
 
+class ModelPool(object):
+    """
+    Replicas of a model, e.g. on several GPUs, served as one model.
+
+    Each request goes to the replica with the fewest sentences in
+    flight, so replicas translate concurrent requests in parallel, each
+    with its own `BatchScheduler`.
+
+    Args:
+        replicas: (list) `ServerModel`s of the same model and options
+    """
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self.model_id = replicas[0].model_id
+        self.in_flight = [0] * len(replicas)
+        self.last_used = 0
+        self.lock = threading.Lock()
+
+    @property
+    def opt(self):
+        return self.replicas[0].opt
+
+    @property
+    def user_opt(self):
+        return self.replicas[0].user_opt
+
+    @property
+    def load_time(self):
+        return sum(getattr(replica, "load_time", 0)
+                   for replica in self.replicas)
+
+    @property
+    def loaded(self):
+        return any(replica.loaded for replica in self.replicas)
+
+    @property
+    def busy(self):
+        return sum(self.in_flight) > 0
+
+    @property
+    def memory(self):
+        """Bytes taken by the loaded replicas"""
+        return sum(replica.memory for replica in self.replicas
+                   if replica.loaded)
+
+    def _acquire(self, n_inputs):
+        with self.lock:
+            i = min(range(len(self.replicas)),
+                    key=lambda i: self.in_flight[i])
+            self.in_flight[i] += n_inputs
+            self.last_used = time.time()
+        return i
+
+    def _release(self, i, n_inputs):
+        with self.lock:
+            self.in_flight[i] -= n_inputs
+
+    def run(self, inputs):
+        """Translate `inputs` with the least loaded replica, see
+           `ServerModel.run`
+        """
+        i = self._acquire(len(inputs))
+        try:
+            return self.replicas[i].run(inputs)
+        finally:
+            self._release(i, len(inputs))
+
+    def run_stream(self, inputs):
+        """Translate `inputs` with the least loaded replica, see
+           `ServerModel.run_stream`
+        """
+        i = self._acquire(len(inputs))
+        try:
+            for output in self.replicas[i].run_stream(inputs):
+                yield output
+        finally:
+            self._release(i, len(inputs))
+
+    def unload(self):
+        for replica in self.replicas:
+            if replica.loaded:
+                replica.unload()
+
+    def to_cpu(self):
+        for replica in self.replicas:
+            if replica.loaded:
+                replica.to_cpu()
+
+    def to_gpu(self):
+        for replica in self.replicas:
+            if replica.loaded and replica.opt.cuda:
+                replica.to_gpu()
+
+    def to_dict(self):
+        d = self.replicas[0].to_dict()
+        d["loaded"] = self.loaded
+        d["memory"] = self.memory
+        d["replicas"] = [{"gpu": replica.opt.gpu,
+                          "loaded": replica.loaded,
+                          "in_flight": in_flight}
+                         for replica, in_flight in zip(self.replicas,
+                                                       self.in_flight)]
+        return d
+
+
 class ServerModel:
     def __init__(self, opt, model_id, tokenizer_opt=None, load=False,
-                 timeout=-1, on_timeout="to_cpu", model_root="./"):
+                 timeout=-1, on_timeout="to_cpu", model_root="./",
+                 max_batch_size=64, max_wait=0.01, cache=None,
+                 before_load=None):
         """
             Args:
                 opt: (dict) options for the Translator
@@ -180,6 +556,13 @@ class ServerModel:
                             timeout (see function `do_timeout`)
                 model_root: (str) path to the model directory
                             it must contain de model and tokenizer file
+                max_batch_size: (int) sentences of concurrent requests
+                                translated together
+                max_wait: (float) seconds a request waits for others
+                          to share its batch (see `BatchScheduler`)
+                cache: (TranslationCache) cache of the translations or None
+                before_load: (function) called with the model before it
+                             loads, e.g. to free memory for it
 
         """
         self.model_root = model_root
@@ -206,6 +589,14 @@ class ServerModel:
         self.loading_lock = threading.Event()
         self.loading_lock.set()
         self.running_lock = threading.Semaphore(value=1)
+        self.cache = cache
+        self.before_load = before_load
+        # decoding options and checkpoints of the loaded model, for the
+        # cache keys, shared by the replicas of the model
+        self.cache_key = None
+        self.scheduler = BatchScheduler(self._translate,
+                                        max_batch_size=max_batch_size,
+                                        max_wait=max_wait)
 
         if load:
             self.load()
@@ -249,13 +640,40 @@ class ServerModel:
     def loaded(self):
         return hasattr(self, 'translator')
 
+    @property
+    def memory(self):
+        """Bytes of the model parameters, or of its checkpoints while it
+           is not loaded"""
+        if self.loaded:
+            return sum(p.numel() * p.element_size()
+                       for p in self.translator.model.parameters())
+        return sum(os.path.getsize(path) for path in self.opt.models
+                   if os.path.exists(path))
+
+    def checkpoint_key(self):
+        """The decoding options and the modification time and size of
+           each checkpoint: a checkpoint replaced at the same path is
+           another model for the cache, whose store outlives the server
+        """
+        key = {k: v for k, v in self.user_opt.items()
+               if k not in ["src", "gpu"]}
+        key["checkpoints"] = []
+        for path in self.opt.models:
+            stat = os.stat(path)
+            key["checkpoints"].append([stat.st_mtime, stat.st_size])
+        return key
+
     def load(self):
+        if self.before_load is not None:
+            self.before_load(self)
         self.loading_lock.clear()
 
         timer = Timer()
         self.logger.info("Loading model %d" % self.model_id)
         timer.start()
 
+        # before reading the checkpoints, which may be replaced meanwhile
+        self.cache_key = self.checkpoint_key()
         try:
             self.translator = build_translator(self.opt,
                                                report_score=False,
@@ -306,10 +724,12 @@ class ServerModel:
         self.reset_unload_timer()
         self.loading_lock.set()
 
-    @critical
     def run(self, inputs):
         """Translate `inputs` using this model
 
+            The sentences of concurrent calls are translated together
+            (see `BatchScheduler`).
+
             Args:
                 inputs: [{"src": "..."},{"src": ...}]
 
@@ -317,33 +737,36 @@ class ServerModel:
                 result: (list) translations
                 times: (dict) containing times
         """
-        self.stop_unload_timer()
-
         timer = Timer()
         timer.start()
 
-        self.logger.info("Running translation using %d" % self.model_id)
+        results = []
+        scores = []
+        for _, result, score in self.run_stream(inputs, timer):
+            results.append(result)
+            scores.append(score)
 
-        if not self.loading_lock.is_set():
-            self.logger.info(
-                "Model #%d is being loaded by another thread, waiting"
-                % self.model_id)
-            if not self.loading_lock.wait(timeout=30):
-                raise ServerModelError("Model %d loading timeout"
-                                       % self.model_id)
+        self.logger.info("Translation Results: %d", len(results))
+        return results, scores, self.opt.n_best, timer.times
 
-        else:
-            if not self.loaded:
-                self.load()
-                timer.tick(name="load")
-            elif self.opt.cuda:
-                self.to_gpu()
-                timer.tick(name="to_gpu")
+    def run_stream(self, inputs, timer=None):
+        """Translate `inputs` using this model, as `run`, but yield the
+           translation of each input as soon as it and the previous ones
+           are translated
+
+            Yields:
+                (index of the input, translation, score)
+        """
+        if timer is None:
+            timer = Timer()
+            timer.start()
+
+        self.logger.info("Running translation using %d" % self.model_id)
+        self.prepare(timer)
 
         texts = []
         head_spaces = []
         tail_spaces = []
-        sslength = []
         for i, inp in enumerate(inputs):
             src = inp['src']
             if src.strip() == "":
@@ -361,57 +784,93 @@ class ServerModel:
                 head_spaces.append(whitespaces_before)
                 tok = self.maybe_tokenize(src.strip())
                 texts.append(tok)
-                sslength.append(len(tok.split()))
                 tail_spaces.append(whitespaces_after)
 
-        empty_indices = [i for i, x in enumerate(texts) if x == ""]
-        texts_to_translate = [x for x in texts if x != ""]
-
-        scores = []
-        predictions = []
-        if len(texts_to_translate) > 0:
-            try:
-                scores, predictions = self.translator.translate(
-                    texts_to_translate,
-                    batch_size=self.opt.batch_size)
-            except (RuntimeError, Exception) as e:
-                err = "Error: %s" % str(e)
-                self.logger.error(err)
-                self.logger.error("repr(text_to_translate): "
-                                  + repr(texts_to_translate))
-                self.logger.error("model: #%s" % self.model_id)
-                self.logger.error("model opt: " + str(self.opt.__dict__))
-                self.logger.error(traceback.format_exc())
-
-                raise ServerModelError(err)
+        keys = [None] * len(texts)
+        cached = [None] * len(texts)
+        if self.cache is not None:
+            for i, text in enumerate(texts):
+                if text != "":
+                    keys[i] = self.cache.key(self.cache_key, text)
+                    cached[i] = self.cache.get(self.model_id, keys[i])
+        texts_to_translate = [text for text, c in zip(texts, cached)
+                              if text != "" and c is None]
+        translations = self.scheduler.translate_iter(texts_to_translate)
+
+        for i, text in enumerate(texts):
+            # NOTE: translator returns lists of `n_best` results
+            #       we can ignore that (i.e. keep the first) only because
+            #       we restrict `n_best=1`
+            if text == "":
+                result, score = "", 0
+            else:
+                if cached[i] is not None:
+                    scores, predictions = cached[i]
+                else:
+                    scores, predictions = next(translations)
+                    scores = [float(s) for s in scores]
+                    if self.cache is not None:
+                        self.cache.put(keys[i], scores, predictions)
+                result = self.maybe_detokenize(predictions[0])
+                score = scores[0]
+            yield i, head_spaces[i] + result + tail_spaces[i], score
 
         timer.tick(name="translation")
         self.logger.info("""Using model #%d\t%d inputs
                \ttranslation time: %f""" % (self.model_id, len(texts),
                                             timer.times['translation']))
-        self.reset_unload_timer()
 
-        # NOTE: translator returns lists of `n_best` list
-        #       we can ignore that (i.e. flatten lists) only because
-        #       we restrict `n_best=1`
-        def flatten_list(_list): return sum(_list, [])
-        results = flatten_list(predictions)
-        scores = [score_tensor.item()
-                  for score_tensor in flatten_list(scores)]
+    @critical
+    def prepare(self, timer):
+        """Load the model and tokenizer, or move the model back to GPU,
+           before tokenizing and translating
+        """
+        self.stop_unload_timer()
 
-        results = [self.maybe_detokenize(item)
-                   for item in results]
+        if not self.loading_lock.is_set():
+            self.logger.info(
+                "Model #%d is being loaded by another thread, waiting"
+                % self.model_id)
+            if not self.loading_lock.wait(timeout=30):
+                raise ServerModelError("Model %d loading timeout"
+                                       % self.model_id)
 
-        # build back results with empty texts
-        for i in empty_indices:
-            results.insert(i, "")
-            scores.insert(i, 0)
+        else:
+            if not self.loaded:
+                self.load()
+                timer.tick(name="load")
+            elif self.opt.cuda:
+                self.to_gpu()
+                timer.tick(name="to_gpu")
 
-        results = ["".join(items)
-                   for items in zip(head_spaces, results, tail_spaces)]
+        self.reset_unload_timer()
 
-        self.logger.info("Translation Results: %d", len(results))
-        return results, scores, self.opt.n_best, timer.times
+    @critical
+    def _translate(self, texts, emit):
+        """Translate the sentences `texts` of one or more requests,
+           calling `emit` with the results of each one in order
+        """
+        self.stop_unload_timer()
+        # the model may have been unloaded since `prepare`
+        if not self.loaded:
+            self.load()
+        elif self.opt.cuda:
+            self.to_gpu()
+        try:
+            for scores, predictions in self.translator.translate_iter(
+                    texts, batch_size=self.opt.batch_size):
+                emit(scores, predictions)
+        except (RuntimeError, Exception) as e:
+            err = "Error: %s" % str(e)
+            self.logger.error(err)
+            self.logger.error("repr(text_to_translate): " + repr(texts))
+            self.logger.error("model: #%s" % self.model_id)
+            self.logger.error("model opt: " + str(self.opt.__dict__))
+            self.logger.error(traceback.format_exc())
+
+            raise ServerModelError(err)
+        finally:
+            self.reset_unload_timer()
 
     def do_timeout(self):
         """Timeout function that free GPU memory by moving the model to CPU
@@ -427,6 +886,8 @@ class ServerModel:
 
     @critical
     def unload(self):
+        if not self.loaded:
+            return
         self.logger.info("Unloading model %d" % self.model_id)
         del self.translator
         if self.opt.cuda:
@@ -456,6 +917,8 @@ class ServerModel:
              }
         if self.tokenizer_opt is not None:
             d["tokenizer"] = self.tokenizer_opt
+        if self.cache is not None:
+            d["cache"] = self.cache.stats(self.model_id)
         return d
 
     @critical
@@ -5,11 +5,16 @@ import configargparse
 import codecs
 import os
 import math
+import multiprocessing
+import pickle
+import time
 
 import torch
 
-from itertools import count
-from onmt.utils.misc import tile
+from collections import deque
+from itertools import count, repeat
+from onmt.utils.misc import tile, split_corpus
+from onmt.translate.ngram_blocker import NGramBlocker
 
 import onmt.model_builder
 import onmt.translate.beam
@@ -45,6 +50,23 @@ def build_translator(opt, report_score=True, logger=None, out_file=None):
     return translator
 
 
+# The translator of the forked `-num_workers` processes
+_worker_translator = None
+
+
+def _init_worker(n_threads):
+    torch.set_num_threads(n_threads)
+
+
+def _translate_shard_worker(args):
+    """ Translate a shard with the translator inherited from the parent. """
+    start = time.time()
+    translations = list(_worker_translator._translate_shard(*args))
+    # plain pickle copies the tensors, instead of passing each one
+    # through a shared memory file descriptor
+    return os.getpid(), time.time() - start, pickle.dumps(translations)
+
+
 class Translator(object):
     """
     Uses a model to translate a batch of sentences.
@@ -101,6 +123,9 @@ class Translator(object):
         self.report_bleu = opt.report_bleu
         self.report_rouge = opt.report_rouge
         self.fast = opt.fast
+        self.shard_size = opt.shard_size
+        self.batch_type = opt.batch_type
+        self.num_workers = opt.num_workers
 
         self.copy_attn = model_opt.copy_attn
 
@@ -151,11 +176,123 @@ class Translator(object):
             * all_predictions is a list of `batch_size` lists
                 of `n_best` predictions
         """
+        all_scores = []
+        all_predictions = []
+        for scores, predictions in self.translate_iter(
+                src, tgt=tgt, src_dir=src_dir, batch_size=batch_size,
+                attn_debug=attn_debug):
+            all_scores.append(scores)
+            all_predictions.append(predictions)
+        return all_scores, all_predictions
+
+    def translate_iter(
+        self,
+        src,
+        tgt=None,
+        src_dir=None,
+        batch_size=None,
+        attn_debug=False
+    ):
+        """
+        Same as `translate`, but yields the `n_best` scores and predictions
+        of each source, in order, once they are written to `out_file`.
+
+        The source is read by shards of `shard_size` examples. Each shard
+        is sorted by length into batches, which limits padding, and its
+        translations are written back in the input order: memory does not
+        grow with the size of the input.
+        """
         assert src is not None
 
         if batch_size is None:
             raise ValueError("batch_size must be set")
+        if self.batch_type == "tokens" and self.data_type != "text":
+            raise ValueError("-batch_type tokens only supports text")
+        if self.num_workers > 1 and (self.cuda or self.dump_beam):
+            raise ValueError("-num_workers only supports CPU translation "
+                             "without -dump_beam")
+
+        src_shards = split_corpus(src, self.shard_size)
+        tgt_shards = split_corpus(tgt, self.shard_size) \
+            if tgt is not None else repeat(None)
+
+        # Statistics
+        counter = count(1)
+        pred_score_total, pred_words_total = 0, 0
+        gold_score_total, gold_words_total = 0, 0
 
+        shards = zip(src_shards, tgt_shards)
+        if self.num_workers > 1:
+            translations = self._translate_parallel(
+                shards, src_dir, batch_size, attn_debug)
+        else:
+            translations = (
+                trans for src_shard, tgt_shard in shards
+                for trans in self._translate_shard(
+                    src_shard, tgt_shard, src_dir, batch_size, attn_debug))
+
+        for trans in translations:
+            pred_score_total += trans.pred_scores[0]
+            pred_words_total += len(trans.pred_sents[0])
+            if tgt is not None:
+                gold_score_total += trans.gold_score
+                gold_words_total += len(trans.gold_sent) + 1
+
+            n_best_preds = [" ".join(pred)
+                            for pred in trans.pred_sents[:self.n_best]]
+            self.out_file.write('\n'.join(n_best_preds) + '\n')
+            self.out_file.flush()
+
+            if self.verbose:
+                sent_number = next(counter)
+                output = trans.log(sent_number)
+                if self.logger:
+                    self.logger.info(output)
+                else:
+                    os.write(1, output.encode('utf-8'))
+
+            if attn_debug:
+                self._log_attention(trans)
+
+            yield trans.pred_scores[:self.n_best], n_best_preds
+
+        if self.report_score:
+            msg = self._report_score('PRED', pred_score_total,
+                                     pred_words_total)
+            if self.logger:
+                self.logger.info(msg)
+            else:
+                print(msg)
+            if tgt is not None:
+                msg = self._report_score('GOLD', gold_score_total,
+                                         gold_words_total)
+                if self.logger:
+                    self.logger.info(msg)
+                else:
+                    print(msg)
+                if self.report_bleu:
+                    msg = self._report_bleu(tgt)
+                    if self.logger:
+                        self.logger.info(msg)
+                    else:
+                        print(msg)
+                if self.report_rouge:
+                    msg = self._report_rouge(tgt)
+                    if self.logger:
+                        self.logger.info(msg)
+                    else:
+                        print(msg)
+
+        if self.dump_beam:
+            import json
+            json.dump(self.beam_accum,
+                      codecs.open(self.dump_beam, 'w', 'utf-8'))
+
+    def _translate_shard(self, src, tgt, src_dir, batch_size, attn_debug):
+        """
+        Yield the translations of the lines `src` in order, decoding them
+        in batches of similar lengths.
+        """
         data = inputters.build_dataset(
             self.fields,
             self.data_type,
@@ -173,126 +310,161 @@ class Translator(object):
 
         cur_device = "cuda" if self.cuda else "cpu"
 
+        batch_size_fn = None
+        if self.batch_type == "tokens":
+            # each source is decoded beam_size times
+            batch_size = max(1, batch_size // self.beam_size)
+            batch_size_fn = inputters.max_src_tok_len
+
         data_iter = inputters.OrderedIterator(
             dataset=data,
             device=cur_device,
             batch_size=batch_size,
+            batch_size_fn=batch_size_fn,
             train=False,
-            sort=False,
+            sort=True,
             sort_within_batch=True,
             shuffle=False
         )
 
         builder = onmt.translate.TranslationBuilder(
-            data, self.fields, self.n_best, self.replace_unk, tgt
+            data, self.fields, self.n_best, self.replace_unk,
+            tgt is not None
         )
 
-        # Statistics
-        counter = count(1)
-        pred_score_total, pred_words_total = 0, 0
-        gold_score_total, gold_words_total = 0, 0
-
-        all_scores = []
-        all_predictions = []
-
+        # Translations waiting for those of earlier lines.
+        pending = {}
+        next_index = 0
         for batch in data_iter:
             batch_data = self.translate_batch(
                 batch, data, attn_debug, fast=self.fast
             )
             translations = builder.from_batch(batch_data)
+            # from_batch sorts the translations by index
+            indices = sorted(batch.indices.tolist())
+            pending.update(zip(indices, translations))
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+        # filtered examples leave gaps
+        for index in sorted(pending):
+            yield pending[index]
+
+    def _translate_parallel(self, shards, src_dir, batch_size, attn_debug):
+        """
+        Translate `shards` in `num_workers` forked processes and yield
+        their translations in order.
 
-            for trans in translations:
-                all_scores += [trans.pred_scores[:self.n_best]]
-                pred_score_total += trans.pred_scores[0]
-                pred_words_total += len(trans.pred_sents[0])
-                if tgt is not None:
-                    gold_score_total += trans.gold_score
-                    gold_words_total += len(trans.gold_sent) + 1
-
-                n_best_preds = [" ".join(pred)
-                                for pred in trans.pred_sents[:self.n_best]]
-                all_predictions += [n_best_preds]
-                self.out_file.write('\n'.join(n_best_preds) + '\n')
-                self.out_file.flush()
-
-                if self.verbose:
-                    sent_number = next(counter)
-                    output = trans.log(sent_number)
-                    if self.logger:
-                        self.logger.info(output)
-                    else:
-                        os.write(1, output.encode('utf-8'))
-
-                if attn_debug:
-                    preds = trans.pred_sents[0]
-                    preds.append('</s>')
-                    attns = trans.attns[0].tolist()
-                    if self.data_type == 'text':
-                        srcs = trans.src_raw
-                    else:
-                        srcs = [str(item) for item in range(len(attns[0]))]
-                    header_format = "{:>10.10} " + "{:>10.7} " * len(srcs)
-                    row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
-                    output = header_format.format("", *srcs) + '\n'
-                    for word, row in zip(preds, attns):
-                        max_index = row.index(max(row))
-                        row_format = row_format.replace(
-                            "{:>10.7f} ", "{:*>10.7f} ", max_index + 1)
-                        row_format = row_format.replace(
-                            "{:*>10.7f} ", "{:>10.7f} ", max_index)
-                        output += row_format.format(word, *row) + '\n'
-                        row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
-                    os.write(1, output.encode('utf-8'))
+        The workers inherit the model copy-on-write and split the CPU
+        threads. Each has up to two shards in flight, so that they keep
+        working while this process writes the translations.
+        """
+        global _worker_translator
+        _worker_translator = self
+        n_threads = max(1, torch.get_num_threads() // self.num_workers)
+        # python 2 always forks
+        context = multiprocessing.get_context("fork") \
+            if hasattr(multiprocessing, "get_context") else multiprocessing
+        pool = context.Pool(
+            self.num_workers, initializer=_init_worker,
+            initargs=(n_threads,))
+        pending = deque()
+        # sentences and busy time of each worker
+        workers = {}
+        start = time.time()
+
+        def collect(result):
+            pid, elapsed, translations = result
+            translations = pickle.loads(translations)
+            n_sents, busy = workers.get(pid, (0, 0.))
+            workers[pid] = (n_sents + len(translations), busy + elapsed)
+            return translations
+
+        try:
+            for src_shard, tgt_shard in shards:
+                if len(pending) == 2 * self.num_workers:
+                    for trans in collect(pending.popleft().get()):
+                        yield trans
+                pending.append(pool.apply_async(
+                    _translate_shard_worker,
+                    ((src_shard, tgt_shard, src_dir, batch_size,
+                      attn_debug),)))
+                del src_shard, tgt_shard
+            while pending:
+                for trans in collect(pending.popleft().get()):
+                    yield trans
+        finally:
+            pool.terminate()
+            pool.join()
+            _worker_translator = None
 
         if self.report_score:
-            msg = self._report_score('PRED', pred_score_total,
-                                     pred_words_total)
-            if self.logger:
-                self.logger.info(msg)
-            else:
-                print(msg)
-            if tgt is not None:
-                msg = self._report_score('GOLD', gold_score_total,
-                                         gold_words_total)
+            elapsed = time.time() - start
+            total = sum(n_sents for n_sents, _ in workers.values())
+            msgs = ["worker %d: %d sents, %.1f sents/s"
+                    % (pid, n_sents, n_sents / max(busy, 1e-6))
+                    for pid, (n_sents, busy) in sorted(workers.items())]
+            rate = total / elapsed
+            msgs.append("%d workers (%d threads each): %.1f sents/s, "
+                        "%.1f sents/s per worker"
+                        % (self.num_workers, n_threads, rate,
+                           rate / self.num_workers))
+            for msg in msgs:
                 if self.logger:
                     self.logger.info(msg)
                 else:
                     print(msg)
-                if self.report_bleu:
-                    msg = self._report_bleu(tgt)
-                    if self.logger:
-                        self.logger.info(msg)
-                    else:
-                        print(msg)
-                if self.report_rouge:
-                    msg = self._report_rouge(tgt)
-                    if self.logger:
-                        self.logger.info(msg)
-                    else:
-                        print(msg)
 
-        if self.dump_beam:
-            import json
-            json.dump(self.translator.beam_accum,
-                      codecs.open(self.dump_beam, 'w', 'utf-8'))
-        return all_scores, all_predictions
+    def _log_attention(self, trans):
+        preds = trans.pred_sents[0]
+        preds.append('</s>')
+        attns = trans.attns[0].tolist()
+        if self.data_type == 'text':
+            srcs = trans.src_raw
+        else:
+            srcs = [str(item) for item in range(len(attns[0]))]
+        header_format = "{:>10.10} " + "{:>10.7} " * len(srcs)
+        row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
+        output = header_format.format("", *srcs) + '\n'
+        for word, row in zip(preds, attns):
+            max_index = row.index(max(row))
+            row_format = row_format.replace(
+                "{:>10.7f} ", "{:*>10.7f} ", max_index + 1)
+            row_format = row_format.replace(
+                "{:*>10.7f} ", "{:>10.7f} ", max_index)
+            output += row_format.format(word, *row) + '\n'
+            row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
+        os.write(1, output.encode('utf-8'))
 
     def translate_batch(self, batch, data, attn_debug, fast=False):
         """
         Translate a batch of sentences.
 
-        Mostly a wrapper around :obj:`Beam`.
+        With `fast`, runs greedy search when `beam_size` and `n_best` are 1
+        and no n-gram is blocked, the fast beam search otherwise. Without
+        it, runs the batched :obj:`BeamSearch`, which supports all the
+        options.
 
         Args:
            batch (:obj:`Batch`): a batch from a dataset object
            data (:obj:`Dataset`): the dataset object
-           fast (bool): enables fast beam search (may not support all features)
+           attn_debug (bool): return the attention of the predictions
+           fast (bool): use greedy or fast beam search (may not support
+              all features)
 
         Todo:
            Shouldn't need the original dataset.
         """
         with torch.no_grad():
-            if fast:
+            if fast and self.beam_size == 1 and self.n_best == 1 \
+                    and self.block_ngram_repeat == 0:
+                return self._greedy_translate_batch(
+                    batch,
+                    data,
+                    self.max_length,
+                    min_length=self.min_length,
+                    return_attention=attn_debug or self.replace_unk)
+            elif fast:
                 return self._fast_translate_batch(
                     batch,
                     data,
@@ -356,9 +528,12 @@ class Translator(object):
             # or [ tgt_len, batch_size, vocab ] when full sentence
         else:
             attn = dec_attn["copy"]
+            # kept on the batch for the next decoding steps
+            copy_map = data.copy_map(
+                batch, self.fields["tgt"].vocab, data.src_vocabs)
             scores = self.model.generator(dec_out.view(-1, dec_out.size(2)),
                                           attn.view(-1, attn.size(2)),
-                                          src_map)
+                                          src_map, copy_map.size(1))
             # here we have scores [tgt_lenxbatch, vocab] or [beamxbatch, vocab]
             if batch_offset is None:
                 scores = scores.view(batch.batch_size, -1, scores.size(-1))
@@ -379,6 +554,139 @@ class Translator(object):
 
         return log_probs, attn
 
+    def _greedy_translate_batch(
+        self,
+        batch,
+        data,
+        max_length,
+        min_length=0,
+        return_attention=False,
+        sync_steps=8
+    ):
+        """
+        Greedy search, the `fast` search with beam_size 1.
+
+        The argmax of each step is taken on the device and written into
+        preallocated buffers. Finished sentences are masked on the device
+        and only dropped from the batch every `sync_steps` steps, the only
+        points where the search waits for the device.
+        """
+        # TODO: support these blacklisted features.
+        assert not self.dump_beam
+        assert not self.use_filter_pred
+        assert self.block_ngram_repeat == 0
+        assert self.global_scorer.beta == 0
+
+        batch_size = batch.batch_size
+        vocab = self.fields["tgt"].vocab
+        start_token = vocab.stoi[self.fields["tgt"].init_token]
+        end_token = vocab.stoi[self.fields["tgt"].eos_token]
+
+        # Encoder forward.
+        src, enc_states, memory_bank, src_lengths = self._run_encoder(
+            batch, data.data_type)
+        self.model.decoder.init_state(src, memory_bank, enc_states)
+
+        use_src_map = data.data_type == 'text' and self.copy_attn
+        src_map = batch.src_map if use_src_map else None
+
+        results = {}
+        results["predictions"] = [[] for _ in range(batch_size)]  # noqa: F812
+        results["scores"] = [[] for _ in range(batch_size)]  # noqa: F812
+        results["attention"] = [[] for _ in range(batch_size)]  # noqa: F812
+        results["batch"] = batch
+        if "tgt" in batch.__dict__:
+            results["gold_score"] = self._score_target(
+                batch, memory_bank, src_lengths, data, src_map)
+            self.model.decoder.init_state(src, memory_bank, enc_states)
+        else:
+            results["gold_score"] = [0] * batch_size
+
+        if isinstance(memory_bank, tuple):
+            mb = memory_bank[0]
+        else:
+            mb = memory_bank
+        memory_lengths = src_lengths
+
+        # Output buffers, indexed by position in the batch.
+        predictions = torch.full([max_length, batch_size], end_token,
+                                 dtype=torch.long, device=mb.device)
+        pred_log_probs = mb.new_zeros([batch_size])
+        pred_lengths = torch.zeros([batch_size], dtype=torch.long,
+                                   device=mb.device)
+        attention = (mb.new_zeros([max_length, batch_size, mb.size(0)])
+                     if return_attention else None)
+
+        # Position in the batch of the sentences still decoded.
+        alive = torch.arange(batch_size, dtype=torch.long, device=mb.device)
+        finished = torch.zeros([batch_size], dtype=torch.uint8,
+                               device=mb.device)
+        decoder_input = torch.full([1, batch_size, 1], start_token,
+                                   dtype=torch.long, device=mb.device)
+
+        for step in range(max_length):
+            log_probs, attn = self._decode_and_generate(
+                decoder_input,
+                memory_bank,
+                batch,
+                data,
+                memory_lengths=memory_lengths,
+                src_map=src_map,
+                step=step,
+                batch_offset=alive
+            )
+
+            if step < min_length:
+                log_probs[:, end_token] = -1e20
+
+            topk_log_probs, topk_ids = log_probs.max(1)
+
+            # Scores and lengths only count unfinished sentences.
+            predictions[step].index_copy_(0, alive, topk_ids)
+            pred_log_probs.index_add_(
+                0, alive, topk_log_probs.masked_fill(finished, 0))
+            pred_lengths.index_add_(0, alive, (1 - finished).long())
+            if attention is not None:
+                attention[step].index_copy_(0, alive, attn[0])
+            finished |= topk_ids.eq(end_token)
+
+            if step + 1 == max_length:
+                break
+            if (step + 1) % sync_steps == 0:
+                keep = (1 - finished).nonzero().view(-1)
+                # If all sentences are translated, no need to go further.
+                if len(keep) == 0:
+                    break
+                # Remove finished sentences for the next steps.
+                if len(keep) < len(alive):
+                    alive = alive.index_select(0, keep)
+                    finished = finished.index_select(0, keep)
+                    topk_ids = topk_ids.index_select(0, keep)
+                    if isinstance(memory_bank, tuple):
+                        memory_bank = tuple(x.index_select(1, keep)
+                                            for x in memory_bank)
+                    else:
+                        memory_bank = memory_bank.index_select(1, keep)
+                    memory_lengths = memory_lengths.index_select(0, keep)
+                    self.model.decoder.map_state(
+                        lambda state, dim: state.index_select(dim, keep))
+                    if src_map is not None:
+                        src_map = src_map.index_select(1, keep)
+
+            decoder_input = topk_ids.view(1, -1, 1)
+
+        # Same length penalty as the fast beam search.
+        length_penalty = (
+            (5.0 + pred_lengths.float()) / 6.0) ** self.global_scorer.alpha
+        pred_scores = pred_log_probs / length_penalty
+        for b, length in enumerate(pred_lengths.tolist()):
+            results["predictions"][b].append(predictions[:length, b])
+            results["scores"][b].append(pred_scores[b])
+            results["attention"][b].append(
+                attention[:length, b, :src_lengths[b]]
+                if attention is not None else [])
+        return results
+
     def _fast_translate_batch(
         self,
         batch,
@@ -388,12 +696,9 @@ class Translator(object):
         n_best=1,
         return_attention=False
     ):
-        # TODO: faster code path for beam_size == 1.
-
         # TODO: support these blacklisted features.
         assert not self.dump_beam
         assert not self.use_filter_pred
-        assert self.block_ngram_repeat == 0
         assert self.global_scorer.beta == 0
 
         beam_size = self.beam_size
@@ -455,6 +760,14 @@ class Translator(object):
             [0.0] + [float("-inf")] * (beam_size - 1), device=mb_device
         ).repeat(batch_size)
 
+        ngram_blocker = None
+        if self.block_ngram_repeat > 0:
+            ngram_blocker = NGramBlocker(
+                self.block_ngram_repeat, batch_size * beam_size,
+                exclusion_tokens={vocab.stoi[t]
+                                  for t in self.ignore_when_blocking},
+                device=mb_device)
+
         # Structure that holds finished hypotheses.
         hypotheses = [[] for _ in range(batch_size)]  # noqa: F812
 
@@ -479,6 +792,9 @@ class Translator(object):
 
             # Multiply probs by the beam probability.
             log_probs += topk_log_probs.view(-1).unsqueeze(1)
+            if ngram_blocker is not None:
+                log_probs.masked_fill_(
+                    ngram_blocker.blocked.unsqueeze(1), -10e20)
 
             alpha = self.global_scorer.alpha
             length_penalty = ((5.0 + (step + 1)) / 6.0) ** alpha
@@ -505,6 +821,10 @@ class Translator(object):
             alive_seq = torch.cat(
                 [alive_seq.index_select(0, select_indices),
                  topk_ids.view(-1, 1)], -1)
+            if ngram_blocker is not None:
+                ngram_blocker.map_state(
+                    lambda state: state.index_select(0, select_indices))
+                ngram_blocker.advance(topk_ids.view(-1))
             if return_attention:
                 current_attn = attn.index_select(1, select_indices)
                 if alive_attn is None:
@@ -567,6 +887,12 @@ class Translator(object):
                 select_indices = batch_index.view(-1)
                 alive_seq = predictions.index_select(0, non_finished) \
                     .view(-1, alive_seq.size(-1))
+                if ngram_blocker is not None:
+                    ngram_blocker.map_state(
+                        lambda state: state.view(
+                            -1, beam_size, *state.size()[1:])
+                        .index_select(0, non_finished)
+                        .view(-1, *state.size()[1:]))
                 if alive_attn is not None:
                     alive_attn = attention.index_select(1, non_finished) \
                         .view(alive_attn.size(0),
@@ -601,15 +927,6 @@ class Translator(object):
         pad = vocab.stoi[self.fields['tgt'].pad_token]
         eos = vocab.stoi[self.fields['tgt'].eos_token]
         bos = vocab.stoi[self.fields['tgt'].init_token]
-        beam = [onmt.translate.Beam(beam_size, n_best=self.n_best,
-                                    cuda=self.cuda,
-                                    global_scorer=self.global_scorer,
-                                    pad=pad, eos=eos, bos=bos,
-                                    min_length=self.min_length,
-                                    stepwise_penalty=self.stepwise_penalty,
-                                    block_ngram_repeat=self.block_ngram_repeat,
-                                    exclusion_tokens=exclusion_tokens)
-                for __ in range(batch_size)]
 
         # (1) Run the encoder on the src.
         src, enc_states, memory_bank, src_lengths = self._run_encoder(
@@ -617,9 +934,6 @@ class Translator(object):
         self.model.decoder.init_state(src, memory_bank, enc_states)
 
         results = {}
-        results["predictions"] = []
-        results["scores"] = []
-        results["attention"] = []
         results["batch"] = batch
         if "tgt" in batch.__dict__:
             results["gold_score"] = self._score_target(
@@ -642,49 +956,62 @@ class Translator(object):
             memory_bank = tile(memory_bank, beam_size, dim=1)
         memory_lengths = tile(src_lengths, beam_size)
 
+        beam = onmt.translate.BeamSearch(
+            beam_size, batch_size,
+            pad=pad, eos=eos, bos=bos,
+            n_best=self.n_best,
+            global_scorer=self.global_scorer,
+            min_length=self.min_length,
+            max_length=self.max_length,
+            memory_lengths=memory_lengths,
+            stepwise_penalty=self.stepwise_penalty,
+            block_ngram_repeat=self.block_ngram_repeat,
+            exclusion_tokens=exclusion_tokens,
+            trace=self.beam_trace)
+
         # (3) run the decoder to generate sentences, using beam search.
-        for i in range(self.max_length):
-            if all((b.done() for b in beam)):
-                break
+        for step in range(self.max_length):
+            decoder_input = beam.current_predictions.view(1, -1, 1)
 
-            # (a) Construct batch x beam_size nxt words.
-            # Get all the pending current beam words and arrange for forward.
+            log_probs, attn = self._decode_and_generate(
+                decoder_input,
+                memory_bank,
+                batch,
+                data,
+                memory_lengths=memory_lengths,
+                src_map=src_map,
+                step=step,
+                batch_offset=beam.batch_offset
+            )
 
-            inp = torch.stack([b.get_current_state() for b in beam])
-            inp = inp.view(1, -1, 1)
+            beam.advance(log_probs, attn)
+            if beam.is_finished.any() or step + 1 == self.max_length:
+                beam.update_finished()
+                if beam.done:
+                    break
 
-            # (b) Decode and forward
-            out, beam_attn = self._decode_and_generate(
-                inp, memory_bank, batch, data, memory_lengths=memory_lengths,
-                src_map=src_map, step=i
-            )
-            out = out.view(batch_size, beam_size, -1)
-            beam_attn = beam_attn.view(batch_size, beam_size, -1)
-
-            # (c) Advance each beam.
-            select_indices_array = []
-            # Loop over the batch_size number of beam
-            for j, b in enumerate(beam):
-                b.advance(out[j, :],
-                          beam_attn.data[j, :, :memory_lengths[j]])
-                select_indices_array.append(
-                    b.get_current_origin() + j * beam_size)
-            select_indices = torch.cat(select_indices_array)
+            # Reorder states.
+            select_indices = beam.select_indices
+            if isinstance(memory_bank, tuple):
+                memory_bank = tuple(x.index_select(1, select_indices)
+                                    for x in memory_bank)
+            else:
+                memory_bank = memory_bank.index_select(1, select_indices)
 
+            memory_lengths = memory_lengths.index_select(0, select_indices)
             self.model.decoder.map_state(
                 lambda state, dim: state.index_select(dim, select_indices))
+            if src_map is not None:
+                src_map = src_map.index_select(1, select_indices)
 
         # (4) Extract sentences from beam.
-        for b in beam:
-            scores, ks = b.sort_finished(minimum=self.n_best)
-            hyps, attn = [], []
-            for i, (times, k) in enumerate(ks[:self.n_best]):
-                hyp, att = b.get_hyp(times, k)
-                hyps.append(hyp)
-                attn.append(att)
-            results["predictions"].append(hyps)
-            results["scores"].append(scores)
-            results["attention"].append(attn)
+        results["predictions"] = beam.predictions
+        results["scores"] = beam.scores
+        results["attention"] = beam.attention
+        if self.beam_trace:
+            for trace in beam.trace:
+                for key, value in trace.items():
+                    self.beam_accum[key].append(value)
 
         return results
 
@@ -8,6 +8,7 @@ from __future__ import print_function
 
 import math
 import pickle
+from contextlib import contextmanager
 import torch.distributed
 
 from onmt.utils.logging import logger
@@ -41,6 +42,15 @@ def all_reduce_and_rescale_tensors(tensors, rescale_denom,
         rescale_denom: denominator for rescaling summed Tensors
         buffer_size: all-reduce chunk size in bytes
     """
+    dtypes = sorted(set(t.dtype for t in tensors), key=str)
+    if len(dtypes) > 1:
+        # the buffer has a single data type
+        for dtype in dtypes:
+            all_reduce_and_rescale_tensors(
+                [t for t in tensors if t.dtype == dtype], rescale_denom,
+                buffer_size)
+        return
+
     # buffer size in bytes, determine equiv. # of elements based on data type
     buffer_t = tensors[0].new(
         math.ceil(buffer_size / tensors[0].element_size())).zero_()
@@ -86,37 +96,173 @@ def all_reduce_and_rescale_tensors(tensors, rescale_denom,
         all_reduce_buffer()
 
 
-def all_gather_list(data, max_size=4096):
-    """Gathers arbitrary data from all nodes into a list."""
+class GradientReducer(object):
+    """
+    All-reduces the gradients of `params` during the backward: they are
+    grouped in buckets of about `bucket_size` bytes, and each bucket is
+    all-reduced asynchronously as soon as the backward has accumulated
+    all its gradients, while the backward goes on.
+
+    Buckets are launched in the same order on all processes, the reverse
+    of `params`. Only the last backward before the optimizer step may
+    all-reduce: set `sync` to False, or use `no_sync`, for the backwards
+    that accumulate gradients before it (`accum_count`, loss shards), and
+    call `finish` before the step to wait for the all-reduces. Parameters
+    whose gradients are complete before the backward that syncs, e.g. the
+    generator with loss shards, should come first in `params`: their
+    bucket is launched last, by `finish`, and does not hold back the
+    others.
+
+    The gradients of parameters unused on all processes stay None.
+
+    Args:
+        params: parameters of the model
+        rescale_denom: denominator for rescaling summed gradients
+        bucket_size: bucket size in bytes
+    """
+
+    def __init__(self, params, rescale_denom=1., bucket_size=10485760):
+        self.rescale_denom = rescale_denom
+        self.sync = True
+        # the backward roughly computes the gradients in reverse order
+        self.buckets = []
+        bucket, filled = [], 0
+        for p in reversed([p for p in params if p.requires_grad]):
+            sz = p.numel() * p.element_size()
+            if bucket and (filled + sz > bucket_size
+                           or p.dtype != bucket[0].dtype):
+                self.buckets.append(bucket)
+                bucket, filled = [], 0
+            bucket.append(p)
+            filled += sz
+        if bucket:
+            self.buckets.append(bucket)
+
+        # hooks on the gradient accumulators run once the gradient of
+        # their parameter is accumulated; keep them alive
+        self._grad_accs = []
+        for k, bucket in enumerate(self.buckets):
+            for p in bucket:
+                grad_acc = p.expand_as(p).grad_fn.next_functions[0][0]
+                grad_acc.register_hook(self._make_hook(k, p))
+                self._grad_accs.append(grad_acc)
+        self._reset()
+
+    def _reset(self):
+        self.ready = set()
+        self.n_ready = [0] * len(self.buckets)
+        self.next_bucket = 0
+        self.handles = []
+
+    @contextmanager
+    def no_sync(self):
+        """ Only accumulate the gradients of the backwards run within. """
+        sync = self.sync
+        self.sync = False
+        try:
+            yield
+        finally:
+            self.sync = sync
+
+    def _make_hook(self, k, p):
+        def hook(*unused):
+            if not self.sync:
+                return
+            if id(p) in self.ready:
+                if k < self.next_bucket:
+                    raise RuntimeError(
+                        "Gradient accumulated after its all-reduce: only "
+                        "the last backward before `finish` may sync")
+                return
+            self.ready.add(id(p))
+            self.n_ready[k] += 1
+            while self.next_bucket < len(self.buckets) and \
+                    self.n_ready[self.next_bucket] == \
+                    len(self.buckets[self.next_bucket]):
+                self._launch(self.next_bucket)
+                self.next_bucket += 1
+        return hook
+
+    def _launch(self, k):
+        bucket = self.buckets[k]
+        # followed by the number of processes with a gradient, per param
+        buffer_t = torch.cat([
+            p.grad.detach().view(-1) if p.grad is not None
+            else p.new_zeros(p.numel()) for p in bucket] + [
+            bucket[0].new_tensor([float(p.grad is not None)
+                                  for p in bucket])])
+        handle = torch.distributed.all_reduce(buffer_t, async_op=True)
+        self.handles.append((k, buffer_t, handle))
+
+    def finish(self):
+        """
+        All-reduce the buckets the backward did not complete, e.g. with
+        unused parameters, wait for all buckets and rescale the gradients.
+        """
+        for k in range(self.next_bucket, len(self.buckets)):
+            self._launch(k)
+        for k, buffer_t, handle in self.handles:
+            handle.wait()
+            buffer_t.div_(self.rescale_denom)
+            bucket = self.buckets[k]
+            has_grad = buffer_t[-len(bucket):].tolist()
+            offset = 0
+            for p, n_grads in zip(bucket, has_grad):
+                numel = p.numel()
+                if n_grads > 0:
+                    grad = buffer_t[offset:offset+numel].view_as(p)
+                    if p.grad is None:
+                        p.grad = grad.clone()
+                    else:
+                        p.grad.data.copy_(grad)
+                offset += numel
+        self._reset()
+
+
+def _collective_device():
+    """ Device of the tensors of the collectives of the backend. """
+    if torch.distributed.get_backend() == "nccl":
+        return torch.device("cuda", torch.cuda.current_device())
+    return torch.device("cpu")
+
+
+def all_reduce_numbers(numbers):
+    """Sums lists of numbers across all processes with a single
+    all-reduce. Integers stay exact up to 2 ** 53.
+
+    Args:
+        numbers: list of ints or floats, of the same length on all
+            processes
+
+    Returns:
+        list of floats, the element-wise sums
+    """
+    packed = torch.tensor([float(n) for n in numbers], dtype=torch.float64,
+                          device=_collective_device())
+    torch.distributed.all_reduce(packed)
+    return packed.tolist()
+
+
+def all_gather_list(data):
+    """Gathers arbitrary picklable data from all processes into a list.
+
+    The sizes of the pickles are gathered first, so the data gathered
+    next has no size limit."""
     world_size = torch.distributed.get_world_size()
-    if not hasattr(all_gather_list, '_in_buffer') or \
-            max_size != all_gather_list._in_buffer.size():
-        all_gather_list._in_buffer = torch.cuda.ByteTensor(max_size)
-        all_gather_list._out_buffers = [
-            torch.cuda.ByteTensor(max_size)
-            for i in range(world_size)
-        ]
-    in_buffer = all_gather_list._in_buffer
-    out_buffers = all_gather_list._out_buffers
+    device = _collective_device()
 
     enc = pickle.dumps(data)
-    enc_size = len(enc)
-    if enc_size + 2 > max_size:
-        raise ValueError(
-            'encoded data exceeds max_size: {}'.format(enc_size + 2))
-    assert max_size < 255*256
-    in_buffer[0] = enc_size // 255  # this encoding works for max_size < 65k
-    in_buffer[1] = enc_size % 255
-    in_buffer[2:enc_size+2] = torch.ByteTensor(list(enc))
-
-    torch.distributed.all_gather(out_buffers, in_buffer.cuda())
-
-    results = []
-    for i in range(world_size):
-        out_buffer = out_buffers[i]
-        size = (255 * out_buffer[0].item()) + out_buffer[1].item()
-
-        bytes_list = bytes(out_buffer[2:size+2].tolist())
-        result = pickle.loads(bytes_list)
-        results.append(result)
-    return results
+    size = torch.tensor([len(enc)], dtype=torch.long, device=device)
+    sizes = [torch.zeros_like(size) for _ in range(world_size)]
+    torch.distributed.all_gather(sizes, size)
+    sizes = [s.item() for s in sizes]
+
+    max_size = max(sizes)
+    in_buffer = torch.zeros(max_size, dtype=torch.uint8)
+    in_buffer[:len(enc)] = torch.ByteTensor(list(enc))
+    in_buffer = in_buffer.to(device)
+    out_buffers = [torch.empty_like(in_buffer) for _ in range(world_size)]
+    torch.distributed.all_gather(out_buffers, in_buffer)
+
+    return [pickle.loads(bytes(out_buffer[:size].tolist()))
+            for out_buffer, size in zip(out_buffers, sizes)]
@@ -3,13 +3,16 @@ This includes: LossComputeBase and the standard NMTLossCompute, and
                sharded loss compute stuff.
 """
 from __future__ import division
+import math
+
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
 
 import onmt
 from onmt.modules.sparse_losses import SparsemaxLoss
 from onmt.modules.sparse_activations import LogSparsemax
+from onmt.modules.fused_losses import fused_cross_entropy
+from onmt.modules.util_class import Cast
 
 
 def build_loss_compute(model, tgt_field, opt, train=True):
@@ -36,7 +39,7 @@ def build_loss_compute(model, tgt_field, opt, train=True):
         criterion = LabelSmoothingLoss(
             opt.label_smoothing, len(tgt_field.vocab), ignore_index=padding_idx
         )
-    elif isinstance(model.generator[1], LogSparsemax):
+    elif isinstance(model.generator[-1], LogSparsemax):
         criterion = SparsemaxLoss(ignore_index=padding_idx, reduction='sum')
     else:
         criterion = nn.NLLLoss(ignore_index=padding_idx, reduction='sum')
@@ -46,7 +49,7 @@ def build_loss_compute(model, tgt_field, opt, train=True):
     # passed to the NMTLossCompute. At the moment, the only supported
     # loss function of this kind is the sparsemax loss.
     use_raw_logits = isinstance(criterion, SparsemaxLoss)
-    loss_gen = model.generator[0] if use_raw_logits else model.generator
+    loss_gen = model.generator[:-1] if use_raw_logits else model.generator
     if opt.copy_attn:
         compute = onmt.modules.CopyGeneratorLossCompute(
             criterion, loss_gen, tgt_field.vocab, opt.copy_loss_by_seqlength
@@ -81,6 +84,8 @@ class LossComputeBase(nn.Module):
         super(LossComputeBase, self).__init__()
         self.criterion = criterion
         self.generator = generator
+        # `GradientReducer` of multi-GPU training, set by the trainer
+        self.grad_reducer = None
 
     @property
     def padding_idx(self):
@@ -168,7 +173,13 @@ class LossComputeBase(nn.Module):
         shard_state = self._make_shard_state(batch, output, range_, attns)
         for shard in shards(shard_state, shard_size):
             loss, stats = self._compute_loss(batch, **shard)
-            loss.div(float(normalization)).backward()
+            # the shards accumulate the generator gradients: only the
+            # backward through the decoder, after the last shard, syncs
+            if self.grad_reducer is not None:
+                with self.grad_reducer.no_sync():
+                    loss.div(float(normalization)).backward()
+            else:
+                loss.div(float(normalization)).backward()
             batch_stats.update(stats)
         return batch_stats
 
@@ -182,7 +193,12 @@ class LossComputeBase(nn.Module):
         Returns:
             :obj:`onmt.utils.Statistics` : statistics for this batch.
         """
-        pred = scores.max(1)[1]
+        return self._pred_stats(loss, scores.max(1)[1], target)
+
+    def _pred_stats(self, loss, pred, target):
+        """
+        Same as `_stats`, given the predicted word `pred` of each target.
+        """
         non_padding = target.ne(self.padding_idx)
         num_correct = pred.eq(target).masked_select(non_padding).sum().item()
         num_non_padding = non_padding.sum().item()
@@ -200,38 +216,75 @@ class LabelSmoothingLoss(nn.Module):
     With label smoothing,
     KL-divergence between q_{smoothed ground truth prob.}(w)
     and p_{prob. computed by model}(w) is minimized.
+
+    q gives `1 - label_smoothing` to the gold word, 0 to `ignore_index`
+    and `label_smoothing` / (vocab size - 2) to each other word, so the
+    KL-divergence of a target is computed in closed form from the gold,
+    padding and summed log probs, without building q.
     """
     def __init__(self, label_smoothing, tgt_vocab_size, ignore_index=-100):
         assert 0.0 < label_smoothing <= 1.0
         self.ignore_index = ignore_index
         super(LabelSmoothingLoss, self).__init__()
 
-        smoothing_value = label_smoothing / (tgt_vocab_size - 2)
-        one_hot = torch.full((tgt_vocab_size,), smoothing_value)
-        one_hot[self.ignore_index] = 0
-        self.register_buffer('one_hot', one_hot.unsqueeze(0))
-
+        self.smoothing_value = label_smoothing / (tgt_vocab_size - 2)
         self.confidence = 1.0 - label_smoothing
+        # sum of q log q
+        self.entropy = 0.
+        if self.confidence > 0:
+            self.entropy += self.confidence * math.log(self.confidence)
+        self.entropy += label_smoothing * math.log(self.smoothing_value)
 
     def forward(self, output, target):
         """
         output (FloatTensor): batch_size x n_classes
         target (LongTensor): batch_size
         """
-        model_prob = self.one_hot.repeat(target.size(0), 1)
-        model_prob.scatter_(1, target.unsqueeze(1), self.confidence)
-        model_prob.masked_fill_((target == self.ignore_index).unsqueeze(1), 0)
-
-        return F.kl_div(output, model_prob, reduction='sum')
+        gold = output.gather(1, target.unsqueeze(1)).squeeze(1)
+        others = output.sum(1) - gold - output[:, self.ignore_index]
+        loss = self.entropy - self.confidence * gold \
+            - self.smoothing_value * others
+        return loss.masked_fill(target == self.ignore_index, 0).sum()
 
 
 class NMTLossCompute(LossComputeBase):
     """
     Standard NMT Loss Computation.
+
+    With a softmax generator and the NLL or label smoothing loss, the
+    generator and the loss are fused (see `fused_cross_entropy`): the
+    loss of a truncation is computed `shard_size` steps at a time
+    without keeping the log probs, in a single backward.
+
+    Args:
+        fused (bool): fuse the generator and the loss when possible
     """
 
-    def __init__(self, criterion, generator, normalization="sents"):
+    def __init__(self, criterion, generator, normalization="sents",
+                 fused=True):
         super(NMTLossCompute, self).__init__(criterion, generator)
+        # the fused loss computes in fp32: a `Cast` between the linear
+        # layer and the log softmax is part of it
+        self.fused = fused and \
+            isinstance(criterion, (nn.NLLLoss, LabelSmoothingLoss)) and \
+            isinstance(generator, nn.Sequential) and len(generator) >= 2 \
+            and isinstance(generator[0], nn.Linear) \
+            and isinstance(generator[-1], nn.LogSoftmax) \
+            and all(isinstance(m, Cast) for m in generator[1:-1])
+
+    def sharded_compute_loss(self, batch, output, attns,
+                             cur_trunc, trunc_size, shard_size,
+                             normalization):
+        if not self.fused:
+            return super(NMTLossCompute, self).sharded_compute_loss(
+                batch, output, attns, cur_trunc, trunc_size, shard_size,
+                normalization)
+        range_ = (cur_trunc, cur_trunc + trunc_size)
+        shard_state = self._make_shard_state(batch, output, range_, attns)
+        loss, stats = self._compute_loss(
+            batch, chunk_size=shard_size * output.size(1), **shard_state)
+        loss.div(float(normalization)).backward()
+        return stats
 
     def _make_shard_state(self, batch, output, range_, attns=None):
         return {
@@ -239,9 +292,21 @@ class NMTLossCompute(LossComputeBase):
             "target": batch.tgt[range_[0] + 1: range_[1]],
         }
 
-    def _compute_loss(self, batch, output, target):
+    def _compute_loss(self, batch, output, target, chunk_size=0):
         bottled_output = self._bottle(output)
 
+        if self.fused:
+            gtruth = target.view(-1)
+            label_smoothing = 0.
+            if isinstance(self.criterion, LabelSmoothingLoss):
+                label_smoothing = 1.0 - self.criterion.confidence
+            linear = self.generator[0]
+            loss, pred = fused_cross_entropy(
+                bottled_output, linear.weight, linear.bias, gtruth,
+                self.padding_idx, label_smoothing, chunk_size)
+            stats = self._pred_stats(loss.clone(), pred, gtruth)
+            return loss, stats
+
         scores = self.generator(bottled_output)
         gtruth = target.view(-1)
 
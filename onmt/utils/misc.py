@@ -1,8 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import codecs
+from itertools import islice
+
 import torch
 
 
+def split_corpus(corpus, shard_size):
+    """
+    Yield lists of `shard_size` lines of `corpus`, a file path or an
+    iterable of lines, reading it lazily. `shard_size` 0 yields one shard.
+    """
+    if isinstance(corpus, str):
+        with codecs.open(corpus, "r", encoding="utf-8") as f:
+            for shard in split_corpus(f, shard_size):
+                yield shard
+        return
+    corpus = iter(corpus)
+    while True:
+        shard = list(islice(corpus, shard_size or None))
+        if not shard:
+            break
+        yield shard
+
+
 def aeq(*args):
     """
     Assert all arguments have the same value
@@ -12,9 +12,13 @@ from math import sqrt
 def build_optim(model, opt, checkpoint):
     """ Build optimizer """
     saved_optimizer_state_dict = None
+    saved_master_params = None
 
     if opt.train_from and opt.reset_optim != 'all':
         optim = checkpoint['optim']
+        # fp32 master weights of a reduced precision model, more precise
+        # than the model once cast
+        saved_master_params = getattr(optim, 'master_params', None)
         # We need to save a copy of optim.optimizer.state_dict() for setting
         # the, optimizer state later on in Stage 2 in this method, since
         # the method optim.set_parameters(model) will overwrite
@@ -46,7 +50,11 @@ def build_optim(model, opt, checkpoint):
             adagrad_accum=opt.adagrad_accumulator_init,
             decay_method=opt.decay_method,
             warmup_steps=opt.warmup_steps,
-            model_size=opt.rnn_size)
+            model_size=opt.rnn_size,
+            loss_scale=opt.loss_scale)
+    if not hasattr(optim, 'loss_scaler'):
+        # checkpoints older than mixed precision
+        optim.loss_scaler = LossScaler(opt.loss_scale)
 
     # Stage 1:
     # Essentially optim.set_parameters (re-)creates and optimizer using
@@ -56,6 +64,9 @@ def build_optim(model, opt, checkpoint):
     # essentially it builds a new optimizer with empty optimizer state and
     # parameters from the model.
     optim.set_parameters(model)
+    if optim.model_params is not None and saved_master_params is not None:
+        for master, saved in zip(optim.master_params, saved_master_params):
+            master.data.copy_(saved.data)
 
     if opt.train_from and (opt.reset_optim in ['none', 'keep_states']):
         # Stage 2: In this stage, which is only performed when loading an
@@ -125,6 +136,40 @@ class MultipleOptimizer(object):
             self.optimizers[i].load_state_dict(state_dicts[i])
 
 
+class LossScaler(object):
+    """
+    Scale of the loss of a mixed precision model, which keeps small
+    gradients from underflowing in fp16.
+
+    Args:
+      loss_scale (float): static scale, or 0 for a dynamic scale
+      init_scale (float): first dynamic scale
+      scale_window (int): steps without overflow before the dynamic
+        scale doubles; it halves on each overflow
+    """
+
+    def __init__(self, loss_scale=0, init_scale=2. ** 15, scale_window=2000):
+        self.dynamic = loss_scale == 0
+        self.scale = init_scale if self.dynamic else loss_scale
+        self.scale_window = scale_window
+        self.good_steps = 0
+        self.skipped_steps = 0
+
+    def update(self, overflow):
+        """ Update the scale after a step, skipped if `overflow`. """
+        if overflow:
+            self.skipped_steps += 1
+        if not self.dynamic:
+            return
+        if overflow:
+            self.scale = max(self.scale / 2, 1.)
+            self.good_steps = 0
+        else:
+            self.good_steps += 1
+            if self.good_steps % self.scale_window == 0:
+                self.scale *= 2
+
+
 class Optimizer(object):
     """
     Controller class for optimization. Mostly a thin
@@ -143,6 +188,12 @@ class Optimizer(object):
       decay_method (str, option): custom decay options
       warmup_steps (int, option): parameter for `noam` decay
       model_size (int, option): parameter for `noam` decay
+      loss_scale (float, option): loss scale of fp16 and bf16 models,
+        0 for dynamic (see `LossScaler`)
+
+    The parameters of fp16 and bf16 models are updated from fp32 master
+    weights, which receive the unscaled gradients. Steps whose gradients
+    overflow are skipped.
 
     We use the default parameters for Adam that are suggested by
     the original paper https://arxiv.org/pdf/1412.6980.pdf
@@ -162,7 +213,8 @@ class Optimizer(object):
                  adagrad_accum=0.0,
                  decay_method=None,
                  warmup_steps=4000,
-                 model_size=None):
+                 model_size=None,
+                 loss_scale=0):
         self.last_ppl = None
         self.learning_rate = learning_rate
         self.original_lr = learning_rate
@@ -177,10 +229,20 @@ class Optimizer(object):
         self.decay_method = decay_method
         self.warmup_steps = warmup_steps
         self.model_size = model_size
+        self.loss_scaler = LossScaler(loss_scale)
 
     def set_parameters(self, model):
         """ ? """
         params = [p for p in model.parameters() if p.requires_grad]
+        names = [name for name, p in model.named_parameters()
+                 if p.requires_grad]
+        self.model_params = None
+        if any(p.dtype != torch.float32 for p in params):
+            # reduced precision model: optimize fp32 copies
+            self.model_params = params
+            params = [p.detach().clone().float().requires_grad_()
+                      for p in params]
+        self.master_params = params
         if self.method == 'sgd':
             self.optimizer = optim.SGD(params, lr=self.learning_rate)
         elif self.method == 'adagrad':
@@ -200,9 +262,7 @@ class Optimizer(object):
         elif self.method == 'sparseadam':
             dense = []
             sparse = []
-            for name, param in model.named_parameters():
-                if not param.requires_grad:
-                    continue
+            for name, param in zip(names, params):
                 # TODO: Find a better way to check for sparse gradients.
                 if 'embed' in name:
                     sparse.append(param)
@@ -216,12 +276,54 @@ class Optimizer(object):
         else:
             raise RuntimeError("Invalid optim method: " + self.method)
 
+    def __getstate__(self):
+        # checkpoints hold the weights of a reduced precision model as
+        # their fp32 master copy (see `ModelSaver`), not twice
+        state = self.__dict__.copy()
+        state['model_params'] = None
+        return state
+
+    @property
+    def loss_scale(self):
+        """ Factor of the loss in the backward. """
+        if self.model_params is None:
+            return 1
+        return self.loss_scaler.scale
+
+    def _unscale_grads(self):
+        """
+        Copy the gradients of a reduced precision model to the master
+        weights, divided by the loss scale. Returns False on overflow.
+        """
+        total = 0.
+        for p, master in zip(self.model_params, self.master_params):
+            if p.grad is None:
+                master.grad = None
+                continue
+            grad = p.grad.detach()
+            if grad.is_sparse:
+                master.grad = grad.float()
+            else:
+                if master.grad is None:
+                    master.grad = torch.empty_like(master)
+                master.grad.copy_(grad)
+                # inf or nan gradients make the sum inf or nan
+                total += master.grad.sum()
+            master.grad.div_(self.loss_scaler.scale)
+        total = float(total)
+        overflow = total in [float('inf'), -float('inf')] or total != total
+        self.loss_scaler.update(overflow)
+        return not overflow
+
     def step(self):
         """Update the model parameters based on current gradients.
 
         Optionally, will employ gradient modification or update learning
         rate.
         """
+        if self.model_params is not None and not self._unscale_grads():
+            # the gradients overflowed: skip the step with a lower scale
+            return
         self._step += 1
 
         # Decay method used in tensor2tensor.
@@ -245,6 +347,9 @@ class Optimizer(object):
             if self.max_grad_norm:
                 clip_grad_norm_(group['params'], self.max_grad_norm)
         self.optimizer.step()
+        if self.model_params is not None:
+            for p, master in zip(self.model_params, self.master_params):
+                p.data.copy_(master.data)
 
 # Code below is an implementation of https://arxiv.org/pdf/1804.04235.pdf
 # inspired but modified from https://github.com/DeadAt0m/adafactor-pytorch
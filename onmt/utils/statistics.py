@@ -4,8 +4,7 @@ import time
 import math
 import sys
 
-from torch.distributed import get_rank
-from onmt.utils.distributed import all_gather_list
+from onmt.utils.distributed import all_reduce_numbers
 from onmt.utils.logging import logger
 
 
@@ -17,6 +16,7 @@ class Statistics(object):
     * accuracy
     * perplexity
     * elapsed time
+    * padding ratio and padded tokens per batch of each side
     """
 
     def __init__(self, loss=0, n_words=0, n_correct=0):
@@ -24,48 +24,53 @@ class Statistics(object):
         self.n_words = n_words
         self.n_correct = n_correct
         self.n_src_words = 0
+        self.n_batches = 0
+        self.n_src_padded = 0
+        self.n_tgt_padded = 0
         self.start_time = time.time()
 
+    # counts summed across processes, the loss aside
+    COUNTS = ["n_words", "n_correct", "n_src_words", "n_batches",
+              "n_src_padded", "n_tgt_padded"]
+
     @staticmethod
-    def all_gather_stats(stat, max_size=4096):
+    def all_gather_stats(stat):
         """
         Gather a `Statistics` object accross multiple process/nodes
 
         Args:
             stat(:obj:Statistics): the statistics object to gather
                 accross all processes/nodes
-            max_size(int): max buffer size to use
 
         Returns:
             `Statistics`, the update stats object
         """
-        stats = Statistics.all_gather_stats_list([stat], max_size=max_size)
+        stats = Statistics.all_gather_stats_list([stat])
         return stats[0]
 
     @staticmethod
-    def all_gather_stats_list(stat_list, max_size=4096):
+    def all_gather_stats_list(stat_list):
         """
-        Gather a `Statistics` list accross all processes/nodes
+        Gather a `Statistics` list accross all processes/nodes, by summing
+        their fields in a single all-reduce
 
         Args:
             stat_list(list([`Statistics`])): list of statistics objects to
                 gather accross all processes/nodes
-            max_size(int): max buffer size to use
 
         Returns:
             our_stats(list([`Statistics`])): list of updated stats
         """
-        # Get a list of world_size lists with len(stat_list) Statistics objects
-        all_stats = all_gather_list(stat_list, max_size=max_size)
-
-        our_rank = get_rank()
-        our_stats = all_stats[our_rank]
-        for other_rank, stats in enumerate(all_stats):
-            if other_rank == our_rank:
-                continue
-            for i, stat in enumerate(stats):
-                our_stats[i].update(stat, update_n_src_words=True)
-        return our_stats
+        fields = ["loss"] + Statistics.COUNTS
+        sums = all_reduce_numbers([getattr(stat, field)
+                                   for stat in stat_list
+                                   for field in fields])
+        for i, stat in enumerate(stat_list):
+            values = sums[i * len(fields):(i + 1) * len(fields)]
+            stat.loss = values[0]
+            for field, value in zip(Statistics.COUNTS, values[1:]):
+                setattr(stat, field, int(value))
+        return stat_list
 
     def update(self, stat, update_n_src_words=False):
         """
@@ -83,6 +88,26 @@ class Statistics(object):
 
         if update_n_src_words:
             self.n_src_words += stat.n_src_words
+            self.n_batches += stat.n_batches
+            self.n_src_padded += stat.n_src_padded
+            self.n_tgt_padded += stat.n_tgt_padded
+
+    def update_batch(self, batch, src_lengths=None):
+        """
+        Count the padded tokens of a training batch.
+
+        Args:
+            batch: the batch, its `src` and `tgt` are padded to
+                `(len, batch_size)`
+            src_lengths(LongTensor): source lengths of a text batch, the
+                source side is not counted without them
+        """
+        self.n_batches += 1
+        # the first target token is only fed to the decoder, as in n_words
+        self.n_tgt_padded += (batch.tgt.size(0) - 1) * batch.batch_size
+        if src_lengths is not None:
+            self.n_src_words += src_lengths.sum().item()
+            self.n_src_padded += batch.src[0].size(0) * batch.batch_size
 
     def accuracy(self):
         """ compute accuracy """
@@ -96,6 +121,26 @@ class Statistics(object):
         """ compute perplexity """
         return math.exp(min(self.loss / self.n_words, 100))
 
+    def src_padding(self):
+        """ compute the share (%) of padding in source batches """
+        if self.n_src_padded == 0:
+            return 0.
+        return 100 * (1 - self.n_src_words / self.n_src_padded)
+
+    def tgt_padding(self):
+        """ compute the share (%) of padding in target batches """
+        if self.n_tgt_padded == 0:
+            return 0.
+        return 100 * (1 - self.n_words / self.n_tgt_padded)
+
+    def src_tok_per_batch(self):
+        """ compute padded source tokens per batch """
+        return self.n_src_padded / max(self.n_batches, 1)
+
+    def tgt_tok_per_batch(self):
+        """ compute padded target tokens per batch """
+        return self.n_tgt_padded / max(self.n_batches, 1)
+
     def elapsed_time(self):
         """ compute elapsed time """
         return time.time() - self.start_time
@@ -120,6 +165,15 @@ class Statistics(object):
                self.n_src_words / (t + 1e-5),
                self.n_words / (t + 1e-5),
                time.time() - start))
+        if self.n_batches > 0:
+            logger.info(
+                "Step %2d/%5d; pad: %4.1f%%/%4.1f%%; "
+                "%5.0f/%5.0f padded tok/batch"
+                % (step, num_steps,
+                   self.src_padding(),
+                   self.tgt_padding(),
+                   self.src_tok_per_batch(),
+                   self.tgt_tok_per_batch()))
         sys.stdout.flush()
 
     def log_tensorboard(self, prefix, writer, learning_rate, step):
@@ -130,3 +184,12 @@ class Statistics(object):
         writer.add_scalar(prefix + "/accuracy", self.accuracy(), step)
         writer.add_scalar(prefix + "/tgtper", self.n_words / t, step)
         writer.add_scalar(prefix + "/lr", learning_rate, step)
+        if self.n_batches > 0:
+            writer.add_scalar(prefix + "/src_padding", self.src_padding(),
+                              step)
+            writer.add_scalar(prefix + "/tgt_padding", self.tgt_padding(),
+                              step)
+            writer.add_scalar(prefix + "/src_tok_per_batch",
+                              self.src_tok_per_batch(), step)
+            writer.add_scalar(prefix + "/tgt_tok_per_batch",
+                              self.tgt_tok_per_batch(), step)
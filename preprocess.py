@@ -10,9 +10,12 @@ import sys
 import gc
 import os
 import codecs
-from itertools import islice
+import multiprocessing
+from collections import Counter, defaultdict, deque
+from functools import partial
 import torch
 from onmt.utils.logging import init_logger, logger
+from onmt.utils.misc import split_corpus
 
 import onmt.inputters as inputters
 import onmt.opts as opts
@@ -20,9 +23,10 @@ import onmt.opts as opts
 
 def check_existing_pt_files(opt):
     """ Check if there are existing .pt files to avoid overwriting them """
-    pattern = opt.save_data + '.{}*.pt'
-    for t in ['train', 'valid', 'vocab']:
-        path = pattern.format(t)
+    pattern = opt.save_data + '.{}*{}'
+    for t, ext in [('train', '.pt'), ('valid', '.pt'), ('vocab', '.pt'),
+                   ('train', '.bin'), ('valid', '.bin')]:
+        path = pattern.format(t, ext)
         if glob.glob(path):
             sys.stderr.write("Please backup existing pt files: %s, "
                              "to avoid overwriting them!\n" % path)
@@ -47,16 +51,78 @@ def parse_args():
     return opt
 
 
-def split_corpus(path, shard_size):
-    with codecs.open(path, "r", encoding="utf-8") as f:
-        while True:
-            shard = list(islice(f, shard_size))
-            if not shard:
-                break
-            yield shard
+def build_save_shard(corpus_type, fields, opt, i, src_shard, tgt_shard):
+    """
+    Build the `i`-th shard of `corpus_type` and save it to disk.
+
+    Returns:
+        The path of the saved shard and the token `Counter`s of its
+        sequential fields (empty for validation data).
+    """
+    assert len(src_shard) == len(tgt_shard)
+    logger.info("Building shard %d." % i)
+    if opt.shard_format == 'mmap':
+        data_path = "{:s}.{:s}.{:d}.bin".format(
+            opt.save_data, corpus_type, i)
+        logger.info(" * saving %sth %s data shard to %s."
+                    % (i, corpus_type, data_path))
+        filter_pred = None
+        if corpus_type == 'train' or opt.filter_valid:
+            filter_pred = partial(
+                inputters.inputter.filter_example,
+                max_src_len=opt.src_seq_length,
+                max_tgt_len=opt.tgt_seq_length)
+        counters = inputters.write_mmap_shard(
+            data_path, src_shard, tgt_shard,
+            src_seq_length_trunc=opt.src_seq_length_trunc,
+            tgt_seq_length_trunc=opt.tgt_seq_length_trunc,
+            filter_pred=filter_pred)
+        return data_path, counters if corpus_type == 'train' else {}
+
+    dataset = inputters.build_dataset(
+        fields, opt.data_type,
+        src=src_shard,
+        tgt=tgt_shard,
+        src_dir=opt.src_dir,
+        src_seq_len=opt.src_seq_length,
+        tgt_seq_len=opt.tgt_seq_length,
+        src_seq_length_trunc=opt.src_seq_length_trunc,
+        tgt_seq_length_trunc=opt.tgt_seq_length_trunc,
+        dynamic_dict=opt.dynamic_dict,
+        sample_rate=opt.sample_rate,
+        window_size=opt.window_size,
+        window_stride=opt.window_stride,
+        window=opt.window,
+        image_channel_size=opt.image_channel_size,
+        use_filter_pred=corpus_type == 'train' or opt.filter_valid
+    )
+
+    data_path = "{:s}.{:s}.{:d}.pt".format(opt.save_data, corpus_type, i)
+    counters = {}
+    if corpus_type == 'train':
+        counters = inputters.count_tokens(dataset.examples, fields)
+
+    logger.info(" * saving %sth %s data shard to %s."
+                % (i, corpus_type, data_path))
+
+    dataset.save(data_path)
+
+    del dataset.examples
+    gc.collect()
+    del dataset
+    gc.collect()
+
+    return data_path, counters
 
 
 def build_save_dataset(corpus_type, fields, opt):
+    """
+    Build and save the shards of `corpus_type`.
+
+    Returns:
+        The paths of the shards in corpus order and the token `Counter`s
+        of the whole corpus, merged shard after shard.
+    """
     assert corpus_type in ['train', 'valid']
 
     if corpus_type == 'train':
@@ -71,54 +137,62 @@ def build_save_dataset(corpus_type, fields, opt):
     src_shards = split_corpus(src, opt.shard_size)
     tgt_shards = split_corpus(tgt, opt.shard_size)
     shard_pairs = zip(src_shards, tgt_shards)
+
     dataset_paths = []
+    counters = defaultdict(Counter)
 
-    for i, (src_shard, tgt_shard) in enumerate(shard_pairs):
-        assert len(src_shard) == len(tgt_shard)
-        logger.info("Building shard %d." % i)
-        dataset = inputters.build_dataset(
-            fields, opt.data_type,
-            src=src_shard,
-            tgt=tgt_shard,
-            src_dir=opt.src_dir,
-            src_seq_len=opt.src_seq_length,
-            tgt_seq_len=opt.tgt_seq_length,
-            src_seq_length_trunc=opt.src_seq_length_trunc,
-            tgt_seq_length_trunc=opt.tgt_seq_length_trunc,
-            dynamic_dict=opt.dynamic_dict,
-            sample_rate=opt.sample_rate,
-            window_size=opt.window_size,
-            window_stride=opt.window_stride,
-            window=opt.window,
-            image_channel_size=opt.image_channel_size,
-            use_filter_pred=corpus_type == 'train' or opt.filter_valid
-        )
-
-        data_path = "{:s}.{:s}.{:d}.pt".format(opt.save_data, corpus_type, i)
+    def collect(result):
+        data_path, shard_counters = result
         dataset_paths.append(data_path)
-
-        logger.info(" * saving %sth %s data shard to %s."
-                    % (i, corpus_type, data_path))
-
-        dataset.save(data_path)
-
-        del dataset.examples
-        gc.collect()
-        del dataset
-        gc.collect()
-
-    return dataset_paths
-
-
-def build_save_vocab(train_dataset, fields, opt):
+        for k, counter in shard_counters.items():
+            counters[k].update(counter)
+
+    if opt.num_workers <= 1:
+        for i, (src_shard, tgt_shard) in enumerate(shard_pairs):
+            collect(build_save_shard(
+                corpus_type, fields, opt, i, src_shard, tgt_shard))
+        return dataset_paths, dict(counters)
+
+    # Only `num_workers` shards are in flight at any time: a shard is read
+    # from disk when a worker is about to be free, and every worker is
+    # replaced after each shard so that its memory is given back.
+    build_fn = partial(build_save_shard, corpus_type, fields, opt)
+    pool = multiprocessing.Pool(opt.num_workers, maxtasksperchild=1)
+    pending = deque()
+    try:
+        for i, (src_shard, tgt_shard) in enumerate(shard_pairs):
+            if len(pending) == opt.num_workers:
+                collect(pending.popleft().get())
+            pending.append(pool.apply_async(
+                build_fn, (i, src_shard, tgt_shard)))
+            del src_shard, tgt_shard
+        while pending:
+            collect(pending.popleft().get())
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return dataset_paths, dict(counters)
+
+
+def build_save_vocab(train_dataset, fields, opt, counters=None):
     fields = inputters.build_vocab(
         train_dataset, fields, opt.data_type, opt.share_vocab,
         opt.src_vocab, opt.src_vocab_size, opt.src_words_min_frequency,
-        opt.tgt_vocab, opt.tgt_vocab_size, opt.tgt_words_min_frequency
+        opt.tgt_vocab, opt.tgt_vocab_size, opt.tgt_words_min_frequency,
+        counters=counters
     )
 
     vocab_path = opt.save_data + '.vocab.pt'
     torch.save(inputters.save_fields_to_vocab(fields), vocab_path)
+    return fields
+
+
+def numericalize_shards(dataset_paths, fields):
+    """ Map the ids of memory-mapped shards to the final vocabulary """
+    for path in dataset_paths:
+        logger.info(" * numericalizing %s." % path)
+        inputters.numericalize_mmap_shard(path, fields)
 
 
 def count_features(path):
@@ -142,6 +216,11 @@ def main():
         "-shuffle is not implemented. Please shuffle \
         your data before pre-processing."
 
+    assert opt.shard_format == 'pt' or opt.data_type == 'text', \
+        "-shard_format mmap is only available for text data."
+    assert opt.shard_format == 'pt' or not opt.dynamic_dict, \
+        "-dynamic_dict is not supported with -shard_format mmap yet."
+
     assert os.path.isfile(opt.train_src) and os.path.isfile(opt.train_tgt), \
         "Please check path of your train src and tgt files!"
 
@@ -161,13 +240,19 @@ def main():
     fields = inputters.get_fields(opt.data_type, src_nfeats, tgt_nfeats)
 
     logger.info("Building & saving training data...")
-    train_dataset_files = build_save_dataset('train', fields, opt)
+    train_dataset_files, counters = build_save_dataset('train', fields, opt)
 
     logger.info("Building & saving validation data...")
-    build_save_dataset('valid', fields, opt)
+    valid_dataset_files, _ = build_save_dataset('valid', fields, opt)
 
     logger.info("Building & saving vocabulary...")
-    build_save_vocab(train_dataset_files, fields, opt)
+    fields = build_save_vocab(train_dataset_files, fields, opt,
+                              counters=counters)
+
+    if opt.shard_format == 'mmap':
+        logger.info("Numericalizing memory-mapped shards...")
+        numericalize_shards(train_dataset_files + valid_dataset_files,
+                            fields)
 
 
 if __name__ == "__main__":
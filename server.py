@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 import configargparse
+import json
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from onmt.translate import TranslationServer, ServerModelError
 
 STATUS_OK = "ok"
@@ -83,6 +84,29 @@ def start(config_file,
 
         return jsonify(out)
 
+    @app.route('/translate_stream', methods=['POST'])
+    def translate_stream():
+        """Same inputs as /translate. The response is chunked, with one
+           JSON object per line and per input, in order, sent as soon as
+           the input is translated. An error ends the stream with an
+           object holding `status` and `error`.
+        """
+        inputs = request.get_json(force=True)
+
+        def generate():
+            try:
+                for i, translation, score in \
+                        translation_server.run_stream(inputs):
+                    yield json.dumps({"id": i, "src": inputs[i]['src'],
+                                      "tgt": translation, "n_best": 1,
+                                      "pred_score": score}) + "\n"
+            except ServerModelError as e:
+                yield json.dumps({"status": STATUS_ERROR,
+                                  "error": str(e)}) + "\n"
+
+        return Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson')
+
     @app.route('/to_cpu/<int:model_id>', methods=['GET'])
     def to_cpu(model_id):
         out = {'model_id': model_id}
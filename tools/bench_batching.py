@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of token batching: torchtext's `batch` with the
+`max_tok_len` batch size function against `onmt.inputters.plan_batches`.
+
+Both plan the batches of a shard of random sentence lengths, with the same
+pool-and-sort strategy, and report examples planned per second and the
+share of padding in the planned batches.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import torchtext
+
+from onmt.inputters.batching import plan_batches, token_costs
+from onmt.inputters.inputter import max_tok_len
+
+
+class _Example(object):
+    __slots__ = ['src', 'tgt']
+
+    def __init__(self, src, tgt):
+        self.src = src
+        self.tgt = tgt
+
+
+def torchtext_plan(examples, batch_size, pool_factor):
+    """ The training path of `OrderedIterator.create_batches`. """
+    examples = list(examples)
+    random.shuffle(examples)
+    plan = []
+    for p in torchtext.data.batch(examples, batch_size * pool_factor):
+        p = sorted(p, key=lambda ex: (len(ex.src), len(ex.tgt)))
+        batches = list(torchtext.data.batch(p, batch_size, max_tok_len))
+        random.shuffle(batches)
+        plan.extend(batches)
+    return plan
+
+
+def padding_ratio(batches, costs):
+    """ Share of padding among the padded tokens of `batches`. """
+    padded = sum(len(b) * costs[b].max() for b in batches)
+    return 1. - sum(costs[b].sum() for b in batches) / padded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n_examples', type=int, default=200000)
+    parser.add_argument('-batch_size', type=int, default=4096,
+                        help="Tokens per batch")
+    parser.add_argument('-pool_factor', type=int, default=100)
+    parser.add_argument('-max_len', type=int, default=100)
+    parser.add_argument('-seed', type=int, default=1)
+    opt = parser.parse_args()
+
+    rng = np.random.RandomState(opt.seed)
+    random.seed(opt.seed)
+    src_lens = rng.randint(1, opt.max_len, size=opt.n_examples)
+    tgt_lens = np.clip(
+        src_lens + rng.randint(-5, 6, size=opt.n_examples), 1, None)
+    costs = token_costs(src_lens, tgt_lens)
+
+    examples = [_Example([0] * s, [0] * t)
+                for s, t in zip(src_lens.tolist(), tgt_lens.tolist())]
+    ids = {id(ex): i for i, ex in enumerate(examples)}
+    start = time.time()
+    ref = torchtext_plan(examples, opt.batch_size, opt.pool_factor)
+    ref_time = time.time() - start
+    ref = [np.array([ids[id(ex)] for ex in b]) for b in ref if b]
+
+    start = time.time()
+    plan = plan_batches(src_lens, tgt_lens, opt.batch_size,
+                        token_batching=True, pool_factor=opt.pool_factor,
+                        seed=opt.seed)
+    plan_time = time.time() - start
+
+    for name, batches, t in [('torchtext + max_tok_len', ref, ref_time),
+                             ('plan_batches', plan, plan_time)]:
+        print("%-24s %8d batches %12.0f examples/s  padding %5.2f%%"
+              % (name, len(batches), opt.n_examples / t,
+                 100 * padding_ratio(batches, costs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of multi-process CPU translation: translate `-src` with the model
+and options of translate.py for several `-num_workers`, and report the
+sentences per second of each count and its speedup over the first count
+(one worker by default).
+
+Use a `-shard_size` small enough to give every worker several shards.
+The predictions of every count are compared with those of one worker.
+"""
+from __future__ import print_function
+import codecs
+import os
+import time
+
+import configargparse
+
+import onmt.opts as opts
+from onmt.translate.translator import build_translator
+
+
+def main():
+    parser = configargparse.ArgumentParser(description=__doc__)
+    opts.translate_opts(parser)
+    parser.add('-workers', type=int, nargs='+', default=[1, 2, 4],
+               help="Numbers of workers to try")
+    opt = parser.parse_args()
+
+    translator = build_translator(
+        opt, report_score=False,
+        out_file=codecs.open(os.devnull, 'w', 'utf-8'))
+
+    print("%8s %10s %8s %10s" % ('workers', 'sents/s', 'speedup',
+                                 'efficiency'))
+    reference = None
+    base = None
+    for n in opt.workers:
+        translator.num_workers = n
+        start = time.time()
+        _, predictions = translator.translate(
+            src=opt.src, src_dir=opt.src_dir, batch_size=opt.batch_size)
+        rate = len(predictions) / (time.time() - start)
+        if reference is None:
+            reference, base = predictions, rate
+        print("%8d %10.1f %7.2fx %9.0f%%%s"
+              % (n, rate, rate / base, 100 * rate / base / n,
+                 "" if predictions == reference else "  (differs)"))
+
+
+if __name__ == "__main__":
+    main()
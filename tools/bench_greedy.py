@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of greedy translation: the `-fast` beam search with a beam of 1
+against the dedicated greedy search of `Translator`.
+
+Both translate `-src` with the model and options of translate.py, and
+report predicted tokens per second. The predictions of both are compared.
+"""
+from __future__ import print_function
+import codecs
+import os
+import time
+
+import configargparse
+import torch
+
+import onmt.inputters as inputters
+import onmt.opts as opts
+from onmt.translate.translator import build_translator
+
+
+def run(translator, data, batches, method):
+    """ Predicted tokens per second and predictions of `method`. """
+    predictions = []
+    n_tokens = 0
+    if translator.cuda:
+        torch.cuda.synchronize()
+    start = time.time()
+    with torch.no_grad():
+        for batch in batches:
+            results = method(batch, data, translator.max_length,
+                             min_length=translator.min_length)
+            for preds in results["predictions"]:
+                n_tokens += len(preds[0])
+                predictions.append(preds[0].tolist())
+    if translator.cuda:
+        torch.cuda.synchronize()
+    return n_tokens / (time.time() - start), predictions
+
+
+def main():
+    parser = configargparse.ArgumentParser(description=__doc__)
+    opts.translate_opts(parser)
+    parser.add('-repeat', type=int, default=3,
+               help="Number of timed runs of each search")
+    opt = parser.parse_args()
+    opt.beam_size = 1
+    opt.n_best = 1
+    opt.fast = True
+
+    translator = build_translator(
+        opt, report_score=False,
+        out_file=codecs.open(os.devnull, 'w', 'utf-8'))
+    data = inputters.build_dataset(
+        translator.fields, translator.data_type, src=opt.src,
+        src_dir=opt.src_dir, sample_rate=opt.sample_rate,
+        window_size=opt.window_size, window_stride=opt.window_stride,
+        window=opt.window, image_channel_size=opt.image_channel_size,
+        dynamic_dict=translator.copy_attn)
+    batches = list(inputters.OrderedIterator(
+        dataset=data, device="cuda" if translator.cuda else "cpu",
+        batch_size=opt.batch_size, train=False, sort=False,
+        sort_within_batch=True, shuffle=False))
+
+    searches = [('beam search, beam 1', translator._fast_translate_batch),
+                ('greedy search', translator._greedy_translate_batch)]
+    outputs = []
+    for name, method in searches:
+        run(translator, data, batches[:1], method)  # warm up
+        runs = [run(translator, data, batches, method)
+                for _ in range(opt.repeat)]
+        outputs.append(runs[-1][1])
+        print("%-20s %10.0f tok/s" % (name, max(r[0] for r in runs)))
+    print("same predictions: %s" % (outputs[0] == outputs[1]))
+
+
+if __name__ == "__main__":
+    main()
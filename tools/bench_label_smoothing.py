@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the label smoothing loss: `LabelSmoothingLoss`, in
+closed form, against the KL-divergence with the smoothed distribution
+built as a dense `tokens x vocab` tensor.
+
+Both run the log softmax, loss and backward of random logits and report
+the time of a step, the peak memory above the logits (on GPU) and the
+difference between the losses.
+"""
+from __future__ import print_function
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from onmt.utils.loss import LabelSmoothingLoss
+
+
+class DenseLabelSmoothingLoss(object):
+    """ The smoothed distribution as a dense tensor, as before. """
+
+    def __init__(self, label_smoothing, tgt_vocab_size, ignore_index,
+                 device):
+        smoothing_value = label_smoothing / (tgt_vocab_size - 2)
+        self.one_hot = torch.full((1, tgt_vocab_size), smoothing_value,
+                                  device=device)
+        self.one_hot[0, ignore_index] = 0
+        self.confidence = 1.0 - label_smoothing
+        self.ignore_index = ignore_index
+
+    def __call__(self, output, target):
+        model_prob = self.one_hot.repeat(target.size(0), 1)
+        model_prob.scatter_(1, target.unsqueeze(1), self.confidence)
+        model_prob.masked_fill_((target == self.ignore_index).unsqueeze(1), 0)
+        return F.kl_div(output, model_prob, reduction='sum')
+
+
+def run(criterion, logits, target, steps):
+    """ Time per step, peak memory in bytes (GPU only) and loss. """
+    cuda = logits.is_cuda
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_max_memory_allocated()
+        base = torch.cuda.memory_allocated()
+    start = time.time()
+    for _ in range(steps):
+        logits.grad = None
+        loss = criterion(F.log_softmax(logits, -1), target)
+        loss.backward()
+    if cuda:
+        torch.cuda.synchronize()
+    elapsed = (time.time() - start) / steps
+    peak = torch.cuda.max_memory_allocated() - base if cuda else None
+    return elapsed, peak, loss.item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-tokens', type=int, default=4096)
+    parser.add_argument('-vocab', type=int, default=50000)
+    parser.add_argument('-label_smoothing', type=float, default=0.1)
+    parser.add_argument('-steps', type=int, default=10)
+    parser.add_argument('-gpu', action='store_true')
+    opt = parser.parse_args()
+
+    device = torch.device("cuda" if opt.gpu else "cpu")
+    pad = 1
+    torch.manual_seed(1)
+    logits = torch.randn(opt.tokens, opt.vocab, device=device,
+                         requires_grad=True)
+    target = torch.randint(0, opt.vocab, (opt.tokens,), dtype=torch.long,
+                           device=device)
+    target[::10] = pad
+
+    criterions = [
+        ('dense', DenseLabelSmoothingLoss(
+            opt.label_smoothing, opt.vocab, pad, device)),
+        ('closed form', LabelSmoothingLoss(
+            opt.label_smoothing, opt.vocab, ignore_index=pad))]
+    ref_loss = None
+    for name, criterion in criterions:
+        # warm up
+        run(criterion, logits, target, 1)
+        elapsed, peak, loss = run(criterion, logits, target, opt.steps)
+        if ref_loss is None:
+            ref_loss = loss
+        print("%-12s %8.2f ms/step  peak %s  loss diff %.2e"
+              % (name, 1000 * elapsed,
+                 "%7.1f MB" % (peak / 2 ** 20) if peak is not None
+                 else "n/a (CPU)",
+                 abs(loss - ref_loss) / abs(ref_loss)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay the training batching of preprocessed shards for several
+`-batch_size` / `-pool_factor` settings and report the padding they cause.
+
+Batches are planned with `onmt.inputters.plan_batches`, which gives the
+batches of `OrderedIterator.create_batches` (and `MmapIterator`), shard by
+shard as train.py does. Padding is counted as in the training logs: source
+tokens as is, target tokens with their <eos>.
+
+For each batch size the tool recommends the smallest pool factor whose
+padding is within `-tolerance` points of the best one: larger pools only
+sort more examples together and make batches less random. Among batch sizes
+it recommends the one with the most real tokens per batch, i.e. the best
+tokens/sec as long as the batch fits in memory.
+"""
+import argparse
+import glob
+
+import numpy as np
+import torch
+
+from onmt.inputters.batching import plan_batches, padding_stats
+from onmt.inputters.mmap_dataset import MmapDataset, MMAP_SUFFIX
+
+
+def load_lengths(data, corpus_type):
+    """ Source and target lengths of each shard of `data`. """
+    paths = sorted(glob.glob(data + '.' + corpus_type + '*.pt'))
+    if not paths:
+        paths = sorted(glob.glob(data + '.' + corpus_type + '*' +
+                                 MMAP_SUFFIX))
+    if not paths:
+        raise IOError("No %s shards found for %s" % (corpus_type, data))
+    shards = []
+    for path in paths:
+        if path.endswith(MMAP_SUFFIX):
+            dataset = MmapDataset(path)
+            shards.append((dataset.lengths("src"), dataset.lengths("tgt")))
+        else:
+            dataset = torch.load(path)
+            shards.append((
+                np.array([len(ex.src) for ex in dataset.examples]),
+                np.array([len(ex.tgt) for ex in dataset.examples])))
+        print("%s: %d examples" % (path, len(shards[-1][0])))
+    return shards
+
+
+def replay(shards, batch_size, token_batching, pool_factor, seed):
+    """ Padding statistics of one epoch with these settings. """
+    totals = np.zeros(4, dtype=np.int64)
+    n_batches = 0
+    for j, (src_lens, tgt_lens) in enumerate(shards):
+        batches = plan_batches(src_lens, tgt_lens, batch_size,
+                               token_batching=token_batching,
+                               pool_factor=pool_factor, seed=seed + j)
+        totals += padding_stats(src_lens, tgt_lens, batches)
+        n_batches += len(batches)
+    src_words, src_padded, tgt_words, tgt_padded = totals.tolist()
+    return {
+        'batch_size': batch_size,
+        'pool_factor': pool_factor,
+        'batches': n_batches,
+        'src_pad': 100 * (1 - src_words / max(src_padded, 1)),
+        'tgt_pad': 100 * (1 - tgt_words / max(tgt_padded, 1)),
+        'src_tok': src_padded / max(n_batches, 1),
+        'tgt_tok': tgt_padded / max(n_batches, 1),
+        'words': (src_words + tgt_words) / max(n_batches, 1),
+    }
+
+
+def padding(result):
+    """ Share (%) of padding over both sides. """
+    real = result['words']
+    return 100 * (1 - real / max(result['src_tok'] + result['tgt_tok'], 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-data', required=True,
+                        help="Path prefix of the preprocessed data")
+    parser.add_argument('-corpus_type', default='train',
+                        choices=['train', 'valid'])
+    parser.add_argument('-batch_type', default='sents',
+                        choices=['sents', 'tokens'])
+    parser.add_argument('-batch_sizes', type=int, nargs='+',
+                        default=[64],
+                        help="Batch sizes to try, as for train.py")
+    parser.add_argument('-pool_factors', type=int, nargs='+',
+                        default=[1, 10, 50, 100, 200, 500],
+                        help="Pool factors to try, as for train.py")
+    parser.add_argument('-tolerance', type=float, default=0.5,
+                        help="""Padding points above the best one accepted
+                        for a smaller pool factor""")
+    parser.add_argument('-seed', type=int, default=1)
+    opt = parser.parse_args()
+
+    shards = load_lengths(opt.data, opt.corpus_type)
+    token_batching = opt.batch_type == 'tokens'
+
+    print("%10s %6s %9s %7s %7s %9s %9s %9s"
+          % ('batch_size', 'pool', 'batches', 'src pad', 'tgt pad',
+             'src tok/b', 'tgt tok/b', 'words/b'))
+    best = []
+    for batch_size in opt.batch_sizes:
+        results = []
+        for pool_factor in sorted(opt.pool_factors):
+            r = replay(shards, batch_size, token_batching, pool_factor,
+                       opt.seed)
+            results.append(r)
+            print("%10d %6d %9d %6.2f%% %6.2f%% %9.0f %9.0f %9.0f"
+                  % (batch_size, pool_factor, r['batches'], r['src_pad'],
+                     r['tgt_pad'], r['src_tok'], r['tgt_tok'],
+                     r['words']))
+        lowest = min(padding(r) for r in results)
+        best.append(next(r for r in results
+                         if padding(r) <= lowest + opt.tolerance))
+
+    print()
+    for r in best:
+        print("-batch_size %d: use -pool_factor %d (%.2f%% padding)"
+              % (r['batch_size'], r['pool_factor'], padding(r)))
+    r = max(best, key=lambda r: (r['words'], -padding(r)))
+    print("Recommended: -batch_type %s -batch_size %d -pool_factor %d "
+          "(most real tokens per batch, if it fits in memory)"
+          % (opt.batch_type, r['batch_size'], r['pool_factor']))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,13 +12,14 @@ import onmt.opts as opts
 
 def main(opt):
     translator = build_translator(opt, report_score=True)
-    translator.translate(
-        src=opt.src,
-        tgt=opt.tgt,
-        src_dir=opt.src_dir,
-        batch_size=opt.batch_size,
-        attn_debug=opt.attn_debug
-    )
+    # translations are written to opt.output as they come
+    for _ in translator.translate_iter(
+            src=opt.src,
+            tgt=opt.tgt,
+            src_dir=opt.src_dir,
+            batch_size=opt.batch_size,
+            attn_debug=opt.attn_debug):
+        pass
 
 
 if __name__ == "__main__":